@@ -0,0 +1,98 @@
+"""Comandos de mantenimiento.
+
+Uso (desde Backend/):  python -m app.cli rebuild-saldos
+"""
+
+import argparse
+
+from .db import SessionLocal
+from .services.costing import rebuild_mp_costo
+from .services.costo_ventas import costear_ventas_pendientes
+from .services.espejo import sincronizar
+from .services.hechos import rebuild_hechos
+from .services.inventory import rebuild_inv_saldo
+from .services.totales import rebuild_totales, verificar_totales
+from .services.varianzas import descartar_cache
+
+
+def _rebuild_saldos(db):
+    filas = rebuild_inv_saldo(db)
+    print(f"inv_saldo reconstruido: {filas} filas")
+
+
+def _rebuild_costos(db):
+    filas = rebuild_mp_costo(db)
+    print(f"mp_costo reconstruido: {filas} filas")
+
+
+def _reset_varianzas(db):
+    meses = descartar_cache(db)
+    print(f"cache de varianzas borrada: {meses} meses")
+
+
+def _verificar_totales(db):
+    descuadres = verificar_totales(db)
+    for tabla, filas in descuadres.items():
+        print(f"{tabla}: {len(filas)} cabeceras descuadradas")
+        for f in filas[:20]:
+            print(f"  #{f['id']}: total {f['total_crc']} vs {f['total_detalle']}, lineas {f['lineas']} vs {f['lineas_detalle']}")
+    if any(descuadres.values()):
+        raise SystemExit(1)
+
+
+def _rebuild_totales(db):
+    filas = rebuild_totales(db)
+    print("totales reconstruidos: " + ", ".join(f"{t} {n} filas" for t, n in filas.items()))
+
+
+def _rebuild_hechos(db):
+    filas = rebuild_hechos(db)
+    print("hechos reconstruidos: " + ", ".join(f"{t} {n} filas" for t, n in filas.items()))
+
+
+def _costear_ventas(db):
+    filas = costear_ventas_pendientes(db)
+    print(f"lineas de venta costeadas: {filas}")
+    if filas:
+        _rebuild_hechos(db)
+
+
+def _sync_espejo(db, completo=False):
+    filas = sincronizar(db, completo=completo)
+    print("espejo sincronizado: " + ", ".join(f"{t} {n} filas" for t, n in filas.items()))
+
+
+def _rebuild_espejo(db):
+    _sync_espejo(db, completo=True)
+
+
+COMMANDS = {
+    "rebuild-saldos": _rebuild_saldos,
+    "rebuild-costos": _rebuild_costos,
+    "reset-varianzas": _reset_varianzas,
+    "verificar-totales": _verificar_totales,
+    "rebuild-totales": _rebuild_totales,
+    "rebuild-hechos": _rebuild_hechos,
+    "costear-ventas": _costear_ventas,
+    "sync-espejo": _sync_espejo,
+    "rebuild-espejo": _rebuild_espejo,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="app.cli")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args(argv)
+    db = SessionLocal()
+    try:
+        COMMANDS[args.command](db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -39,5 +39,14 @@ class Settings:
     APP_TITLE = os.getenv("APP_TITLE", "GlutenFree API")
     APP_VERSION = os.getenv("APP_VERSION", "0.1.0")
 
+    # Entradas maximas de la cache de costeo (por proceso)
+    COST_CACHE_SIZE = int(os.getenv("COST_CACHE_SIZE", "512"))
+
+    # Hilos para consultas de reportes en paralelo; cada uno toma una conexion del pool
+    REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "6"))
+
+    # Carpeta del espejo Parquet para /reportes/pivot (`python -m app.cli sync-espejo`)
+    ESPEJO_DIR = os.getenv("ESPEJO_DIR", "espejo")
+
 
 settings = Settings()
@@ -20,6 +20,7 @@ from .routers import (
     reportes,
     rutas,
     vacaciones,
+    export,
 )
 
 app = FastAPI(title="GlutenFree ERP API")
@@ -30,6 +31,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Montar routers
@@ -43,7 +45,7 @@ app.include_router(produccion.router)
 app.include_router(inventario.router)
 app.include_router(finanzas.router)
 app.include_router(costos.router)      # /costos/mp
-app.include_router(costeo.router)      # /costeo/recetas/{id}, /costeo/tandas/{id}
+app.include_router(costeo.router)      # /costeo/recetas, /costeo/recetas/{id}, /costeo/tandas, /costeo/tandas/{id}
 # Importante: registrar primero las rutas de '/planillas/dias' para evitar
 # que el path dinamico '/planillas/{planilla_id}' capture 'dias' como ID.
 app.include_router(planillas_dias.router)
@@ -51,6 +53,7 @@ app.include_router(planilla.router)
 app.include_router(reportes.router)
 app.include_router(rutas.router, prefix="/rutas", tags=["rutas"])
 app.include_router(vacaciones.router, prefix="/vacaciones", tags=["vacaciones"])
+app.include_router(export.router)       # /export/{ventas|compras|inv_mov|planillas|gastos}
 
 # Alias compatibles para costeo
 costeo_alias = APIRouter(prefix="/costeo", tags=["costeo"])
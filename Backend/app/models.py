@@ -88,6 +88,7 @@ class Tanda(Base):
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     fecha = Column(Date, nullable=False)
     receta_id = Column(BigInteger, ForeignKey("receta.id"))
+    cantidad_tandas = Column(Numeric(12, 4), nullable=False, default=1)
     ubicacion_origen_id = Column(BigInteger, ForeignKey("ubicacion.id"))
     ubicacion_destino_id = Column(BigInteger, ForeignKey("ubicacion.id"))
     nota = Column(String(240))
@@ -119,6 +120,8 @@ class Compra(Base):
     condicion_pago = Column(Enum('CONTADO', 'CREDITO', name="cond_pago"), default='CONTADO')
     dias_credito = Column(Integer)
     fecha_limite = Column(Date)
+    total_crc = Column(Numeric(18, 6), nullable=False, default=0)   # triggers sobre el detalle
+    lineas = Column(Integer, nullable=False, default=0)
 
 class CompraDet(Base):
     __tablename__ = "compra_det"
@@ -138,6 +141,8 @@ class Venta(Base):
     condicion_pago = Column(Enum('CONTADO', 'CREDITO', name="cond_pago_venta"), default='CONTADO')
     dias_credito = Column(Integer)
     fecha_limite = Column(Date)
+    total_crc = Column(Numeric(18, 6), nullable=False, default=0)   # triggers sobre el detalle
+    lineas = Column(Integer, nullable=False, default=0)
 
 class VentaDet(Base):
     __tablename__ = "venta_det"
@@ -148,6 +153,7 @@ class VentaDet(Base):
     cantidad = Column(Numeric(18, 6), nullable=False)
     precio_unitario_crc = Column(Numeric(18, 6), nullable=False)
     descuento_crc = Column(Numeric(18, 6), nullable=False, default=0)
+    costo_unitario_crc = Column(Numeric(18, 6))  # costo congelado al vender, por uom de la linea
 
 # =======================
 # Costos indirectos y config
@@ -162,7 +168,7 @@ class CostoIndirecto(Base):
 class ConfigCosteo(Base):
     __tablename__ = "config_costeo"
     id = Column(Integer, primary_key=True, default=1)
-    metodo = Column(Enum('PCT_DIRECTO', 'POR_HORA', 'POR_UNIDAD', name="metodo_costeo"), nullable=False, default='PCT_DIRECTO')
+    metodo = Column(Enum('PCT_DIRECTO', 'POR_HORA', 'POR_UNIDAD', 'PORCENTAJE_GLOBAL', name="metodo_costeo"), nullable=False, default='PCT_DIRECTO')
     parametro_json = Column(JSON, nullable=True)
 
 # app/models.py (añadir al final)
@@ -1,23 +1,35 @@
 
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import text
 
+from ..services.cost_cache import cost_cache
+from ..services import hechos, varianzas
+from ..services.costing import registrar_costos_compra
+from ..services.inventory import insert_inv_mov, insert_inv_movs
 from ..utils.deps import db_dep
+from ..utils.pagination import MAX_LIMIT, Keyset, proyectar
 
 router = APIRouter(prefix="/compras", tags=["compras"])
 
 
 @router.get("")
 def listar_compras(
+    response: Response,
     desde: str | None = Query(None, description="Filtrar fecha >= YYYY-MM-DD"),
     hasta: str | None = Query(None, description="Filtrar fecha <= YYYY-MM-DD"),
     include: List[str] | None = Query(None, description="items, totales"),
+    after: str | None = Query(None, description="cursor de la pagina anterior (header X-Next-Cursor)"),
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = Query(None, description="campos a devolver, separados por coma"),
     db = Depends(db_dep)
 ):
     params: dict[str, object] = {}
     filtros: list[str] = []
+    ks = Keyset([("c.fecha", "fecha", "DESC"), ("c.id", "id", "DESC")], after, limit)
+    if ks.where():
+        filtros.append(ks.where())
     if desde:
         filtros.append("c.fecha >= :desde")
         params["desde"] = desde
@@ -28,49 +40,42 @@ def listar_compras(
     base = """
         SELECT c.id, c.fecha, c.proveedor_id, p.nombre AS proveedor_nombre,
                c.condicion_pago, c.dias_credito, c.moneda, c.nota,
-               COALESCE(ct.total_crc, 0) AS total_crc
+               c.total_crc, c.lineas
         FROM compra c
         LEFT JOIN proveedor p ON p.id = c.proveedor_id
-        LEFT JOIN (
-            SELECT compra_id,
-                   SUM((cantidad * costo_unitario_crc) - COALESCE(descuento_crc, 0)) AS total_crc
-            FROM compra_det
-            GROUP BY compra_id
-        ) ct ON ct.compra_id = c.id
     """
     if filtros:
         base += " WHERE " + " AND ".join(filtros)
-    base += " ORDER BY c.fecha DESC, c.id DESC"
+    base += ks.order_by()
+    params.update(ks.params())
 
-    registros = db.execute(text(base), params).mappings().all()
-    compras = [dict(r) for r in registros]
+    compras = ks.pagina(db.execute(text(base), params).mappings().all(), response)
     include_set = {item.lower() for item in (include or [])}
 
     if compras and "items" in include_set:
-        id_params = {f"id{i}": compra["id"] for i, compra in enumerate(compras)}
-        in_clause = ", ".join(f":id{i}" for i in range(len(id_params)))
-        items_sql = text(f"""
+        items_sql = text("""
             SELECT d.compra_id, d.id, d.producto_id, pr.nombre AS producto_nombre,
                    d.uom_id, u.nombre AS uom_nombre,
                    d.cantidad, d.costo_unitario_crc, d.descuento_crc
             FROM compra_det d
             LEFT JOIN producto pr ON pr.id = d.producto_id
             LEFT JOIN uom u ON u.id = d.uom_id
-            WHERE d.compra_id IN ({in_clause})
+            WHERE d.compra_id IN :ids
             ORDER BY d.compra_id, d.id
         """)
-        items = db.execute(items_sql, id_params).mappings().all()
+        items = db.execute(items_sql, {"ids": tuple(r["id"] for r in compras)}).mappings().all()
         items_by: dict[int, list[dict]] = {}
         for it in items:
             items_by.setdefault(it["compra_id"], []).append(dict(it))
         for compra in compras:
             compra["items"] = items_by.get(compra["id"], [])
 
-    return compras
+    return proyectar(compras, fields)
 
 
-@router.post("")
-def crear_compra(payload: dict, db = Depends(db_dep)):
+def _compra_doc(payload: dict) -> tuple[dict, list[dict]]:
+    if not isinstance(payload, dict):
+        raise HTTPException(400, "cada compra debe ser un objeto")
     data = {
         "fecha": payload.get("fecha"),
         "proveedor_id": payload.get("proveedor_id"),
@@ -81,12 +86,81 @@ def crear_compra(payload: dict, db = Depends(db_dep)):
     }
     if not data["fecha"] or not data["proveedor_id"]:
         raise HTTPException(400, "fecha y proveedor_id son obligatorios")
-    res = db.execute(text("""
-        INSERT INTO compra (fecha, proveedor_id, condicion_pago, dias_credito, moneda, nota)
-        VALUES (:fecha, :proveedor_id, :condicion_pago, :dias_credito, :moneda, :nota)
-    """), data)
+    items = []
+    if not isinstance(payload.get("items") or [], list):
+        raise HTTPException(400, "items debe ser una lista")
+    for it in payload.get("items") or []:
+        if not isinstance(it, dict):
+            raise HTTPException(400, "cada item debe ser un objeto")
+        try:
+            item = {
+                "producto_id": it.get("producto_id"),
+                "uom_id": it.get("uom_id"),
+                "cantidad": float(it.get("cantidad") or 0),
+                "costo_unitario_crc": float(it.get("costo_unitario_crc") or 0),
+                "descuento_crc": float(it.get("descuento_crc") or 0),
+            }
+        except (TypeError, ValueError):
+            raise HTTPException(400, "cantidad, costo_unitario_crc y descuento_crc deben ser numericos")
+        if not item["producto_id"] or not item["uom_id"] or item["cantidad"] <= 0:
+            raise HTTPException(400, "producto_id, uom_id y cantidad > 0 requeridos en cada item")
+        items.append(item)
+    return data, items
+
+
+@router.post("")
+def crear_compra(payload: dict, db = Depends(db_dep)):
+    """Crea una compra, o un lote {"compras": [...]} (p. ej. el estado de cuenta mensual de un proveedor).
+
+    Cada documento acepta items: detalle, kardex y mp_costo se escriben con inserts
+    multi-fila en la misma transaccion que los encabezados.
+    """
+    lote = "compras" in payload
+    if lote and not isinstance(payload["compras"], list):
+        raise HTTPException(400, "compras debe ser una lista")
+    docs = [_compra_doc(d) for d in (payload["compras"] if lote else [payload])]
+    if not docs:
+        raise HTTPException(400, "compras vacio")
+
+    ids, detalle = [], []
+    for data, items in docs:
+        res = db.execute(text("""
+            INSERT INTO compra (fecha, proveedor_id, condicion_pago, dias_credito, moneda, nota)
+            VALUES (:fecha, :proveedor_id, :condicion_pago, :dias_credito, :moneda, :nota)
+        """), data)
+        ids.append(res.lastrowid)
+        detalle += [{"compra_id": res.lastrowid, **it} for it in items]
+    if detalle:
+        db.execute(text("""
+            INSERT INTO compra_det (compra_id, producto_id, uom_id, cantidad, costo_unitario_crc, descuento_crc)
+            VALUES (:compra_id, :producto_id, :uom_id, :cantidad, :costo_unitario_crc, :descuento_crc)
+        """), detalle)
+        # ids de detalle para mp_costo (desempate del ultimo costo); las compras son nuevas
+        lineas = db.execute(text("""
+            SELECT d.id AS det_id, d.compra_id, d.producto_id, d.uom_id, d.cantidad,
+                   d.costo_unitario_crc, d.descuento_crc, c.fecha
+            FROM compra_det d
+            JOIN compra c ON c.id = d.compra_id
+            WHERE d.compra_id IN :ids
+            ORDER BY d.id
+        """), {"ids": tuple(ids)}).mappings().all()
+        registrar_costos_compra(db, lineas)
+        insert_inv_movs(db, [dict(
+            fecha=ln["fecha"], producto_id=ln["producto_id"], uom_id=ln["uom_id"], tipo="IN",
+            cantidad=ln["cantidad"], motivo="COMPRA", ref_tabla="compra", ref_id=ln["compra_id"],
+            costo_unitario_crc=ln["costo_unitario_crc"],
+        ) for ln in lineas])
+        # una compra con fecha pasada cambia el costo historico de los meses de varianza ya guardados
+        varianzas.descartar_productos(db, {ln["producto_id"] for ln in lineas}, desde=min(ln["fecha"] for ln in lineas))
+    hechos.registrar_compras(db, [dict(data, items=items) for data, items in docs])
     db.commit()
-    return {"id": res.lastrowid}
+    if detalle:
+        cost_cache.invalidate(*{("mp", int(d["producto_id"])) for d in detalle})
+
+    total = sum(d["cantidad"] * d["costo_unitario_crc"] - d["descuento_crc"] for d in detalle)
+    if lote:
+        return {"ids": ids, "items": len(detalle), "total_crc": total}
+    return {"id": ids[0], "items": len(detalle), "total_crc": total}
 
 
 @router.post("/{compra_id}/items")
@@ -101,24 +175,27 @@ def agregar_item(compra_id: int, payload: dict, db = Depends(db_dep)):
     }
     if not data["producto_id"]:
         raise HTTPException(400, "producto_id requerido")
+    compra = db.execute(text("SELECT fecha, proveedor_id FROM compra WHERE id = :id"), {"id": compra_id}).mappings().first()
+    if not compra:
+        raise HTTPException(404, "compra no encontrada")
     det = db.execute(text("""
         INSERT INTO compra_det (compra_id, producto_id, uom_id, cantidad, costo_unitario_crc, descuento_crc)
         VALUES (:compra_id, :producto_id, :uom_id, :cantidad, :costo_unitario_crc, :descuento_crc)
     """), data)
-    db.execute(text("""
-        INSERT INTO inv_mov (fecha, producto_id, uom_id, cantidad, tipo, motivo, ref_tabla, ref_id, costo_unitario_crc)
-        SELECT c.fecha, d.producto_id, d.uom_id, d.cantidad, 'IN', 'COMPRA', 'compra', d.compra_id, d.costo_unitario_crc
-        FROM compra c JOIN compra_det d ON d.compra_id = c.id
-        WHERE d.id = :det_id
-    """), {"det_id": det.lastrowid})
+    registrar_costos_compra(db, [{**data, "det_id": det.lastrowid, "fecha": compra["fecha"]}])
+    insert_inv_mov(
+        db, fecha=compra["fecha"], producto_id=data["producto_id"], uom_id=data["uom_id"],
+        tipo="IN", cantidad=data["cantidad"], motivo="COMPRA", ref_tabla="compra", ref_id=compra_id,
+        costo_unitario_crc=data["costo_unitario_crc"],
+    )
+    hechos.registrar_compras(db, [{**compra, "nuevo": False, "items": [data]}])
+    varianzas.descartar_productos(db, [data["producto_id"]], desde=compra["fecha"])
     db.commit()
+    cost_cache.invalidate(("mp", int(data["producto_id"])))
     return {"ok": True}
 
 
 @router.get("/{compra_id}/totales")
 def totales(compra_id: int, db = Depends(db_dep)):
-    row = db.execute(text("""
-        SELECT SUM(cantidad * costo_unitario_crc - COALESCE(descuento_crc, 0)) AS total_crc
-        FROM compra_det WHERE compra_id = :id
-    """), {"id": compra_id}).mappings().first()
-    return row or {"total_crc": 0}
+    row = db.execute(text("SELECT total_crc, lineas FROM compra WHERE id = :id"), {"id": compra_id}).mappings().first()
+    return row or {"total_crc": 0, "lineas": 0}
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
 from ..utils.deps import db_dep
+from ..utils.pagination import MAX_LIMIT, Keyset, proyectar
 
 
 
@@ -12,14 +13,25 @@ def _normalize_bool(value, default=None):
 router = APIRouter(prefix="/contactos", tags=["contactos"])
 
 @router.get("/clientes")
-def list_clientes(q: str | None = Query(None), db = Depends(db_dep)):
+def list_clientes(
+    response: Response,
+    q: str | None = Query(None),
+    after: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = None,
+    db = Depends(db_dep),
+):
+    ks = Keyset([("nombre", "nombre", "ASC"), ("id", "id", "ASC")], after, limit)
     base = "SELECT id, nombre, num_doc, telefono, email, direccion, activo FROM cliente WHERE 1=1"
     params = {}
     if q:
         base += " AND (nombre LIKE :q OR num_doc LIKE :q)"
         params["q"] = f"%{q}%"
-    base += " ORDER BY nombre"
-    return db.execute(text(base), params).mappings().all()
+    if ks.where():
+        base += " AND " + ks.where()
+    base += ks.order_by()
+    params.update(ks.params())
+    return proyectar(ks.pagina(db.execute(text(base), params).mappings().all(), response), fields)
 
 @router.post("/clientes")
 def create_cliente(payload: dict, db = Depends(db_dep)):
@@ -42,14 +54,25 @@ def create_cliente(payload: dict, db = Depends(db_dep)):
     return db.execute(text("SELECT * FROM cliente WHERE id=:id"), {"id": res.lastrowid}).mappings().first()
 
 @router.get("/proveedores")
-def list_proveedores(q: str | None = Query(None), db = Depends(db_dep)):
+def list_proveedores(
+    response: Response,
+    q: str | None = Query(None),
+    after: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = None,
+    db = Depends(db_dep),
+):
+    ks = Keyset([("nombre", "nombre", "ASC"), ("id", "id", "ASC")], after, limit)
     base = "SELECT id, nombre, num_doc, telefono, email, direccion, activo FROM proveedor WHERE 1=1"
     params = {}
     if q:
         base += " AND (nombre LIKE :q OR num_doc LIKE :q)"
         params["q"] = f"%{q}%"
-    base += " ORDER BY nombre"
-    return db.execute(text(base), params).mappings().all()
+    if ks.where():
+        base += " AND " + ks.where()
+    base += ks.order_by()
+    params.update(ks.params())
+    return proyectar(ks.pagina(db.execute(text(base), params).mappings().all(), response), fields)
 
 @router.post("/proveedores")
 def create_proveedor(payload: dict, db = Depends(db_dep)):
@@ -71,14 +94,25 @@ def create_proveedor(payload: dict, db = Depends(db_dep)):
     return db.execute(text("SELECT * FROM proveedor WHERE id=:id"), {"id": res.lastrowid}).mappings().first()
 
 @router.get("/empleados")
-def list_empleados(q: str | None = Query(None), db = Depends(db_dep)):
+def list_empleados(
+    response: Response,
+    q: str | None = Query(None),
+    after: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = None,
+    db = Depends(db_dep),
+):
+    ks = Keyset([("nombre", "nombre", "ASC"), ("id", "id", "ASC")], after, limit)
     base = "SELECT id, nombre, num_doc, telefono, email, direccion, activo, tarifa_hora_crc FROM empleado WHERE 1=1"
     params = {}
     if q:
         base += " AND (nombre LIKE :q OR num_doc LIKE :q)"
         params["q"] = f"%{q}%"
-    base += " ORDER BY nombre"
-    return db.execute(text(base), params).mappings().all()
+    if ks.where():
+        base += " AND " + ks.where()
+    base += ks.order_by()
+    params.update(ks.params())
+    return proyectar(ks.pagina(db.execute(text(base), params).mappings().all(), response), fields)
 
 @router.post("/empleados")
 def create_empleado(payload: dict, db = Depends(db_dep)):
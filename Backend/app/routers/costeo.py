@@ -1,12 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import text
+from ..services.cost_cache import cost_cache
+from ..services.costing import CicloRecetasError, costear_recetas, costear_tandas
+from ..services.simulacion import simular
 from ..utils.deps import db_dep
 
 router = APIRouter(prefix="/costeo", tags=["costeo"])
 
-def _cfg_pct(db):
-    row = db.execute(text("SELECT pct FROM config_costeo LIMIT 1")).mappings().first()
-    return float(row["pct"]) if row else 0.0
+@router.get("/recetas")
+def costear_recetas_bulk(
+    ids: str = Query("", description="ids de receta separados por coma"),
+    producto_salida_id: int | None = Query(None),
+    pct_ind: float | None = Query(None),
+    db = Depends(db_dep),
+):
+    id_list = [int(x) for x in ids.split(",") if x.strip().isdigit()]
+    try:
+        res = costear_recetas(
+            db,
+            receta_ids=id_list or None,
+            producto_salida_id=producto_salida_id,
+            pct_ind=pct_ind,
+        )
+    except CicloRecetasError as e:
+        raise HTTPException(409, str(e))
+    return list(res.values())
 
 @router.get("/recetas/{receta_id}")
 def costear_receta(
@@ -15,108 +33,69 @@ def costear_receta(
     pct_ind: float | None = Query(None),
     db = Depends(db_dep),
 ):
-    ings = db.execute(text("""
-        SELECT i.producto_id, p.nombre, i.uom_id, i.cantidad
-        FROM receta_det i
-        JOIN producto p ON p.id = i.producto_id
-        WHERE i.receta_id = :id
-    """), {"id": receta_id}).mappings().all()
-    if not ings:
+    try:
+        res = costear_recetas(db, receta_ids=[receta_id], pct_ind=pct_ind, rendimiento=rendimiento)
+    except CicloRecetasError as e:
+        raise HTTPException(409, str(e))
+    if receta_id not in res:
         raise HTTPException(404, "receta sin ingredientes")
+    return res[receta_id]
 
-    ids = tuple({int(r["producto_id"]) for r in ings})
-    cost_map = {}
-    if ids:
-        q = text("""
-            SELECT d.producto_id AS id,
-                   (SELECT d2.costo_unitario_crc
-                    FROM compra_det d2
-                    JOIN compra c2 ON c2.id = d2.compra_id
-                    WHERE d2.producto_id = d.producto_id
-                    ORDER BY c2.fecha DESC, d2.id DESC
-                    LIMIT 1) AS costo_unitario_crc
-            FROM (SELECT DISTINCT producto_id FROM compra_det WHERE producto_id IN :ids) d
-        """)
-        for r in db.execute(q, {"ids": ids}).mappings().all():
-            cost_map[int(r["id"])] = float(r["costo_unitario_crc"] or 0)
+@router.post("/simulacion")
+def simulacion(payload: dict, db = Depends(db_dep)):
+    """Efecto de shocks de precio de MP sobre el unitario y margen de todas las recetas.
 
-    rows, directo = [], 0.0
-    for it in ings:
-        unit = float(cost_map.get(int(it["producto_id"]), 0))
-        total = unit * float(it["cantidad"] or 0)
-        rows.append({
-            "producto_id": it["producto_id"], "nombre": it["nombre"],
-            "cantidad": it["cantidad"], "costo_unitario_crc": unit, "costo_total_crc": total
-        })
-        directo += total
+    payload: {"shocks": [{"producto_id", "pct"?, "delta_crc"?}], "pct_ind"?}
+    """
+    shocks = payload.get("shocks") or []
+    for s in shocks:
+        if not s.get("producto_id"):
+            raise HTTPException(400, "producto_id requerido en cada shock")
+    try:
+        return simular(db, shocks, pct_ind=payload.get("pct_ind"))
+    except CicloRecetasError as e:
+        raise HTTPException(409, str(e))
+    except (TypeError, ValueError):
+        raise HTTPException(400, "pct, delta_crc y pct_ind deben ser numericos")
 
-    if pct_ind is None:
-        pct_ind = _cfg_pct(db)
-    indirecto = directo * float(pct_ind or 0)
-    total = directo + indirecto
+@router.get("/cache")
+def cache_stats():
+    return cost_cache.stats()
 
-    if not rendimiento:
-        outs = db.execute(text("SELECT SUM(rendimiento) AS rend FROM receta_salida WHERE receta_id=:id"), {"id": receta_id}).mappings().first()
-        rendimiento = float(outs["rend"] or 0)
-    unitario = (total / rendimiento) if (rendimiento and rendimiento > 0) else None
+@router.delete("/cache")
+def cache_clear():
+    cost_cache.clear()
+    return {"ok": True}
 
+@router.get("/tandas")
+def costear_tandas_rango(
+    desde: str | None = Query(None, description="Filtrar fecha >= YYYY-MM-DD"),
+    hasta: str | None = Query(None, description="Filtrar fecha <= YYYY-MM-DD"),
+    db = Depends(db_dep),
+):
+    where, params = [], {}
+    if desde:
+        where.append("fecha >= :desde")
+        params["desde"] = desde
+    if hasta:
+        where.append("fecha <= :hasta")
+        params["hasta"] = hasta
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    tandas = db.execute(text(f"""
+        SELECT id, fecha FROM tanda {where_sql} ORDER BY fecha, id
+    """), params).mappings().all()
+    res = costear_tandas(db, (t["id"] for t in tandas))
+    items = [{"fecha": t["fecha"], **res[int(t["id"])]} for t in tandas]
     return {
-        "ingredientes": rows,
-        "costo_directo_crc": directo,
-        "costo_indirecto_crc": indirecto,
-        "costo_total_crc": total,
-        "rendimiento": rendimiento,
-        "unitario_crc": unitario,
+        "items": items,
+        "costo_directo_crc": sum(i["costo_directo_crc"] for i in items),
+        "costo_indirecto_crc": sum(i["costo_indirecto_crc"] for i in items),
+        "costo_total_crc": sum(i["costo_total_crc"] for i in items),
     }
 
 @router.get("/tandas/{tanda_id}")
 def costear_tanda(tanda_id: int, db = Depends(db_dep)):
-    cons = db.execute(text("""
-        SELECT producto_id, SUM(cantidad) AS cantidad
-        FROM tanda_consumo WHERE tanda_id=:id
-        GROUP BY producto_id
-    """), {"id": tanda_id}).mappings().all()
-    if not cons:
-        return {"costo_directo_crc": 0, "costo_indirecto_crc": 0, "costo_total_crc": 0, "unitario_crc": None, "consumos": []}
-
-    ids = tuple({int(r["producto_id"]) for r in cons})
-    cost_map = {}
-    if ids:
-        q = text("""
-            SELECT d.producto_id AS id,
-                   (SELECT d2.costo_unitario_crc
-                    FROM compra_det d2
-                    JOIN compra c2 ON c2.id = d2.compra_id
-                    WHERE d2.producto_id = d.producto_id
-                    ORDER BY c2.fecha DESC, d2.id DESC
-                    LIMIT 1) AS costo_unitario_crc
-            FROM (SELECT DISTINCT producto_id FROM compra_det WHERE producto_id IN :ids) d
-        """)
-        for r in db.execute(q, {"ids": ids}).mappings().all():
-            cost_map[int(r["id"])] = float(r["costo_unitario_crc"] or 0)
-
-    rows, directo = [], 0.0
-    for it in cons:
-        unit = float(cost_map.get(int(it["producto_id"]), 0))
-        total = unit * float(it["cantidad"] or 0)
-        nombre = db.execute(text("SELECT nombre FROM producto WHERE id=:id"), {"id": it["producto_id"]}).scalar() or f"#{it['producto_id']}"
-        rows.append({
-            "producto_id": it["producto_id"], "nombre": nombre,
-            "cantidad": it["cantidad"], "costo_unitario_crc": unit, "costo_total_crc": total
-        })
-        directo += total
-
-    pct = _cfg_pct(db)
-    indirecto = directo * pct
-    total = directo + indirecto
-
-    outs = db.execute(text("SELECT SUM(cantidad) FROM tanda_salida WHERE tanda_id=:id"), {"id": tanda_id}).scalar()
-    unitario = (total / float(outs)) if outs else None
-
-    return {
-        "consumos": rows,
-        "costo_directo_crc": directo,
-        "costo_indirecto_crc": indirecto,
-        "costo_total_crc": total,
-        "unitario_crc": unitario,
-    }
+    res = costear_tandas(db, [tanda_id])
+    if tanda_id not in res:
+        raise HTTPException(404, "tanda no encontrada")
+    return res[tanda_id]
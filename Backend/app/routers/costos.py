@@ -1,5 +1,8 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy import text
+from fastapi import APIRouter, Depends, HTTPException, Query
+from ..services.cost_cache import cost_cache
+from ..services.cost_history import cargar_historial
+from ..services.costing import costos_ultimos, rebuild_mp_costo
+from ..services.uom import conversor
 from ..utils.deps import db_dep
 
 router = APIRouter(prefix="/costos", tags=["costos"])
@@ -9,16 +12,38 @@ def costos_mp(ids: str = Query(""), db = Depends(db_dep)):
     id_list = [int(x) for x in ids.split(",") if x.strip().isdigit()]
     if not id_list:
         return {}
-    rows = db.execute(text("""
-        SELECT d.producto_id AS id,
-               COALESCE((
-                 SELECT d2.costo_unitario_crc
-                 FROM compra_det d2
-                 JOIN compra c2 ON c2.id = d2.compra_id
-                 WHERE d2.producto_id = d.producto_id
-                 ORDER BY c2.fecha DESC, d2.id DESC
-                 LIMIT 1
-               ), 0) AS costo_unitario_crc
-        FROM (SELECT DISTINCT producto_id FROM compra_det WHERE producto_id IN :ids) d
-    """), {"ids": tuple(id_list)}).mappings().all()
-    return {str(r["id"]): float(r["costo_unitario_crc"] or 0) for r in rows}
+    return {str(k): v for k, v in costos_ultimos(db, id_list).items()}
+
+@router.post("/mp/historico")
+def costos_mp_historico(payload: dict, db = Depends(db_dep)):
+    """Valoriza filas {producto_id, fecha, uom_id?, cantidad?} al costo de compra vigente en cada fecha.
+
+    Sin uom_id el costo y la cantidad se toman en la uom base del producto.
+    """
+    items = payload.get("items") or []
+    for it in items:
+        if not it.get("producto_id") or not it.get("fecha"):
+            raise HTTPException(400, "producto_id y fecha requeridos en cada item")
+    hist = cargar_historial(db, (it["producto_id"] for it in items))
+    try:
+        costos = hist.valorar(items)
+    except ValueError:
+        raise HTTPException(400, "fecha invalida (use YYYY-MM-DD)")
+    conv = conversor(db)
+    out, total = [], 0.0
+    for it, unit_base in zip(items, costos):
+        unit = unit_base * conv.factor(it["producto_id"], it.get("uom_id"))
+        row = {"producto_id": it["producto_id"], "fecha": it["fecha"], "uom_id": it.get("uom_id"), "costo_unitario_crc": unit}
+        if it.get("cantidad") is not None:
+            row["cantidad"] = it["cantidad"]
+            row["costo_total_crc"] = unit * float(it["cantidad"] or 0)
+            total += row["costo_total_crc"]
+        out.append(row)
+    return {"items": out, "costo_total_crc": total}
+
+@router.post("/mp/rebuild")
+def costos_mp_rebuild(db = Depends(db_dep)):
+    filas = rebuild_mp_costo(db)
+    db.commit()
+    cost_cache.clear()
+    return {"ok": True, "filas": filas}
@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+from datetime import date, timedelta
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+
+from ..db import SessionLocal
+from .planilla import FACTOR_DOBLE_DEFAULT, FACTOR_EXTRA_DEFAULT, FACTOR_FERIADO_DEFAULT
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+# Filas leidas del cursor del servidor por bloque
+LOTE = 1000
+
+# entidad -> (SELECT ... FROM ..., columna de fecha para desde/hasta, ORDER BY)
+_CONSULTAS = {
+    "ventas": ("""
+        SELECT v.id AS venta_id, v.codigo_factura, v.fecha, v.cliente_id, c.nombre AS cliente_nombre,
+               v.condicion_pago, v.estado_cobro_pago, d.id AS det_id, d.producto_id, p.sku,
+               p.nombre AS producto_nombre, u.nombre AS uom_nombre, d.cantidad, d.precio_unitario_crc,
+               d.descuento_crc, d.cantidad * d.precio_unitario_crc - d.descuento_crc AS subtotal_crc
+        FROM venta v
+        JOIN venta_det d ON d.venta_id = v.id
+        LEFT JOIN cliente c ON c.id = v.cliente_id
+        LEFT JOIN producto p ON p.id = d.producto_id
+        LEFT JOIN uom u ON u.id = d.uom_id
+    """, "v.fecha", "v.fecha, v.id, d.id"),
+    "compras": ("""
+        SELECT c.id AS compra_id, c.fecha, c.proveedor_id, pr.nombre AS proveedor_nombre,
+               c.condicion_pago, c.estado_cobro_pago, d.id AS det_id, d.producto_id, p.sku,
+               p.nombre AS producto_nombre, u.nombre AS uom_nombre, d.cantidad, d.costo_unitario_crc,
+               d.descuento_crc, d.cantidad * d.costo_unitario_crc - d.descuento_crc AS subtotal_crc
+        FROM compra c
+        JOIN compra_det d ON d.compra_id = c.id
+        LEFT JOIN proveedor pr ON pr.id = c.proveedor_id
+        LEFT JOIN producto p ON p.id = d.producto_id
+        LEFT JOIN uom u ON u.id = d.uom_id
+    """, "c.fecha", "c.fecha, c.id, d.id"),
+    "inv_mov": ("""
+        SELECT m.id, m.fecha, m.tipo, m.motivo, m.producto_id, p.sku, p.nombre AS producto_nombre,
+               u.nombre AS uom_nombre, m.cantidad, m.costo_unitario_crc, m.ubicacion_id,
+               m.ref_tabla, m.ref_id, m.nota
+        FROM inv_mov m
+        LEFT JOIN producto p ON p.id = m.producto_id
+        LEFT JOIN uom u ON u.id = m.uom_id
+    """, "m.fecha", "m.fecha, m.id"),
+    "planillas": (f"""
+        SELECT ps.id AS planilla_id, ps.semana_inicio, dd.fecha, d.id AS det_id, d.empleado_id,
+               COALESCE(e.nombre, d.persona) AS empleado_nombre, d.rol, d.tarifa_hora_crc,
+               dd.horas_reg, dd.horas_extra, dd.horas_doble, dd.horas_feriado,
+               d.tarifa_hora_crc * (dd.horas_reg
+                   + COALESCE(ps.factor_extra, {FACTOR_EXTRA_DEFAULT}) * dd.horas_extra
+                   + COALESCE(ps.factor_doble, {FACTOR_DOBLE_DEFAULT}) * dd.horas_doble
+                   + COALESCE(ps.factor_feriado, {FACTOR_FERIADO_DEFAULT}) * dd.horas_feriado) AS monto_crc
+        FROM planilla_det_dia dd
+        JOIN planilla_det d ON d.id = dd.det_id
+        JOIN planilla_semana ps ON ps.id = d.planilla_id
+        LEFT JOIN empleado e ON e.id = d.empleado_id
+    """, "dd.fecha", "dd.fecha, d.id"),
+    "gastos": ("""
+        SELECT g.id, g.fecha, g.categoria_id, cg.nombre AS categoria, g.monto_crc, g.metodo_pago,
+               g.proveedor_id, pr.nombre AS proveedor_nombre, g.nota
+        FROM gasto g
+        LEFT JOIN categoria_gasto cg ON cg.id = g.categoria_id
+        LEFT JOIN proveedor pr ON pr.id = g.proveedor_id
+    """, "g.fecha", "g.fecha, g.id"),
+}
+
+
+def _filas(sql: str, params: dict, formato: str):
+    """Genera el archivo por bloques leyendo con cursor del servidor.
+
+    La sesion se abre aqui y no con db_dep: FastAPI cierra las dependencias antes
+    de enviar la respuesta, y el cursor debe vivir mientras se transmite.
+    """
+    with SessionLocal() as db:
+        res = db.execute(text(sql), params, execution_options={"stream_results": True, "yield_per": LOTE})
+        columnas = list(res.keys())
+        buf = io.StringIO()
+        escritor = csv.writer(buf)
+        if formato == "csv":
+            escritor.writerow(columnas)
+            yield buf.getvalue()
+        for bloque in res.partitions():
+            buf.seek(0)
+            buf.truncate()
+            if formato == "csv":
+                escritor.writerows(bloque)
+            else:
+                for fila in bloque:
+                    buf.write(json.dumps(dict(zip(columnas, fila)), default=str) + "\n")
+            yield buf.getvalue()
+
+
+@router.get("/{entidad}")
+def exportar(
+    entidad: str,
+    formato: str = Query("csv", pattern="^(csv|ndjson)$"),
+    desde: date | None = Query(None, description="fecha >= YYYY-MM-DD"),
+    hasta: date | None = Query(None, description="fecha <= YYYY-MM-DD"),
+):
+    if entidad not in _CONSULTAS:
+        raise HTTPException(404, f"entidad no exportable; use una de: {', '.join(_CONSULTAS)}")
+    if desde and hasta and hasta < desde:
+        raise HTTPException(400, "hasta debe ser >= desde")
+    sql, col_fecha, orden = _CONSULTAS[entidad]
+    params: dict[str, object] = {}
+    filtros: list[str] = []
+    if desde:
+        filtros.append(f"{col_fecha} >= :desde")
+        params["desde"] = desde
+    if hasta:
+        filtros.append(f"{col_fecha} < :hasta")
+        params["hasta"] = hasta + timedelta(days=1)
+    if filtros:
+        sql += " WHERE " + " AND ".join(filtros)
+    sql += f" ORDER BY {orden}"
+
+    nombre = "_".join([entidad] + [x.isoformat() for x in (desde, hasta) if x]) + "." + formato
+    media = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _filas(sql, params, formato),
+        media_type=media,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
@@ -1,65 +1,119 @@
-from fastapi import APIRouter, Depends
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import text
+from ..services import hechos, overhead
+from ..services.cost_cache import cost_cache
 from ..utils.deps import db_dep
+from ..utils.pagination import MAX_LIMIT, Keyset, proyectar
 
 router = APIRouter(prefix="/finanzas", tags=["finanzas"])
 
 @router.get("/cxc")
-def cxc(db = Depends(db_dep)):
-    return db.execute(text("""
+def cxc(
+    response: Response,
+    after: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = None,
+    db = Depends(db_dep),
+):
+    ks = Keyset([("v.fecha", "fecha", "DESC"), ("v.id", "venta_id", "DESC")], after, limit)
+    sql = """
         SELECT v.id AS venta_id, v.fecha,
                DATE_ADD(v.fecha, INTERVAL COALESCE(v.dias_credito,0) DAY) AS fecha_limite,
-               SUM(d.cantidad*d.precio_unitario_crc - COALESCE(d.descuento_crc,0)) AS total_crc,
+               v.total_crc,
                0 AS cobrado_crc,
-               SUM(d.cantidad*d.precio_unitario_crc - COALESCE(d.descuento_crc,0)) AS saldo_crc,
+               v.total_crc AS saldo_crc,
                DATEDIFF(CURDATE(), DATE_ADD(v.fecha, INTERVAL COALESCE(v.dias_credito,0) DAY)) AS dias_vencido
         FROM venta v
-        LEFT JOIN venta_det d ON d.venta_id = v.id
-        GROUP BY v.id
-        ORDER BY v.fecha DESC
-    """)).mappings().all()
+    """
+    if ks.where():
+        sql += " WHERE " + ks.where()
+    sql += ks.order_by()
+    rows = db.execute(text(sql), ks.params()).mappings().all()
+    return proyectar(ks.pagina(rows, response), fields)
 
 @router.get("/cxp")
-def cxp(db = Depends(db_dep)):
-    return db.execute(text("""
+def cxp(
+    response: Response,
+    after: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = None,
+    db = Depends(db_dep),
+):
+    ks = Keyset([("c.fecha", "fecha", "DESC"), ("c.id", "compra_id", "DESC")], after, limit)
+    sql = """
         SELECT c.id AS compra_id, c.fecha,
                DATE_ADD(c.fecha, INTERVAL COALESCE(c.dias_credito,0) DAY) AS fecha_limite,
-               SUM(d.cantidad*d.costo_unitario_crc - COALESCE(d.descuento_crc,0)) AS total_crc,
+               c.total_crc,
                0 AS pagado_crc,
-               SUM(d.cantidad*d.costo_unitario_crc - COALESCE(d.descuento_crc,0)) AS saldo_crc,
+               c.total_crc AS saldo_crc,
                DATEDIFF(CURDATE(), DATE_ADD(c.fecha, INTERVAL COALESCE(c.dias_credito,0) DAY)) AS dias_vencido
         FROM compra c
-        LEFT JOIN compra_det d ON d.compra_id = c.id
-        GROUP BY c.id
-        ORDER BY c.fecha DESC
-    """)).mappings().all()
+    """
+    if ks.where():
+        sql += " WHERE " + ks.where()
+    sql += ks.order_by()
+    rows = db.execute(text(sql), ks.params()).mappings().all()
+    return proyectar(ks.pagina(rows, response), fields)
 
 @router.get("/config/indirectos")
 def get_cfg(db = Depends(db_dep)):
-    # Compatibilidad: tabla config_costeo con columnas (metodo, parametro_json) {pct}
-    row = db.execute(text("SELECT metodo, parametro_json FROM config_costeo WHERE id=1")).mappings().first()
-    if not row:
-        return {"method":"PORCENTAJE_GLOBAL", "pct": 0.0}
-    metodo = row.get("metodo") or "PORCENTAJE_GLOBAL"
-    pj = row.get("parametro_json") or {}
-    try:
-        pct = float((pj or {}).get("pct", 0))
-    except Exception:
-        pct = 0.0
-    return {"method": metodo, "pct": pct}
+    # Compatibilidad: tabla config_costeo con columnas (metodo, parametro_json) {pct, tarifa_h, tarifa_unidad}
+    row = db.execute(text("SELECT metodo FROM config_costeo WHERE id=1")).mappings().first()
+    cfg = overhead.config_indirectos(db)
+    metodo = (row and row.get("metodo")) or "PORCENTAJE_GLOBAL"
+    return {
+        "method": metodo,
+        "pct": cfg["pct"],
+        "tarifa_h": cfg["tarifa_h"],
+        "tarifa_unidad": cfg["tarifa_unidad"],
+    }
 
 @router.put("/config/indirectos")
 def set_cfg(payload: dict, db = Depends(db_dep)):
-    metodo = payload.get("method") or "PORCENTAJE_GLOBAL"
-    pct = float(payload.get("pct") or 0)
+    # PORCENTAJE_GLOBAL (legado) = PCT_DIRECTO; sin parametro fijo (null) la tasa se calcula del pool del mes.
+    # Se mezcla con lo guardado: un parametro que no viene en el payload se conserva.
+    row = db.execute(text("SELECT metodo, parametro_json FROM config_costeo WHERE id=1")).mappings().first()
+    params = (row and row["parametro_json"]) or {}
+    if isinstance(params, (str, bytes)):
+        try:
+            params = json.loads(params)
+        except ValueError:
+            params = {}
+    metodo = payload.get("method") or (row and row["metodo"]) or "PORCENTAJE_GLOBAL"
+    if metodo not in ("PORCENTAJE_GLOBAL",) + overhead.METODOS:
+        raise HTTPException(400, "method invalido (PORCENTAJE_GLOBAL, PCT_DIRECTO, POR_HORA, POR_UNIDAD)")
+    if "pct" in payload:
+        params.pop("porcentaje", None)
+    for k in ("pct", "tarifa_h", "tarifa_unidad"):
+        if k not in payload:
+            continue
+        v = payload[k]
+        if v is None or v == "":
+            params[k] = None
+            continue
+        try:
+            params[k] = float(v)
+        except (TypeError, ValueError):
+            raise HTTPException(400, f"{k} debe ser numerico")
     db.execute(text("""
         INSERT INTO config_costeo (id, metodo, parametro_json)
-        VALUES (1, :metodo, JSON_OBJECT('pct', :pct))
+        VALUES (1, :metodo, :params)
         ON DUPLICATE KEY UPDATE metodo=VALUES(metodo), parametro_json=VALUES(parametro_json)
-    """), {"metodo": metodo, "pct": pct})
+    """), {"metodo": metodo, "params": json.dumps(params)})
     db.commit()
+    cost_cache.invalidate(("config",))
     return {"ok": True}
 
+@router.get("/config/indirectos/tasa")
+def get_tasa(mes: str | None = None, db = Depends(db_dep)):
+    # Tasa de indirectos del mes (YYYY-MM, por defecto el actual) con su pool y base
+    try:
+        tasa = overhead.tasa_mes(db, mes)
+    except ValueError:
+        raise HTTPException(400, "mes invalido (YYYY-MM)")
+    return {k: v for k, v in tasa.items() if k != "deps"}
+
 @router.get("/indirectos")
 def list_ind(db = Depends(db_dep)):
     return db.execute(text("SELECT id, nombre, monto_mensual_crc, activo FROM costo_indirecto ORDER BY id DESC")).mappings().all()
@@ -76,13 +130,21 @@ def add_ind(payload: dict, db = Depends(db_dep)):
         VALUES (:nombre, :monto_mensual_crc, :activo)
     """), data)
     db.commit()
+    overhead.invalidar("indirectos")
     return {"ok": True}
 
 # ---------------------------
 # Gastos operativos
 # ---------------------------
 @router.get("/gastos")
-def list_gastos(mes: str | None = None, db = Depends(db_dep)):
+def list_gastos(
+    response: Response,
+    mes: str | None = None,
+    after: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = None,
+    db = Depends(db_dep),
+):
     base = """
       SELECT g.id, g.fecha, g.monto_crc, g.metodo_pago AS metodo, g.nota,
              g.proveedor_id, pr.nombre AS proveedor_nombre,
@@ -92,11 +154,22 @@ def list_gastos(mes: str | None = None, db = Depends(db_dep)):
       LEFT JOIN categoria_gasto cg ON cg.id = g.categoria_id
     """
     params = {}
+    filtros = []
+    ks = Keyset([("g.fecha", "fecha", "DESC"), ("g.id", "id", "DESC")], after, limit)
     if mes:
-        base += " WHERE DATE_FORMAT(g.fecha,'%Y-%m') = :mes"
-        params["mes"] = mes
-    base += " ORDER BY g.fecha DESC, g.id DESC"
-    return db.execute(text(base), params).mappings().all()
+        try:
+            params["ini"], params["fin"] = overhead.mes_rango(mes)
+        except ValueError:
+            raise HTTPException(400, "mes debe ser YYYY-MM")
+        filtros.append("g.fecha >= :ini AND g.fecha < :fin")
+    if ks.where():
+        filtros.append(ks.where())
+    if filtros:
+        base += " WHERE " + " AND ".join(filtros)
+    base += ks.order_by()
+    params.update(ks.params())
+    rows = db.execute(text(base), params).mappings().all()
+    return proyectar(ks.pagina(rows, response), fields)
 
 @router.post("/gastos")
 def add_gasto(payload: dict, db = Depends(db_dep)):
@@ -133,5 +206,7 @@ def add_gasto(payload: dict, db = Depends(db_dep)):
         INSERT INTO gasto (fecha, categoria_id, monto_crc, proveedor_id, metodo_pago, nota)
         VALUES (:fecha, :categoria_id, :monto, :proveedor_id, :metodo, :nota)
     """), {"fecha": fecha, "categoria_id": categoria_id, "monto": monto, "proveedor_id": proveedor_id, "metodo": metodo, "nota": nota})
+    hechos.registrar_gastos(db, [{"fecha": fecha, "monto_crc": monto}])
     db.commit()
+    overhead.invalidar("gastos", fecha)
     return {"ok": True}
@@ -1,68 +1,123 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import text
+from ..services.cost_history import cargar_historial
+from ..services.inventory import insert_inv_mov, rebuild_inv_saldo
+from ..services.uom import conversor
 from ..utils.deps import db_dep
+from ..utils.pagination import MAX_LIMIT, Keyset, proyectar
 
 router = APIRouter(prefix="/inventario", tags=["inventario"])
 
+def _filtro_ubicacion(ubicacion_id: int | None):
+    # 0 = movimientos sin ubicacion asignada
+    if ubicacion_id is None:
+        return "", {}
+    return " AND s.ubicacion_id = :ubicacion_id", {"ubicacion_id": ubicacion_id}
+
 @router.get("/mp")
-def mp(db = Depends(db_dep)):
-    # existencias = IN - OUT; totales por motivo
-    return db.execute(text("""
+def mp(ubicacion_id: int | None = Query(None), db = Depends(db_dep)):
+    # existencias = IN - OUT; totales por motivo (desde inv_saldo)
+    filtro, params = _filtro_ubicacion(ubicacion_id)
+    return db.execute(text(f"""
         SELECT p.sku, p.nombre,
-               COALESCE(SUM(CASE WHEN m.tipo='IN'  THEN m.cantidad WHEN m.tipo='OUT' THEN -m.cantidad ELSE 0 END),0) AS existencias,
-               COALESCE(SUM(CASE WHEN m.motivo='COMPRA' THEN m.cantidad ELSE 0 END),0) AS total_comprado,
-               COALESCE(SUM(CASE WHEN m.motivo='CONSUMO_RECETA' THEN m.cantidad ELSE 0 END),0) AS total_consumido
+               COALESCE(SUM(s.existencias),0) AS existencias,
+               COALESCE(SUM(s.total_compra),0) AS total_comprado,
+               COALESCE(SUM(s.total_consumo),0) AS total_consumido
         FROM producto p
-        LEFT JOIN inv_mov m ON m.producto_id = p.id
+        LEFT JOIN inv_saldo s ON s.producto_id = p.id{filtro}
         WHERE p.tipo = 'MP'
         GROUP BY p.id
         ORDER BY p.nombre
-    """)).mappings().all()
+    """), params).mappings().all()
 
 @router.get("/pt")
-def pt(db = Depends(db_dep)):
-    return db.execute(text("""
+def pt(ubicacion_id: int | None = Query(None), db = Depends(db_dep)):
+    filtro, params = _filtro_ubicacion(ubicacion_id)
+    return db.execute(text(f"""
         SELECT p.sku, p.nombre,
-               COALESCE(SUM(CASE WHEN m.tipo='IN'  THEN m.cantidad WHEN m.tipo='OUT' THEN -m.cantidad ELSE 0 END),0) AS existencias,
-               COALESCE(SUM(CASE WHEN m.motivo='PRODUCCION_SALIDA' THEN m.cantidad ELSE 0 END),0) AS total_producido,
-               COALESCE(SUM(CASE WHEN m.motivo='VENTA' THEN m.cantidad ELSE 0 END),0) AS total_vendido
+               COALESCE(SUM(s.existencias),0) AS existencias,
+               COALESCE(SUM(s.total_produccion),0) AS total_producido,
+               COALESCE(SUM(s.total_venta),0) AS total_vendido
         FROM producto p
-        LEFT JOIN inv_mov m ON m.producto_id = p.id
+        LEFT JOIN inv_saldo s ON s.producto_id = p.id{filtro}
         WHERE p.tipo = 'PT'
         GROUP BY p.id
         ORDER BY p.nombre
-    """)).mappings().all()
+    """), params).mappings().all()
 
 @router.get("/resumen")
-def resumen(db = Depends(db_dep)):
-    return db.execute(text("""
+def resumen(ubicacion_id: int | None = Query(None), db = Depends(db_dep)):
+    filtro, params = _filtro_ubicacion(ubicacion_id)
+    return db.execute(text(f"""
         SELECT p.sku, p.nombre, p.tipo,
-               MAX(CASE WHEN m.tipo='IN' THEN m.fecha END)  AS ultima_entrada,
-               MAX(CASE WHEN m.tipo='OUT' THEN m.fecha END) AS ultima_salida,
-               COALESCE(SUM(CASE WHEN m.tipo='IN'  THEN m.cantidad WHEN m.tipo='OUT' THEN -m.cantidad ELSE 0 END),0) AS existencias_mov
+               MAX(s.ultima_entrada) AS ultima_entrada,
+               MAX(s.ultima_salida)  AS ultima_salida,
+               COALESCE(SUM(s.existencias),0) AS existencias_mov
         FROM producto p
-        LEFT JOIN inv_mov m ON m.producto_id = p.id
+        LEFT JOIN inv_saldo s ON s.producto_id = p.id{filtro}
         GROUP BY p.id
         ORDER BY p.nombre
-    """)).mappings().all()
+    """), params).mappings().all()
+
+@router.get("/saldos")
+def saldos(producto_id: int | None = Query(None), db = Depends(db_dep)):
+    base = """
+        SELECT s.producto_id, p.sku, p.nombre, s.ubicacion_id, u.nombre AS ubicacion_nombre,
+               s.existencias, s.ultima_entrada, s.ultima_salida
+        FROM inv_saldo s
+        JOIN producto p ON p.id = s.producto_id
+        LEFT JOIN ubicacion u ON u.id = s.ubicacion_id
+    """
+    params = {}
+    if producto_id:
+        base += " WHERE s.producto_id = :producto_id"
+        params["producto_id"] = producto_id
+    base += " ORDER BY p.nombre, s.ubicacion_id"
+    return db.execute(text(base), params).mappings().all()
+
+@router.post("/saldos/rebuild")
+def saldos_rebuild(db = Depends(db_dep)):
+    filas = rebuild_inv_saldo(db)
+    db.commit()
+    return {"ok": True, "filas": filas}
 
 @router.get("/mermas")
-def mermas(db = Depends(db_dep)):
-    return db.execute(text("""
-        SELECT DATE(m.fecha) AS fecha,
+def mermas(
+    response: Response,
+    after: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = None,
+    db = Depends(db_dep),
+):
+    ks = Keyset([("m.fecha", "fecha_hora", "DESC"), ("m.id", "id", "DESC")], after, limit)
+    sql = """
+        SELECT m.id, m.fecha AS fecha_hora, DATE(m.fecha) AS fecha,
+               m.producto_id,
+               m.uom_id,
                p.nombre AS producto_nombre,
                u.nombre AS uom_nombre,
                m.cantidad AS cantidad,
-               COALESCE(p.costo_estandar_crc, 0) AS costo_unitario_crc,
-               m.cantidad * COALESCE(p.costo_estandar_crc, 0) AS costo_total_crc,
                m.motivo AS motivo,
                m.nota AS nota
         FROM inv_mov m
         JOIN producto p ON p.id = m.producto_id
         JOIN uom u ON u.id = m.uom_id
         WHERE m.motivo = 'MERMA'
-        ORDER BY m.fecha DESC
-    """)).mappings().all()
+    """
+    if ks.where():
+        sql += " AND " + ks.where()
+    sql += ks.order_by()
+    rows = ks.pagina(db.execute(text(sql), ks.params()).mappings().all(), response)
+    # Valoriza cada merma (solo las de la pagina) al costo de compra vigente en su fecha
+    hist = cargar_historial(db, (r["producto_id"] for r in rows))
+    conv = conversor(db)
+    out = []
+    for r, unit_base in zip(rows, hist.valorar(rows)):
+        unit = unit_base * conv.factor(r["producto_id"], r["uom_id"])
+        r["costo_unitario_crc"] = unit
+        r["costo_total_crc"] = unit * float(r["cantidad"] or 0)
+        out.append(r)
+    return proyectar(out, fields)
 
 @router.post("/merma")
 def merma(payload: dict, db = Depends(db_dep)):
@@ -71,13 +126,11 @@ def merma(payload: dict, db = Depends(db_dep)):
         "producto_id": payload.get("producto_id"),
         "uom_id": payload.get("uom_id"),
         "cantidad": float(payload.get("cantidad") or 0),
+        "ubicacion_id": payload.get("ubicacion_id"),
         "nota": payload.get("nota"),
     }
     if not data["fecha"] or not data["producto_id"] or not data["uom_id"] or data["cantidad"] <= 0:
         raise HTTPException(400, "fecha, producto_id, uom_id, cantidad > 0 requeridos")
-    db.execute(text("""
-        INSERT INTO inv_mov (fecha, producto_id, uom_id, tipo, cantidad, motivo, ref_tabla, ref_id, nota)
-        VALUES (:fecha, :producto_id, :uom_id, 'OUT', :cantidad, 'MERMA', 'merma', NULL, :nota)
-    """), data)
+    insert_inv_mov(db, tipo="OUT", motivo="MERMA", ref_tabla="merma", **data)
     db.commit()
     return {"ok": True}
@@ -1,10 +1,12 @@
 from datetime import date
 from typing import Dict, List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import text
 
+from ..services import overhead
 from ..utils.deps import db_dep
+from ..utils.pagination import MAX_LIMIT, Keyset, proyectar
 
 FACTOR_EXTRA_DEFAULT = 1.5
 FACTOR_DOBLE_DEFAULT = 2.0
@@ -50,17 +52,42 @@ def _calc_total(tarifa, horas_reg, horas_extra, horas_doble, horas_feriado, fact
     )
 
 
+def _meses_con_horas(db, filtro: str, params: dict) -> list[str]:
+    rows = db.execute(text(f"""
+        SELECT DISTINCT DATE_FORMAT(dd.fecha, '%Y-%m') AS mes
+        FROM planilla_det_dia dd
+        JOIN planilla_det d ON d.id = dd.det_id
+        WHERE {filtro}
+    """), params).all()
+    return [r[0] for r in rows]
+
+
 @router.get("")
-def listar(mes: str | None = None, db = Depends(db_dep)):
+def listar(
+    response: Response,
+    mes: str | None = None,
+    after: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = None,
+    db = Depends(db_dep),
+):
     params = {
         "fx": FACTOR_EXTRA_DEFAULT,
         "fd": FACTOR_DOBLE_DEFAULT,
         "ff": FACTOR_FERIADO_DEFAULT,
     }
-    where = ""
+    ks = Keyset([("ps.semana_inicio", "semana_inicio", "DESC"), ("ps.id", "id", "DESC")], after, limit)
+    filtros = []
     if mes:
-        where = " WHERE DATE_FORMAT(ps.semana_inicio,'%Y-%m') = :mes"
-        params["mes"] = mes
+        try:
+            params["ini"], params["fin"] = overhead.mes_rango(mes)
+        except ValueError:
+            raise HTTPException(400, "mes debe ser YYYY-MM")
+        filtros.append("ps.semana_inicio >= :ini AND ps.semana_inicio < :fin")
+    if ks.where():
+        filtros.append(ks.where())
+    where = " WHERE " + " AND ".join(filtros) if filtros else ""
+    params.update(ks.params())
     query = f"""
         SELECT
             ps.id,
@@ -85,9 +112,9 @@ def listar(mes: str | None = None, db = Depends(db_dep)):
         LEFT JOIN planilla_det_dia dd ON dd.det_id = d.id
         {where}
         GROUP BY ps.id
-        ORDER BY ps.semana_inicio DESC
+        {ks.order_by()}
     """
-    return db.execute(text(query), params).mappings().all()
+    return proyectar(ks.pagina(db.execute(text(query), params).mappings().all(), response), fields)
 
 
 @router.post("")
@@ -142,8 +169,11 @@ def actualizar(planilla_id: int, payload: dict, db = Depends(db_dep)):
 
 @router.delete("/{planilla_id}")
 def eliminar(planilla_id: int, db = Depends(db_dep)):
+    meses = _meses_con_horas(db, "d.planilla_id = :id", {"id": planilla_id})
     res = db.execute(text("DELETE FROM planilla_semana WHERE id=:id"), {"id": planilla_id})
     db.commit()
+    for mes in meses:
+        overhead.invalidar("planilla", mes)
     if res.rowcount == 0:
         raise HTTPException(404, "Planilla no encontrada")
     return {"ok": True}
@@ -338,8 +368,11 @@ def update_det(planilla_id: int, det_id: int, payload: dict, db = Depends(db_dep
 
 @router.delete("/{planilla_id}/detalles/{det_id}")
 def delete_det(planilla_id: int, det_id: int, db = Depends(db_dep)):
+    meses = _meses_con_horas(db, "d.id = :id", {"id": det_id})
     res = db.execute(text("DELETE FROM planilla_det WHERE id=:id AND planilla_id=:pid"), {"id": det_id, "pid": planilla_id})
     db.commit()
+    for mes in meses:
+        overhead.invalidar("planilla", mes)
     if res.rowcount == 0:
         raise HTTPException(404, "Detalle no encontrado")
     return {"ok": True}
@@ -352,10 +385,12 @@ def put_dias(planilla_id: int, det_id: int, payload: dict, db = Depends(db_dep))
         raise HTTPException(404, "Detalle no encontrado")
     dias = payload.get("dias") or []
     afectados = 0
+    meses = set()
     for d in dias:
         fecha = _coerce_date(d.get("fecha"))
         if not fecha:
             raise HTTPException(400, "fecha invalida (YYYY-MM-DD)")
+        meses.add(overhead.mes_de(fecha))
         body = {
             "det_id": det_id,
             "fecha": fecha.isoformat(),
@@ -380,6 +415,9 @@ def put_dias(planilla_id: int, det_id: int, payload: dict, db = Depends(db_dep))
         """), body)
         afectados += 1
     db.commit()
+    # las horas del mes alimentan la tasa de indirectos POR_HORA
+    for mes in meses:
+        overhead.invalidar("planilla", mes)
     return {"ok": True, "n": afectados}
 
 
@@ -396,6 +434,7 @@ def delete_dia(planilla_id: int, det_id: int, fecha: str, db = Depends(db_dep)):
         "fecha": fecha_norm.isoformat(),
     })
     db.commit()
+    overhead.invalidar("planilla", fecha_norm)
     if res.rowcount == 0:
         raise HTTPException(404, "Registro de dia no encontrado")
     return {"ok": True}
@@ -1,25 +1,92 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import text
+from ..services import overhead, varianzas
+from ..services.cost_cache import cost_cache
+from ..services.costing import CicloRecetasError
+from ..services.inventory import insert_inv_mov, insert_inv_movs
+from ..services.plan_produccion import requerimientos
 from ..utils.deps import db_dep
 
 router = APIRouter(prefix="/produccion", tags=["produccion"])
 
 @router.post("/tandas")
 def crear_tanda(payload: dict, db = Depends(db_dep)):
+    # Con receta_id se explota la receta x cantidad_tandas: consumos, salidas y kardex en una sola transaccion
     data = {
         "fecha": payload.get("fecha"),
-        "tanda_receta_id": payload.get("tanda_receta_id"),
-        "cantidad_tandas": payload.get("cantidad_tandas"),
+        "receta_id": payload.get("receta_id") or payload.get("tanda_receta_id") or None,
+        "ubicacion_origen_id": payload.get("ubicacion_origen_id") or None,
+        "ubicacion_destino_id": payload.get("ubicacion_destino_id") or None,
         "nota": payload.get("nota"),
     }
     if not data["fecha"]:
         raise HTTPException(400, "fecha requerida")
+    try:
+        multiplo = float(payload.get("cantidad_tandas") or 1)
+    except (TypeError, ValueError):
+        raise HTTPException(400, "cantidad_tandas debe ser numerico")
+    if multiplo <= 0:
+        raise HTTPException(400, "cantidad_tandas > 0 requerida")
+
+    consumos, salidas = [], []
+    if data["receta_id"]:
+        params = {"rid": data["receta_id"]}
+        if not db.execute(text("SELECT 1 FROM receta WHERE id = :rid"), params).first():
+            raise HTTPException(404, "receta no encontrada")
+        consumos = [
+            {"producto_id": r["producto_id"], "uom_id": r["uom_id"], "cantidad": float(r["cantidad"]) * multiplo}
+            for r in db.execute(text("""
+                SELECT producto_id, uom_id, cantidad FROM receta_det WHERE receta_id = :rid ORDER BY id
+            """), params).mappings().all()
+            if r["cantidad"] and float(r["cantidad"]) > 0
+        ]
+        salidas = [
+            {"producto_id": r["producto_id"], "uom_id": r["uom_id"], "cantidad": float(r["rendimiento"]) * multiplo}
+            for r in db.execute(text("""
+                SELECT producto_id, uom_id, rendimiento FROM receta_salida WHERE receta_id = :rid ORDER BY id
+            """), params).mappings().all()
+        ]
+
     res = db.execute(text("""
-        INSERT INTO tanda (fecha, tanda_receta_id, cantidad_tandas, nota)
-        VALUES (:fecha, :tanda_receta_id, :cantidad_tandas, :nota)
-    """), data)
+        INSERT INTO tanda (fecha, receta_id, cantidad_tandas, ubicacion_origen_id, ubicacion_destino_id, nota)
+        VALUES (:fecha, :receta_id, :cantidad_tandas, :ubicacion_origen_id, :ubicacion_destino_id, :nota)
+    """), {**data, "cantidad_tandas": multiplo})
+    tanda_id = res.lastrowid
+    movs = []
+    if consumos:
+        db.execute(text("""
+            INSERT INTO tanda_consumo (tanda_id, producto_id, uom_id, cantidad)
+            VALUES (:tanda_id, :producto_id, :uom_id, :cantidad)
+        """), [{"tanda_id": tanda_id, **c} for c in consumos])
+        movs += [dict(
+            c, fecha=data["fecha"], tipo="OUT", motivo="CONSUMO_RECETA", ref_tabla="tanda", ref_id=tanda_id,
+            ubicacion_id=data["ubicacion_origen_id"],
+        ) for c in consumos]
+    if salidas:
+        db.execute(text("""
+            INSERT INTO tanda_salida (tanda_id, producto_id, uom_id, cantidad)
+            VALUES (:tanda_id, :producto_id, :uom_id, :cantidad)
+        """), [{"tanda_id": tanda_id, **s} for s in salidas])
+        movs += [dict(
+            s, fecha=data["fecha"], tipo="IN", motivo="PRODUCCION_SALIDA", ref_tabla="tanda", ref_id=tanda_id,
+            ubicacion_id=data["ubicacion_destino_id"],
+        ) for s in salidas]
+    insert_inv_movs(db, movs)
+    varianzas.descartar_mes(db, data["fecha"])
     db.commit()
-    return {"id": res.lastrowid}
+    overhead.invalidar("produccion", data["fecha"])
+    cost_cache.invalidate(("tanda", tanda_id))
+    return {"id": tanda_id, "consumos": consumos, "salidas": salidas}
+
+def _get_tanda(db, tanda_id: int):
+    tanda = db.execute(text("""
+        SELECT id, fecha, ubicacion_origen_id, ubicacion_destino_id FROM tanda WHERE id = :id
+    """), {"id": tanda_id}).mappings().first()
+    if not tanda:
+        raise HTTPException(404, "tanda no encontrada")
+    return tanda
 
 @router.post("/tandas/{tanda_id}/consumos")
 def agregar_consumo(tanda_id: int, payload: dict, db = Depends(db_dep)):
@@ -31,16 +98,20 @@ def agregar_consumo(tanda_id: int, payload: dict, db = Depends(db_dep)):
     }
     if not data["producto_id"]:
         raise HTTPException(400, "producto_id requerido")
+    tanda = _get_tanda(db, tanda_id)
     db.execute(text("""
         INSERT INTO tanda_consumo (tanda_id, producto_id, uom_id, cantidad)
         VALUES (:tanda_id, :producto_id, :uom_id, :cantidad)
     """), data)
-    db.execute(text("""
-        INSERT INTO inv_mov (fecha, producto_id, uom_id, cantidad, tipo, ref, ref_id)
-        SELECT t.fecha, :producto_id, :uom_id, -:cantidad, 'PROD_CONSUMO', 'tanda', :tanda_id
-        FROM tanda t WHERE t.id=:tanda_id
-    """), data)
+    insert_inv_mov(
+        db, fecha=tanda["fecha"], producto_id=data["producto_id"], uom_id=data["uom_id"],
+        tipo="OUT", cantidad=data["cantidad"], motivo="CONSUMO_RECETA", ref_tabla="tanda", ref_id=tanda_id,
+        ubicacion_id=tanda["ubicacion_origen_id"],
+    )
+    varianzas.descartar_mes(db, tanda["fecha"])
     db.commit()
+    cost_cache.invalidate(("tanda", tanda_id))
+    overhead.invalidar("produccion", tanda["fecha"])
     return {"ok": True}
 
 @router.post("/tandas/{tanda_id}/salidas")
@@ -53,14 +124,83 @@ def agregar_salida(tanda_id: int, payload: dict, db = Depends(db_dep)):
     }
     if not data["producto_id"]:
         raise HTTPException(400, "producto_id requerido")
+    tanda = _get_tanda(db, tanda_id)
     db.execute(text("""
         INSERT INTO tanda_salida (tanda_id, producto_id, uom_id, cantidad)
         VALUES (:tanda_id, :producto_id, :uom_id, :cantidad)
     """), data)
-    db.execute(text("""
-        INSERT INTO inv_mov (fecha, producto_id, uom_id, cantidad, tipo, ref, ref_id)
-        SELECT t.fecha, :producto_id, :uom_id, :cantidad, 'PROD_SALIDA', 'tanda', :tanda_id
-        FROM tanda t WHERE t.id=:tanda_id
-    """), data)
+    insert_inv_mov(
+        db, fecha=tanda["fecha"], producto_id=data["producto_id"], uom_id=data["uom_id"],
+        tipo="IN", cantidad=data["cantidad"], motivo="PRODUCCION_SALIDA", ref_tabla="tanda", ref_id=tanda_id,
+        ubicacion_id=tanda["ubicacion_destino_id"],
+    )
+    varianzas.descartar_mes(db, tanda["fecha"])
     db.commit()
+    cost_cache.invalidate(("tanda", tanda_id))
+    overhead.invalidar("produccion", tanda["fecha"])
     return {"ok": True}
+
+@router.post("/plan")
+def plan(payload: dict, db = Depends(db_dep)):
+    """Requerimientos de MP para tandas planeadas: bruto, existencias, por comprar y fecha de quiebre.
+
+    payload: {desde, hasta, ubicacion_id?, plan: [{receta_id, cantidad_tandas, fecha?}]};
+    sin fecha la tanda se planea en desde. Solo se netean existencias de MP (ver "nota").
+    """
+    try:
+        desde = date.fromisoformat(str(payload.get("desde") or date.today()))
+        hasta = date.fromisoformat(str(payload.get("hasta") or desde))
+    except ValueError:
+        raise HTTPException(400, "desde/hasta invalidos (YYYY-MM-DD)")
+    if hasta < desde:
+        raise HTTPException(400, "hasta debe ser >= desde")
+    plan_items = payload.get("plan") or []
+    if not isinstance(plan_items, list) or not all(isinstance(it, dict) for it in plan_items):
+        raise HTTPException(400, "plan debe ser una lista de items")
+    items = []
+    for it in plan_items:
+        if not it.get("receta_id"):
+            raise HTTPException(400, "receta_id requerido en cada item del plan")
+        try:
+            receta_id = int(it["receta_id"])
+        except (TypeError, ValueError):
+            raise HTTPException(400, f"receta_id invalido: {it['receta_id']}")
+        try:
+            fecha = date.fromisoformat(str(it.get("fecha") or desde))
+            cantidad = float(it.get("cantidad_tandas") or 0)
+        except (TypeError, ValueError):
+            raise HTTPException(400, "fecha (YYYY-MM-DD) y cantidad_tandas numerica requeridas")
+        if not desde <= fecha <= hasta:
+            raise HTTPException(400, f"fecha {fecha} fuera del rango del plan")
+        if cantidad > 0:
+            items.append({"receta_id": receta_id, "fecha": fecha, "cantidad_tandas": cantidad})
+    try:
+        materiales = requerimientos(db, items, ubicacion_id=payload.get("ubicacion_id"))
+    except CicloRecetasError as e:
+        raise HTTPException(409, str(e))
+    except KeyError as e:
+        raise HTTPException(404, f"receta {e.args[0]} no encontrada")
+    return {
+        "desde": desde,
+        "hasta": hasta,
+        "materiales": materiales,
+        "con_faltante": sum(1 for m in materiales if m["por_comprar"] > 0),
+        "nota": "las subrecetas se explotan completas hasta MP: no se descuentan existencias de intermedios",
+    }
+
+@router.get("/varianzas")
+def get_varianzas(
+    desde: str | None = Query(None, description="YYYY-MM-DD; por defecto el primer dia del mes"),
+    hasta: str | None = Query(None, description="YYYY-MM-DD; por defecto hoy"),
+    db = Depends(db_dep),
+):
+    """Varianzas de uso de MP y de rendimiento de las tandas contra su receta, con impacto en CRC."""
+    try:
+        d_hasta = date.fromisoformat(hasta) if hasta else date.today()
+        d_desde = date.fromisoformat(desde) if desde else d_hasta.replace(day=1)
+    except ValueError:
+        raise HTTPException(400, "desde/hasta invalidos (YYYY-MM-DD)")
+    if d_hasta < d_desde:
+        raise HTTPException(400, "hasta debe ser >= desde")
+    res = varianzas.resumen(db, varianzas.lineas(db, d_desde, d_hasta))
+    return {"desde": d_desde, "hasta": d_hasta, **res}
@@ -1,17 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
+from ..services.cost_cache import cost_cache
+from ..services.inventory import reconvertir
+from ..services.uom import invalidar_conversor
 from ..utils.deps import db_dep
+from ..utils.pagination import MAX_LIMIT, Keyset, proyectar
 
 router = APIRouter(prefix="/productos", tags=["productos"])
 
 @router.get("")
 def list_productos(
+    response: Response,
     q: str | None = Query(None),
     tipo: str | None = Query(None, regex="^(MP|PT)$"),
     activo: int | None = Query(None),
+    after: str | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = None,
     db = Depends(db_dep),
 ):
+    ks = Keyset([("id", "id", "DESC")], after, limit)
     base = "SELECT id, sku, nombre, tipo, uom_base_id, activo, precio_venta_crc, costo_estandar_crc FROM producto WHERE 1=1"
     params = {}
     if tipo:
@@ -20,8 +29,11 @@ def list_productos(
         base += " AND (sku LIKE :q OR nombre LIKE :q)"; params["q"] = f"%{q}%"
     if activo is not None:
         base += " AND activo = :activo"; params["activo"] = 1 if str(activo) in ("1","true","True") else 0
-    base += " ORDER BY id DESC LIMIT 500"
-    return db.execute(text(base), params).mappings().all()
+    if ks.where():
+        base += " AND " + ks.where()
+    base += ks.order_by()
+    params.update(ks.params())
+    return proyectar(ks.pagina(db.execute(text(base), params).mappings().all(), response), fields)
 
 @router.post("")
 def create_producto(payload: dict, db = Depends(db_dep)):
@@ -39,6 +51,7 @@ def create_producto(payload: dict, db = Depends(db_dep)):
         VALUES (:sku, :nombre, :tipo, :uom_base_id, :activo, :precio_venta_crc, :costo_estandar_crc)
     """), data)
     db.commit()
+    invalidar_conversor()
     pid = res.lastrowid
     return db.execute(text("SELECT * FROM producto WHERE id=:id"), {"id": pid}).mappings().first()
 
@@ -54,6 +67,7 @@ def update_producto(producto_id: int, payload: dict, db = Depends(db_dep)):
         "precio_venta_crc": payload.get("precio_venta_crc"),
         "costo_estandar_crc": payload.get("costo_estandar_crc"),
     }
+    uom_antes = db.execute(text("SELECT uom_base_id FROM producto WHERE id=:id"), {"id": producto_id}).scalar()
     db.execute(text("""
         UPDATE producto SET
           sku = COALESCE(:sku, sku),
@@ -65,7 +79,15 @@ def update_producto(producto_id: int, payload: dict, db = Depends(db_dep)):
           costo_estandar_crc = COALESCE(:costo_estandar_crc, costo_estandar_crc)
         WHERE id = :id
     """), data)
-    db.commit()
+    try:
+        # con otra uom base cambian las cantidades guardadas en inv_saldo, mp_costo y hechos
+        if data["uom_base_id"] and uom_antes is not None and int(data["uom_base_id"]) != int(uom_antes):
+            reconvertir(db, [producto_id])
+        db.commit()
+    finally:
+        # el nombre y la uom base del producto van dentro de los costeos en cache
+        invalidar_conversor()
+        cost_cache.invalidate(("mp", producto_id))
     row = db.execute(text("SELECT * FROM producto WHERE id=:id"), {"id": producto_id}).mappings().first()
     if not row:
         raise HTTPException(404, "producto no encontrado")
@@ -1,6 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
+from ..services import varianzas
+from ..services.cost_cache import cost_cache
+from ..services.costing import CicloRecetasError, ciclo_desde, receta_por_producto
 from ..utils.deps import db_dep
 
 router = APIRouter(prefix="/recetas", tags=["recetas"])
@@ -21,6 +24,20 @@ def _normalize_decimal(value, default=0.0):
         return default
 
 
+def _invalidar_costos(receta_id: int, salidas=()):
+    # Los productos que produce la receta pueden ser ingrediente de otras (subrecetas);
+    # ("recetas",) cubre lo calculado sobre el catalogo completo
+    cost_cache.invalidate(("receta", receta_id), ("recetas",), *(("mp", int(s["producto_id"])) for s in salidas))
+
+
+def _rechazar_ciclo(db, receta_id: int):
+    # un ciclo rompe el costeo de todo el catalogo: se rechaza antes del commit
+    ciclo = ciclo_desde(db, receta_id)
+    if ciclo:
+        db.rollback()
+        raise HTTPException(409, str(CicloRecetasError(ciclo)))
+
+
 def _get_receta(db, receta_id: int):
     receta = db.execute(text("""
         SELECT id, nombre, producto_salida_id, uom_salida_id, nota, activo,
@@ -123,7 +140,9 @@ def crear(payload: dict, db = Depends(db_dep)):
             INSERT INTO receta_salida (receta_id, producto_id, uom_id, rendimiento)
             VALUES (:receta_id, :producto_id, :uom_id, :rendimiento)
         """), body)
+    _rechazar_ciclo(db, receta_id)
     db.commit()
+    _invalidar_costos(receta_id, salidas)
     return _get_receta(db, receta_id)
 
 
@@ -187,20 +206,30 @@ def actualizar(receta_id: int, payload: dict, db = Depends(db_dep)):
                 INSERT INTO receta_salida (receta_id, producto_id, uom_id, rendimiento)
                 VALUES (:receta_id, :producto_id, :uom_id, :rendimiento)
             """), body)
+    _rechazar_ciclo(db, receta_id)
+    varianzas.descartar_receta(db, receta_id)
     db.commit()
+    _invalidar_costos(receta_id, list(receta["salidas"]) + list(payload.get("salidas") or []))
     return _get_receta(db, receta_id)
 
 
 @router.delete("/{receta_id}")
 def eliminar(receta_id: int, db = Depends(db_dep)):
+    salidas = db.execute(text("SELECT producto_id FROM receta_salida WHERE receta_id = :id"), {"id": receta_id}).mappings().all()
     try:
         res = db.execute(text("DELETE FROM receta WHERE id = :id"), {"id": receta_id})
+        # si otra receta pasa a producir sus salidas, sus aristas nuevas pueden cerrar un ciclo
+        productores = receta_por_producto(db)
+        for rid in {productores[int(s["producto_id"])] for s in salidas if int(s["producto_id"]) in productores}:
+            _rechazar_ciclo(db, rid)
+        varianzas.descartar_receta(db, receta_id)
         db.commit()
     except IntegrityError:
         db.rollback()
         raise HTTPException(409, "No se puede eliminar la receta porque esta referenciada en otros registros")
     if res.rowcount == 0:
         raise HTTPException(404, "receta no encontrada")
+    _invalidar_costos(receta_id, salidas)
     return {"ok": True}
 
 
@@ -234,7 +263,10 @@ def agregar_ingrediente(receta_id: int, payload: dict, db = Depends(db_dep)):
         INSERT INTO receta_det (receta_id, producto_id, uom_id, cantidad, costo_unitario_crc, otros_costos_crc)
         VALUES (:receta_id, :producto_id, :uom_id, :cantidad, :costo_unitario_crc, :otros_costos_crc)
     """), data)
+    _rechazar_ciclo(db, receta_id)
+    varianzas.descartar_receta(db, receta_id)
     db.commit()
+    _invalidar_costos(receta_id)
     return {"ok": True}
 
 
@@ -266,5 +298,8 @@ def agregar_salida(receta_id: int, payload: dict, db = Depends(db_dep)):
         INSERT INTO receta_salida (receta_id, producto_id, uom_id, rendimiento)
         VALUES (:receta_id, :producto_id, :uom_id, :rendimiento)
     """), data)
+    _rechazar_ciclo(db, receta_id)
+    varianzas.descartar_receta(db, receta_id)
     db.commit()
+    _invalidar_costos(receta_id, [data])
     return {"ok": True}
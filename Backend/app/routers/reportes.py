@@ -1,52 +1,36 @@
-from fastapi import APIRouter, Depends
+from datetime import date, timedelta
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import text
 
+from ..services import espejo
+from ..services.dashboard import kpis
+from ..services.overhead import mes_rango
+from ..services.paralelo import en_paralelo
+from ..services.pronostico import METODOS, pronosticar
 from ..utils.deps import db_dep
 
 router = APIRouter(prefix="/reportes", tags=["reportes"])
 
 @router.get("/dashboard")
-def dashboard(mes: str | None = None, db = Depends(db_dep)):
+def dashboard(
+    mes: str | None = Query(None, description="YYYY-MM; si no, desde/hasta o los ultimos 30 dias"),
+    desde: date | None = None,
+    hasta: date | None = None,
+):
     if mes:
-        ventas = db.execute(text("""
-            SELECT DATE(v.fecha) AS fecha,
-                   SUM(d.cantidad*d.precio_unitario_crc - COALESCE(d.descuento_crc,0)) AS total_crc
-            FROM venta v
-            LEFT JOIN venta_det d ON d.venta_id = v.id
-            WHERE DATE_FORMAT(v.fecha,'%Y-%m') = :mes
-            GROUP BY DATE(v.fecha)
-            ORDER BY fecha DESC
-        """), {"mes": mes}).mappings().all()
-        compras = db.execute(text("""
-            SELECT DATE(c.fecha) AS fecha,
-                   SUM(d.cantidad*d.costo_unitario_crc - COALESCE(d.descuento_crc,0)) AS total_crc
-            FROM compra c
-            LEFT JOIN compra_det d ON d.compra_id = c.id
-            WHERE DATE_FORMAT(c.fecha,'%Y-%m') = :mes
-            GROUP BY DATE(c.fecha)
-            ORDER BY fecha DESC
-        """), {"mes": mes}).mappings().all()
+        try:
+            ini, fin = mes_rango(mes)
+        except ValueError:
+            raise HTTPException(400, "mes debe ser YYYY-MM")
     else:
-        ventas = db.execute(text("""
-            SELECT DATE(v.fecha) AS fecha,
-                   SUM(d.cantidad*d.precio_unitario_crc - COALESCE(d.descuento_crc,0)) AS total_crc
-            FROM venta v
-            LEFT JOIN venta_det d ON d.venta_id = v.id
-            WHERE v.fecha >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-            GROUP BY DATE(v.fecha)
-            ORDER BY fecha DESC
-        """)).mappings().all()
-        compras = db.execute(text("""
-            SELECT DATE(c.fecha) AS fecha,
-                   SUM(d.cantidad*d.costo_unitario_crc - COALESCE(d.descuento_crc,0)) AS total_crc
-            FROM compra c
-            LEFT JOIN compra_det d ON d.compra_id = c.id
-            WHERE c.fecha >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-            GROUP BY DATE(c.fecha)
-            ORDER BY fecha DESC
-        """)).mappings().all()
-    margen = []  # si quieres lo calculamos por mes luego
-    return {"ventas": ventas, "compras": compras, "margen": margen}
+        hoy = date.today()
+        fin = (hasta or hoy) + timedelta(days=1)
+        ini = desde or hoy - timedelta(days=30)
+    if ini >= fin:
+        raise HTTPException(400, "desde no puede ser posterior a hasta")
+    return kpis(ini, fin)
 
 
 @router.get("/resumen-ventas")
@@ -54,17 +38,19 @@ def resumen_ventas(
     desde: str | None = None,
     hasta: str | None = None,
     top: int | None = None,
-    db = Depends(db_dep),
 ):
+    # Lee los hechos diarios (dia x cliente x producto), no el detalle de facturas
     where = []
     params: dict[str, object] = {}
     if desde:
-        where.append("v.fecha >= :desde")
+        where.append("{t}.fecha >= :desde")
         params["desde"] = desde
     if hasta:
-        where.append("v.fecha <= :hasta")
+        where.append("{t}.fecha <= :hasta")
         params["hasta"] = hasta
-    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    def where_sql(t):
+        return ("WHERE " + " AND ".join(w.format(t=t) for w in where)) if where else ""
 
     limit_sql = ""
     if top and top > 0:
@@ -74,16 +60,18 @@ def resumen_ventas(
     cliente_sql = text(
         f"""
         SELECT
-            v.cliente_id,
-            COALESCE(c.nombre, CONCAT('Cliente #', v.cliente_id)) AS cliente_nombre,
-            COUNT(DISTINCT v.id) AS facturas,
-            SUM(d.cantidad) AS unidades,
-            SUM(d.cantidad * d.precio_unitario_crc - COALESCE(d.descuento_crc, 0)) AS total_crc
-        FROM venta v
-        LEFT JOIN venta_det d ON d.venta_id = v.id
-        LEFT JOIN cliente c ON c.id = v.cliente_id
-        {where_sql}
-        GROUP BY v.cliente_id, cliente_nombre
+            h.cliente_id,
+            COALESCE(c.nombre, CONCAT('Cliente #', h.cliente_id)) AS cliente_nombre,
+            COALESCE(MAX(f.facturas), 0) AS facturas,
+            SUM(h.cantidad) AS unidades,
+            SUM(h.total_crc) AS total_crc
+        FROM hecho_venta h
+        LEFT JOIN cliente c ON c.id = h.cliente_id
+        LEFT JOIN (
+            SELECT v.cliente_id, COUNT(*) AS facturas FROM venta v {where_sql("v")} GROUP BY v.cliente_id
+        ) f ON f.cliente_id = h.cliente_id
+        {where_sql("h")}
+        GROUP BY h.cliente_id, cliente_nombre
         ORDER BY total_crc DESC
         {limit_sql}
         """
@@ -92,20 +80,158 @@ def resumen_ventas(
     producto_sql = text(
         f"""
         SELECT
-            d.producto_id,
-            COALESCE(p.nombre, CONCAT('Producto #', d.producto_id)) AS producto_nombre,
-            SUM(d.cantidad) AS unidades,
-            SUM(d.cantidad * d.precio_unitario_crc - COALESCE(d.descuento_crc, 0)) AS total_crc
-        FROM venta_det d
-        LEFT JOIN venta v ON v.id = d.venta_id
-        LEFT JOIN producto p ON p.id = d.producto_id
-        {where_sql}
-        GROUP BY d.producto_id, producto_nombre
+            h.producto_id,
+            COALESCE(p.nombre, CONCAT('Producto #', h.producto_id)) AS producto_nombre,
+            SUM(h.cantidad) AS unidades,
+            SUM(h.total_crc) AS total_crc
+        FROM hecho_venta h
+        LEFT JOIN producto p ON p.id = h.producto_id
+        {where_sql("h")}
+        GROUP BY h.producto_id, producto_nombre
         ORDER BY total_crc DESC
         {limit_sql}
         """
     )
 
-    clientes = db.execute(cliente_sql, params).mappings().all()
-    productos = db.execute(producto_sql, params).mappings().all()
-    return {"clientes": clientes, "productos": productos}
+    # independientes: cada una en su conexion, a la vez
+    return en_paralelo({
+        "clientes": lambda db: db.execute(cliente_sql, params).mappings().all(),
+        "productos": lambda db: db.execute(producto_sql, params).mappings().all(),
+    })
+
+
+
+# dimension -> (columnas, GROUP BY, JOIN para el nombre, ORDER BY)
+_MARGEN_POR = {
+    "meses": ("DATE_FORMAT(h.fecha, '%Y-%m') AS mes", "mes", "", "mes"),
+    "productos": ("h.producto_id, COALESCE(p.nombre, CONCAT('Producto #', h.producto_id)) AS producto_nombre, "
+                  "SUM(h.cantidad) AS unidades",
+                  "h.producto_id, producto_nombre", "LEFT JOIN producto p ON p.id = h.producto_id", "margen_crc DESC"),
+    "clientes": ("h.cliente_id, COALESCE(c.nombre, CONCAT('Cliente #', h.cliente_id)) AS cliente_nombre",
+                 "h.cliente_id, cliente_nombre", "LEFT JOIN cliente c ON c.id = h.cliente_id", "margen_crc DESC"),
+    "rutas": ("NULLIF(h.ruta_id, 0) AS ruta_id, COALESCE(r.nombre, 'Sin ruta') AS ruta_nombre",
+              "h.ruta_id, ruta_nombre", "LEFT JOIN ruta r ON r.id = h.ruta_id", "margen_crc DESC"),
+}
+
+
+def _fila_margen(r) -> dict:
+    out = {k: (float(v) if k in ("ventas_crc", "costo_crc", "margen_crc", "unidades") else v) for k, v in r.items()}
+    out["lineas_sin_costo"] = int(r["lineas_sin_costo"] or 0)
+    out["margen_pct"] = out["margen_crc"] / out["ventas_crc"] * 100 if out["ventas_crc"] else None
+    return out
+
+
+@router.get("/margen")
+def margen(desde: date | None = None, hasta: date | None = None):
+    # Suma el costo congelado en cada linea al vender (hecho_venta.costo_crc): aqui no se costean recetas.
+    # lineas_sin_costo: lineas vendidas sin costo conocido (cuentan como costo 0).
+    where = []
+    params: dict[str, object] = {}
+    if desde:
+        where.append("h.fecha >= :desde")
+        params["desde"] = desde
+    if hasta:
+        where.append("h.fecha <= :hasta")
+        params["hasta"] = hasta
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+
+    def consulta(cols, group_by, join, orden):
+        sql = text(f"""
+            SELECT {cols},
+                   SUM(h.total_crc) AS ventas_crc,
+                   SUM(h.costo_crc) AS costo_crc,
+                   SUM(h.total_crc - h.costo_crc) AS margen_crc,
+                   SUM(h.lineas_sin_costo) AS lineas_sin_costo
+            FROM hecho_venta h
+            {join}
+            {where_sql}
+            GROUP BY {group_by}
+            ORDER BY {orden}
+        """)
+        return lambda db: [_fila_margen(r) for r in db.execute(sql, params).mappings().all()]
+
+    res = en_paralelo({k: consulta(*v) for k, v in _MARGEN_POR.items()})
+    tot = {k: sum(m[k] for m in res["meses"]) for k in ("ventas_crc", "costo_crc", "margen_crc", "lineas_sin_costo")}
+    tot["margen_pct"] = tot["margen_crc"] / tot["ventas_crc"] * 100 if tot["ventas_crc"] else None
+    return {"desde": desde, "hasta": hasta, "totales": tot, **res}
+
+
+@router.get("/pivot")
+def pivot(
+    tabla: str = Query(..., description="venta_det, compra_det, inv_mov, tanda_consumo, tanda_salida, planilla_det_dia o gasto"),
+    filas: str = Query(..., description="columnas de agrupacion separadas por coma, p. ej. producto_id,cliente_id,mes"),
+    medidas: str = Query("id:count", description="columna:agregado separados por coma, p. ej. total_crc:sum,cantidad_base:sum"),
+    desde: date | None = None,
+    hasta: date | None = None,
+    top: int | None = None,
+):
+    # Lee el espejo Parquet (python -m app.cli sync-espejo), no MySQL: no compite con la operacion
+    grupos = [c.strip() for c in filas.split(",") if c.strip()]
+    aggs = []
+    for m in medidas.split(","):
+        if m.strip():
+            col, _, agg = m.strip().partition(":")
+            aggs.append((col, agg or "sum"))
+    try:
+        datos = espejo.pivot(tabla, grupos, aggs, desde=desde, hasta=hasta, top=top)
+    except espejo.EspejoNoDisponible as exc:
+        raise HTTPException(503, str(exc))
+    except ValueError as exc:
+        raise HTTPException(400, str(exc))
+    return {"tabla": tabla, "filas": grupos, "medidas": [f"{c}_{a}" for c, a in aggs], "datos": datos}
+
+
+@router.get("/pronostico")
+def pronostico(
+    horizonte: int = Query(28, ge=1, le=180, description="dias a pronosticar desde hoy"),
+    granularidad: str = Query("dia", pattern="^(dia|semana)$"),
+    metodo: str = Query("perfil", pattern=f"^({'|'.join(METODOS)})$"),
+    historia: int = Query(364, ge=28, le=1092, description="dias de ventas usados para ajustar"),
+    alpha: float = Query(0.3, gt=0, le=1, description="suavizado exponencial (metodo=suavizado)"),
+    producto_id: int | None = None,
+    top: int | None = None,
+    db = Depends(db_dep),
+):
+    # Demanda por PT (uom base): historia en una matriz producto x dia, todos los productos a la vez
+    res = pronosticar(db, horizonte=horizonte, historia=historia, metodo=metodo, alpha=alpha)
+    F, fechas, ids = res["pronostico"], res["fechas"], res["producto_ids"]
+    if granularidad == "semana":
+        # semanas de lunes a domingo; la primera y la ultima pueden ser parciales
+        lunes = [f - timedelta(days=f.weekday()) for f in fechas]
+        fechas = sorted(set(lunes))
+        grupo = np.searchsorted(np.array(fechas), np.array(lunes))
+        W = np.zeros((F.shape[0], len(fechas)))
+        np.add.at(W.T, grupo, F.T)
+        F = W
+    filas = np.arange(len(ids))
+    if producto_id is not None:
+        filas = filas[np.array(ids, dtype=np.int64) == producto_id]
+    totales = F.sum(axis=1)
+    filas = filas[np.argsort(-totales[filas], kind="stable")]
+    if top and top > 0:
+        filas = filas[:top]
+
+    info = {}
+    if len(filas):
+        info = {int(r["id"]): r for r in db.execute(text("""
+            SELECT p.id, p.sku, p.nombre, u.nombre AS uom_nombre
+            FROM producto p LEFT JOIN uom u ON u.id = p.uom_base_id
+            WHERE p.id IN :ids
+        """), {"ids": tuple(ids[i] for i in filas)}).mappings()}
+    productos = []
+    for i in filas:
+        pid = ids[i]
+        r = info.get(pid) or {}
+        err = res["error_pct"][i]
+        productos.append({
+            "producto_id": pid,
+            "sku": r.get("sku"),
+            "nombre": r.get("nombre"),
+            "uom_nombre": r.get("uom_nombre"),
+            "promedio_diario": float(res["promedio_diario"][i]),
+            "total": float(totales[i]),
+            "error_pct": None if np.isnan(err) else float(err),
+            "serie": [{"fecha": f, "cantidad": float(c)} for f, c in zip(fechas, F[i])],
+        })
+    return {"desde": res["desde"], "horizonte": horizonte, "granularidad": granularidad, "metodo": metodo,
+            "productos": productos}
@@ -1,5 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import text
+from ..services.cost_cache import cost_cache
+from ..services.inventory import reconvertir
+from ..services.uom import invalidar_conversor
 from ..utils.deps import db_dep
 
 router = APIRouter(prefix="/uom", tags=["uom"])
@@ -20,3 +23,62 @@ def create_uom(payload: dict, db = Depends(db_dep)):
     db.commit()
     uid = res.lastrowid
     return db.execute(text("SELECT id, codigo, nombre FROM uom WHERE id=:id"), {"id": uid}).mappings().first()
+
+@router.get("/conversiones")
+def list_conversiones(producto_id: int | None = None, db = Depends(db_dep)):
+    base = """
+        SELECT c.id, c.producto_id, c.uom_origen_id, uo.codigo AS uom_origen,
+               c.uom_destino_id, ud.codigo AS uom_destino, c.factor
+        FROM uom_conversion c
+        JOIN uom uo ON uo.id = c.uom_origen_id
+        JOIN uom ud ON ud.id = c.uom_destino_id
+    """
+    params = {}
+    if producto_id:
+        base += " WHERE c.producto_id = :producto_id OR c.producto_id IS NULL"
+        params["producto_id"] = producto_id
+    base += " ORDER BY c.producto_id, uo.codigo, ud.codigo"
+    return db.execute(text(base), params).mappings().all()
+
+@router.post("/conversiones")
+def upsert_conversion(payload: dict, db = Depends(db_dep)):
+    """1 uom_origen = factor uom_destino; producto_id opcional (vacio = conversion generica)."""
+    data = {
+        "producto_id": payload.get("producto_id") or None,
+        "uom_origen_id": payload.get("uom_origen_id"),
+        "uom_destino_id": payload.get("uom_destino_id"),
+        "factor": float(payload.get("factor") or 0),
+    }
+    if not data["uom_origen_id"] or not data["uom_destino_id"]:
+        raise HTTPException(400, "uom_origen_id y uom_destino_id son obligatorios")
+    if data["uom_origen_id"] == data["uom_destino_id"]:
+        raise HTTPException(400, "uom_origen_id y uom_destino_id deben ser distintos")
+    if data["factor"] <= 0:
+        raise HTTPException(400, "factor debe ser mayor a cero")
+    db.execute(text("""
+        INSERT INTO uom_conversion (producto_id, uom_origen_id, uom_destino_id, factor)
+        VALUES (:producto_id, :uom_origen_id, :uom_destino_id, :factor)
+        ON DUPLICATE KEY UPDATE factor = VALUES(factor)
+    """), data)
+    _conversiones_cambiaron(db, data["producto_id"])
+    return {"ok": True}
+
+@router.delete("/conversiones/{conversion_id}")
+def delete_conversion(conversion_id: int, db = Depends(db_dep)):
+    row = db.execute(text("SELECT producto_id FROM uom_conversion WHERE id = :id"),
+                     {"id": conversion_id}).first()
+    if not row:
+        raise HTTPException(404, "conversion no encontrada")
+    db.execute(text("DELETE FROM uom_conversion WHERE id = :id"), {"id": conversion_id})
+    _conversiones_cambiaron(db, row[0])
+    return {"ok": True}
+
+def _conversiones_cambiaron(db, producto_id):
+    # inv_saldo, mp_costo y los hechos guardan cantidades en uom base: se recalculan en la
+    # misma transaccion (solo el producto, o todos si la conversion es generica)
+    try:
+        reconvertir(db, [producto_id] if producto_id else None)
+        db.commit()
+    finally:
+        invalidar_conversor()
+        cost_cache.clear()
@@ -1,24 +1,38 @@
 
+from datetime import date
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
 
+from ..services import hechos
+from ..services.costo_ventas import costos_venta
+from ..services.import_ventas import Catalogos, armar_ticket, guardar_lote, registros
+from ..services.inventory import insert_inv_mov, insert_inv_movs
 from ..utils.deps import db_dep
+from ..utils.pagination import MAX_LIMIT, Keyset, proyectar
 
 router = APIRouter(prefix="/ventas", tags=["ventas"])
 
 
 @router.get("")
 def listar_ventas(
+    response: Response,
     desde: str | None = Query(None, description="Filtrar fecha >= YYYY-MM-DD"),
     hasta: str | None = Query(None, description="Filtrar fecha <= YYYY-MM-DD"),
     include: List[str] | None = Query(None, description="items, totales"),
+    after: str | None = Query(None, description="cursor de la pagina anterior (header X-Next-Cursor)"),
+    limit: int | None = Query(None, ge=1, le=MAX_LIMIT),
+    fields: str | None = Query(None, description="campos a devolver, separados por coma"),
     db = Depends(db_dep)
 ):
     params: dict[str, object] = {}
     filtros: list[str] = []
+    ks = Keyset([("v.fecha", "fecha", "DESC"), ("v.id", "id", "DESC")], after, limit)
+    if ks.where():
+        filtros.append(ks.where())
     if desde:
         filtros.append("v.fecha >= :desde")
         params["desde"] = desde
@@ -29,49 +43,58 @@ def listar_ventas(
     base = """
         SELECT v.id, v.codigo_factura, v.fecha, v.cliente_id, c.nombre AS cliente_nombre,
                v.condicion_pago, v.dias_credito, v.moneda, v.nota,
-               COALESCE(vt.total_crc, 0) AS total_crc
+               v.total_crc, v.lineas
         FROM venta v
         LEFT JOIN cliente c ON c.id = v.cliente_id
-        LEFT JOIN (
-            SELECT venta_id,
-                   SUM((cantidad * precio_unitario_crc) - COALESCE(descuento_crc, 0)) AS total_crc
-            FROM venta_det
-            GROUP BY venta_id
-        ) vt ON vt.venta_id = v.id
     """
     if filtros:
         base += " WHERE " + " AND ".join(filtros)
-    base += " ORDER BY v.fecha DESC, v.id DESC"
+    base += ks.order_by()
+    params.update(ks.params())
 
-    registros = db.execute(text(base), params).mappings().all()
-    ventas = [dict(v) for v in registros]
+    ventas = ks.pagina(db.execute(text(base), params).mappings().all(), response)
     include_set = {item.lower() for item in (include or [])}
 
     if ventas and "items" in include_set:
-        id_params = {f"id{i}": venta["id"] for i, venta in enumerate(ventas)}
-        in_clause = ", ".join(f":id{i}" for i in range(len(id_params)))
-        items_sql = text(f"""
+        items_sql = text("""
             SELECT d.venta_id, d.id, d.producto_id, p.nombre AS producto_nombre,
                    d.uom_id, u.nombre AS uom_nombre,
                    d.cantidad, d.precio_unitario_crc, d.descuento_crc
             FROM venta_det d
             LEFT JOIN producto p ON p.id = d.producto_id
             LEFT JOIN uom u ON u.id = d.uom_id
-            WHERE d.venta_id IN ({in_clause})
+            WHERE d.venta_id IN :ids
             ORDER BY d.venta_id, d.id
         """)
-        items = db.execute(items_sql, id_params).mappings().all()
+        items = db.execute(items_sql, {"ids": tuple(r["id"] for r in ventas)}).mappings().all()
         items_by: dict[int, list[dict]] = {}
         for it in items:
             items_by.setdefault(it["venta_id"], []).append(dict(it))
         for venta in ventas:
             venta["items"] = items_by.get(venta["id"], [])
 
-    return ventas
+    return proyectar(ventas, fields)
+
+
+def _item_venta(item: dict) -> dict:
+    try:
+        data = {
+            "producto_id": item.get("producto_id"),
+            "uom_id": item.get("uom_id"),
+            "cantidad": float(item.get("cantidad") or 0),
+            "precio_unitario_crc": float(item.get("precio_unitario_crc") or 0),
+            "descuento_crc": float(item.get("descuento_crc") or 0),
+        }
+    except (TypeError, ValueError):
+        raise HTTPException(400, "cantidad, precio_unitario_crc y descuento_crc deben ser numericos")
+    if not data["producto_id"] or not data["uom_id"] or data["cantidad"] <= 0:
+        raise HTTPException(400, "producto_id, uom_id y cantidad > 0 requeridos en cada item")
+    return data
 
 
 @router.post("")
 def crear_venta(payload: dict, db = Depends(db_dep)):
+    # items opcionales: encabezado, detalle y kardex en una sola transaccion
     data = {
         "codigo_factura": (payload.get("codigo_factura") or "").strip(),
         "fecha": payload.get("fecha"),
@@ -79,24 +102,110 @@ def crear_venta(payload: dict, db = Depends(db_dep)):
         "condicion_pago": payload.get("condicion_pago"),
         "dias_credito": payload.get("dias_credito"),
         "moneda": payload.get("moneda") or "CRC",
+        "ruta_id": payload.get("ruta_id"),
         "nota": payload.get("nota"),
     }
     if not data["codigo_factura"]:
         raise HTTPException(400, "codigo_factura es obligatorio")
     if not data["fecha"] or not data["cliente_id"]:
         raise HTTPException(400, "fecha y cliente_id son obligatorios")
+    try:
+        data["fecha"] = date.fromisoformat(str(data["fecha"]))
+    except ValueError:
+        raise HTTPException(400, "fecha invalida (YYYY-MM-DD)")
+    items = [_item_venta(it) for it in payload.get("items") or []]
     try:
         res = db.execute(text(
             """
-            INSERT INTO venta (codigo_factura, fecha, cliente_id, condicion_pago, dias_credito, moneda, nota)
-            VALUES (:codigo_factura, :fecha, :cliente_id, :condicion_pago, :dias_credito, :moneda, :nota)
+            INSERT INTO venta (codigo_factura, fecha, cliente_id, condicion_pago, dias_credito, moneda, ruta_id, nota)
+            VALUES (:codigo_factura, :fecha, :cliente_id, :condicion_pago, :dias_credito, :moneda, :ruta_id, :nota)
             """
         ), data)
-        db.commit()
     except IntegrityError as exc:
         db.rollback()
         raise HTTPException(409, "codigo_factura ya existe") from exc
-    return {"id": res.lastrowid}
+    venta_id = res.lastrowid
+    if items:
+        # costo de lo vendido congelado al momento de la venta (reportes de margen)
+        for it, costo in zip(items, costos_venta(db, items, fecha=data["fecha"])):
+            it["costo_unitario_crc"] = costo
+        db.execute(text("""
+            INSERT INTO venta_det (venta_id, producto_id, uom_id, cantidad, precio_unitario_crc, descuento_crc,
+                                   costo_unitario_crc)
+            VALUES (:venta_id, :producto_id, :uom_id, :cantidad, :precio_unitario_crc, :descuento_crc,
+                    :costo_unitario_crc)
+        """), [{"venta_id": venta_id, **it} for it in items])
+        insert_inv_movs(db, [dict(
+            fecha=data["fecha"], producto_id=it["producto_id"], uom_id=it["uom_id"], tipo="OUT",
+            cantidad=it["cantidad"], motivo="VENTA", ref_tabla="venta", ref_id=venta_id,
+        ) for it in items])
+    hechos.registrar_ventas(db, [{"fecha": data["fecha"], "cliente_id": data["cliente_id"],
+                                  "ruta_id": data["ruta_id"], "items": items}])
+    db.commit()
+    total = sum(it["cantidad"] * it["precio_unitario_crc"] - it["descuento_crc"] for it in items)
+    return {"id": venta_id, "items": len(items), "total_crc": total}
+
+
+@router.post("/import")
+async def importar_ventas(
+    request: Request,
+    formato: str = Query("csv", pattern="^(csv|ndjson)$"),
+    lote: int = Query(500, ge=1, le=5000, description="filas por transaccion"),
+    db = Depends(db_dep),
+):
+    """Importa el archivo diario del POS enviado como cuerpo (CSV con encabezado o NDJSON).
+
+    Una fila por item: codigo_factura, fecha, cliente | cliente_id, sku | producto_id,
+    uom | uom_id (por defecto la base), cantidad, precio_unitario_crc, descuento_crc.
+    Las filas de un ticket deben venir seguidas. Un ticket con alguna fila invalida
+    se rechaza completo; el resto del archivo sigue.
+    """
+    cat = await run_in_threadpool(Catalogos, db)
+    res = {"lineas": 0, "ventas": 0, "items": 0, "duplicadas": 0, "errores": []}
+    vistos: set[str] = set()
+    tickets: list[dict] = []
+    actual: list[tuple[int, dict]] = []
+    filas = 0
+
+    def cerrar_ticket():
+        if not actual:
+            return
+        try:
+            t = armar_ticket(cat, actual)
+        except ValueError as exc:
+            res["errores"].append({"linea": actual[0][0], "codigo_factura": actual[0][1]["codigo_factura"],
+                                   "error": str(exc)})
+            return
+        tickets.append(dict(t, linea=actual[0][0]))
+
+    cod_actual = None
+    async for n, fila, error in registros(request.stream(), formato):
+        res["lineas"] += 1
+        cod = str((fila or {}).get("codigo_factura") or "").strip()
+        if error or not cod:
+            res["errores"].append({"linea": n, "error": error or "codigo_factura requerido"})
+            continue
+        if cod != cod_actual:
+            cerrar_ticket()
+            actual = []
+            cod_actual = cod
+            if filas >= lote:
+                await run_in_threadpool(guardar_lote, db, tickets, res)
+                tickets, filas = [], 0
+            if cod in vistos:
+                res["errores"].append({"linea": n, "codigo_factura": cod,
+                                       "error": "codigo_factura repetido en el archivo (filas no contiguas)"})
+                cod_actual = None
+                continue
+            vistos.add(cod)
+        if cod_actual is None:
+            continue
+        fila["codigo_factura"] = cod
+        actual.append((n, fila))
+        filas += 1
+    cerrar_ticket()
+    await run_in_threadpool(guardar_lote, db, tickets, res)
+    return res
 
 
 @router.post("/{venta_id}/items")
@@ -111,24 +220,27 @@ def agregar_item(venta_id: int, payload: dict, db = Depends(db_dep)):
     }
     if not data["producto_id"]:
         raise HTTPException(400, "producto_id requerido")
-    det = db.execute(text("""
-        INSERT INTO venta_det (venta_id, producto_id, uom_id, cantidad, precio_unitario_crc, descuento_crc)
-        VALUES (:venta_id, :producto_id, :uom_id, :cantidad, :precio_unitario_crc, :descuento_crc)
-    """), data)
+    venta = db.execute(text("SELECT fecha, cliente_id, ruta_id FROM venta WHERE id = :id"),
+                       {"id": venta_id}).mappings().first()
+    if not venta:
+        raise HTTPException(404, "venta no encontrada")
+    data["costo_unitario_crc"] = costos_venta(db, [data], fecha=venta["fecha"])[0]
     db.execute(text("""
-        INSERT INTO inv_mov (fecha, producto_id, uom_id, cantidad, tipo, motivo, ref_tabla, ref_id)
-        SELECT v.fecha, d.producto_id, d.uom_id, -d.cantidad, 'OUT', 'VENTA', 'venta', d.venta_id
-        FROM venta v JOIN venta_det d ON d.venta_id = v.id
-        WHERE d.id = :det_id
-    """), {"det_id": det.lastrowid})
+        INSERT INTO venta_det (venta_id, producto_id, uom_id, cantidad, precio_unitario_crc, descuento_crc,
+                               costo_unitario_crc)
+        VALUES (:venta_id, :producto_id, :uom_id, :cantidad, :precio_unitario_crc, :descuento_crc,
+                :costo_unitario_crc)
+    """), data)
+    insert_inv_mov(
+        db, fecha=venta["fecha"], producto_id=data["producto_id"], uom_id=data["uom_id"],
+        tipo="OUT", cantidad=data["cantidad"], motivo="VENTA", ref_tabla="venta", ref_id=venta_id,
+    )
+    hechos.registrar_ventas(db, [{**venta, "nuevo": False, "items": [data]}])
     db.commit()
     return {"ok": True}
 
 
 @router.get("/{venta_id}/totales")
 def totales(venta_id: int, db = Depends(db_dep)):
-    row = db.execute(text("""
-        SELECT SUM(cantidad * precio_unitario_crc - COALESCE(descuento_crc, 0)) AS total_crc
-        FROM venta_det WHERE venta_id = :id
-    """), {"id": venta_id}).mappings().first()
-    return row or {"total_crc": 0}
+    row = db.execute(text("SELECT total_crc, lineas FROM venta WHERE id = :id"), {"id": venta_id}).mappings().first()
+    return row or {"total_crc": 0, "lineas": 0}
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from threading import Lock
+
+from ..config import settings
+
+
+class CostCache:
+    """Cache LRU en proceso para resultados de costeo.
+
+    Cada entrada declara sus dependencias como tuplas, p. ej. ("receta", 3) o
+    ("mp", 12); invalidate() descarta solo las entradas que dependen de ellas.
+    Con varios workers de uvicorn cada proceso tiene su propia cache.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()   # key -> (valor, deps)
+        self._index: dict[tuple, set] = {}        # dep -> keys
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidaciones = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, deps=()):
+        deps = frozenset(deps)
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, deps)
+            for dep in deps:
+                self._index.setdefault(dep, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+
+    def invalidate(self, *deps):
+        with self._lock:
+            for dep in deps:
+                for key in self._index.pop(dep, ()):
+                    if key in self._data:
+                        self._drop(key)
+                        self.invalidaciones += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidaciones += len(self._data)
+            self._data.clear()
+            self._index.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else None,
+                "invalidaciones": self.invalidaciones,
+            }
+
+    def _drop(self, key):
+        _, deps = self._data.pop(key)
+        for dep in deps:
+            keys = self._index.get(dep)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[dep]
+
+
+cost_cache = CostCache(settings.COST_CACHE_SIZE)
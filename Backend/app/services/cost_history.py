@@ -0,0 +1,81 @@
+from bisect import bisect_right
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .uom import conversor
+
+
+def as_date(value) -> date | None:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+class HistorialCostos:
+    """Historial de precios de compra por MP, ordenado por fecha.
+
+    Equivale a fn_costo_mp_al(fecha, mp): ultimo costo con fecha <= la pedida
+    (desempate por id de compra_det) y costo_estandar_crc si no hay compras previas.
+    Los costos quedan por uom base del producto.
+    """
+
+    def __init__(self, series: dict[int, tuple[list, list]], estandar: dict[int, float]):
+        self._series = series
+        self._estandar = estandar
+
+    def compra_al(self, producto_id, fecha) -> float | None:
+        """Ultimo costo de compra con fecha <= la pedida; None si no hay compras previas."""
+        serie = self._series.get(int(producto_id))
+        ref = as_date(fecha)
+        if serie and ref is not None:
+            fechas, precios = serie
+            i = bisect_right(fechas, ref)
+            if i:
+                return precios[i - 1]
+        return None
+
+    def costo_al(self, producto_id, fecha) -> float:
+        costo = self.compra_al(producto_id, fecha)
+        return costo if costo is not None else self._estandar.get(int(producto_id), 0.0)
+
+    def valorar(self, filas, producto_key="producto_id", fecha_key="fecha") -> list[float]:
+        """Costo unitario historico para cada fila (dicts o mappings)."""
+        return [self.costo_al(f[producto_key], f[fecha_key]) for f in filas]
+
+
+def cargar_historial(db: Session, producto_ids, hasta=None) -> HistorialCostos:
+    """Carga en dos consultas el historial de compras y el costo estandar de las MP indicadas."""
+    ids = tuple({int(x) for x in producto_ids})
+    if not ids:
+        return HistorialCostos({}, {})
+    params = {"ids": ids}
+    filtro_fecha = ""
+    if hasta is not None:
+        filtro_fecha = "AND c.fecha <= :hasta"
+        params["hasta"] = as_date(hasta)
+    rows = db.execute(text(f"""
+        SELECT d.producto_id, d.uom_id, c.fecha, d.costo_unitario_crc
+        FROM compra_det d
+        JOIN compra c ON c.id = d.compra_id
+        WHERE d.producto_id IN :ids {filtro_fecha}
+        ORDER BY d.producto_id, c.fecha, d.id
+    """), params).mappings().all()
+    conv = conversor(db)
+    series: dict[int, tuple[list, list]] = {}
+    for r in rows:
+        fechas, precios = series.setdefault(int(r["producto_id"]), ([], []))
+        fechas.append(as_date(r["fecha"]))
+        precios.append(float(r["costo_unitario_crc"] or 0) / conv.factor(r["producto_id"], r["uom_id"]))
+    estandar = {
+        int(r["id"]): float(r["costo_estandar_crc"] or 0)
+        for r in db.execute(text("""
+            SELECT id, costo_estandar_crc FROM producto WHERE id IN :ids
+        """), {"ids": ids}).mappings().all()
+    }
+    return HistorialCostos(series, estandar)
@@ -1,6 +1,11 @@
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
+from . import overhead
+from .cost_cache import cost_cache
+from .cost_history import cargar_historial
+from .uom import conversor, crear_tabla_factores
+
 def receta_costos(db: Session, receta_id: int):
     # Usa vistas creadas: v_costo_receta_total y v_costo_receta_directo
     row = db.execute(text("""
@@ -9,3 +14,408 @@ def receta_costos(db: Session, receta_id: int):
         WHERE receta_id = :rid
     """), {"rid": receta_id}).mappings().first()
     return dict(row) if row else {}
+
+
+# =======================
+# Indice de costos de MP (mp_costo)
+# =======================
+_UPSERT_MP_COSTO = text("""
+    INSERT INTO mp_costo (producto_id, ultimo_costo_crc, ultima_fecha, ultimo_det_id,
+                          cantidad_acum, costo_acum_crc, descuento_acum_crc)
+    VALUES (:producto_id, :costo_unitario_crc, :fecha, :det_id,
+            :cantidad, :cantidad * :costo_unitario_crc, :descuento_crc)
+    ON DUPLICATE KEY UPDATE
+      -- el orden importa: ultima_fecha se evalua al final usando ultimo_det_id ya actualizado
+      ultimo_costo_crc = IF(ultima_fecha IS NULL OR (VALUES(ultima_fecha), VALUES(ultimo_det_id)) >= (ultima_fecha, ultimo_det_id),
+                            VALUES(ultimo_costo_crc), ultimo_costo_crc),
+      ultimo_det_id = IF(ultima_fecha IS NULL OR (VALUES(ultima_fecha), VALUES(ultimo_det_id)) >= (ultima_fecha, ultimo_det_id),
+                         VALUES(ultimo_det_id), ultimo_det_id),
+      ultima_fecha = IF(ultimo_det_id = VALUES(ultimo_det_id), VALUES(ultima_fecha), ultima_fecha),
+      cantidad_acum = cantidad_acum + VALUES(cantidad_acum),
+      costo_acum_crc = costo_acum_crc + VALUES(costo_acum_crc),
+      descuento_acum_crc = descuento_acum_crc + VALUES(descuento_acum_crc)
+""")
+
+
+def registrar_costos_compra(db: Session, lineas: list[dict]):
+    """Actualiza mp_costo con lineas de compra_det recien insertadas (sin commit).
+
+    Cada linea: det_id, producto_id, uom_id, fecha (de la compra), cantidad, costo_unitario_crc,
+    descuento_crc. Cantidad y costo se guardan en la uom base del producto.
+    """
+    if not lineas:
+        return
+    conv = conversor(db)
+    rows = []
+    for ln in lineas:
+        f = conv.factor(ln["producto_id"], ln.get("uom_id"))
+        rows.append({
+            "det_id": ln["det_id"],
+            "producto_id": ln["producto_id"],
+            "fecha": ln["fecha"],
+            "cantidad": float(ln.get("cantidad") or 0) * f,
+            "costo_unitario_crc": float(ln.get("costo_unitario_crc") or 0) / f,
+            "descuento_crc": float(ln.get("descuento_crc") or 0),
+        })
+    db.execute(_UPSERT_MP_COSTO, rows)
+
+
+def costos_ultimos(db: Session, producto_ids) -> dict[int, float]:
+    """Ultimo costo de compra por MP, por uom base (lectura directa de mp_costo)."""
+    ids = tuple({int(x) for x in producto_ids})
+    if not ids:
+        return {}
+    rows = db.execute(text("""
+        SELECT producto_id, ultimo_costo_crc FROM mp_costo WHERE producto_id IN :ids
+    """), {"ids": ids}).mappings().all()
+    return {int(r["producto_id"]): float(r["ultimo_costo_crc"] or 0) for r in rows}
+
+
+def rebuild_mp_costo(db: Session, producto_ids=None) -> int:
+    """Recalcula mp_costo desde compra_det (en uom base); completo o solo producto_ids. Devuelve filas generadas."""
+    ids = tuple({int(x) for x in producto_ids}) if producto_ids is not None else None
+    if ids == ():
+        return 0
+    filtro = "WHERE producto_id IN :ids" if ids else ""
+    params = {"ids": ids} if ids else {}
+    crear_tabla_factores(db, f"SELECT DISTINCT producto_id, uom_id FROM compra_det {filtro}", params)
+    db.execute(text(f"DELETE FROM mp_costo {filtro}"), params)
+    # tmp_uom_factor es TEMPORARY: MySQL no permite leerla dos veces en la misma consulta
+    res = db.execute(text(f"""
+        INSERT INTO mp_costo (producto_id, ultimo_costo_crc, ultima_fecha, ultimo_det_id,
+                              cantidad_acum, costo_acum_crc, descuento_acum_crc)
+        SELECT producto_id, costo_base, fecha, id, cantidad_acum, costo_acum_crc, descuento_acum_crc
+        FROM (
+            SELECT d.producto_id, d.id, c.fecha,
+                   d.costo_unitario_crc / COALESCE(f.factor, 1) AS costo_base,
+                   SUM(d.cantidad * COALESCE(f.factor, 1)) OVER w AS cantidad_acum,
+                   SUM(d.cantidad * d.costo_unitario_crc) OVER w AS costo_acum_crc,
+                   SUM(d.descuento_crc) OVER w AS descuento_acum_crc,
+                   ROW_NUMBER() OVER (PARTITION BY d.producto_id ORDER BY c.fecha DESC, d.id DESC) AS rn
+            FROM compra_det d
+            JOIN compra c ON c.id = d.compra_id
+            LEFT JOIN tmp_uom_factor f ON f.producto_id = d.producto_id AND f.uom_id = d.uom_id
+            {filtro.replace("producto_id", "d.producto_id")}
+            WINDOW w AS (PARTITION BY d.producto_id)
+        ) x
+        WHERE rn = 1
+    """), params)
+    return res.rowcount
+
+
+# =======================
+# Costeo de recetas
+# =======================
+class CicloRecetasError(ValueError):
+    """Una receta se usa, directa o indirectamente, como ingrediente de si misma."""
+
+    def __init__(self, ciclo: list[int]):
+        self.ciclo = ciclo
+        super().__init__("ciclo en recetas: " + " -> ".join(str(r) for r in ciclo))
+
+
+def ciclo_desde(db: Session, receta_id: int) -> list[int] | None:
+    """Ciclo de subrecetas que pasa por receta_id (como en CicloRecetasError.ciclo), o None.
+
+    Una receta apunta a la que produce cada ingrediente suyo (receta_por_producto).
+    Para validar al escribir: toda arista nueva de la receta editada sale o llega a ella.
+    """
+    productores = receta_por_producto(db)
+    hijos: dict[int, set[int]] = {}
+    for rid, pid in db.execute(text("SELECT receta_id, producto_id FROM receta_det")).all():
+        sub = productores.get(int(pid))
+        if sub is not None:
+            hijos.setdefault(int(rid), set()).add(sub)
+    padre: dict[int, int | None] = {receta_id: None}
+    pila = [receta_id]
+    while pila:
+        rid = pila.pop()
+        for sub in hijos.get(rid, ()):
+            if sub == receta_id:
+                camino = [rid]
+                while padre[camino[-1]] is not None:
+                    camino.append(padre[camino[-1]])
+                return camino[::-1] + [receta_id]
+            if sub not in padre:
+                padre[sub] = rid
+                pila.append(sub)
+    return None
+
+
+def costear_recetas(
+    db: Session,
+    receta_ids=None,
+    producto_salida_id: int | None = None,
+    pct_ind: float | None = None,
+    rendimiento: float | None = None,
+) -> dict[int, dict]:
+    """Costea varias recetas usando cost_cache; solo recalcula las que no estan en cache.
+
+    Devuelve {receta_id: resultado} con la misma forma que /costeo/recetas/{id};
+    las recetas sin ingredientes no aparecen. Lanza CicloRecetasError si hay ciclos.
+    Sin pct_ind el indirecto sale de la tasa del mes actual (services/overhead).
+    """
+    if receta_ids is None or producto_salida_id is not None:
+        where, params = [], {}
+        if receta_ids is not None:
+            where.append("id IN :ids")
+            params["ids"] = tuple({int(x) for x in receta_ids}) or (0,)
+        if producto_salida_id is not None:
+            where.append("producto_salida_id = :psid")
+            params["psid"] = producto_salida_id
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        receta_ids = db.execute(text(f"SELECT id FROM receta {where_sql}"), params).scalars().all()
+
+    mes = overhead.mes_de(None)
+    out: dict[int, dict] = {}
+    faltan = []
+    for rid in sorted({int(x) for x in receta_ids}):
+        hit = cost_cache.get(("receta", rid, pct_ind, rendimiento, mes))
+        if hit is None:
+            faltan.append(rid)
+        elif hit:
+            out[rid] = hit
+    if faltan:
+        calc, deps_map = _calcular_recetas(db, faltan, pct_ind=pct_ind, rendimiento=rendimiento)
+        for rid in faltan:
+            res = calc.get(rid)
+            deps = set(deps_map.get(rid, ())) | {("receta", rid)}
+            if res:
+                out[rid] = res
+            # {} marca receta sin ingredientes, para no recalcularla en cada llamada
+            cost_cache.put(("receta", rid, pct_ind, rendimiento, mes), res or {}, deps)
+    return dict(sorted(out.items()))
+
+
+def receta_por_producto(db: Session) -> dict[int, int]:
+    """producto -> receta que lo produce (la de menor id si hay varias)."""
+    return {
+        int(r["producto_id"]): int(r["receta_id"])
+        for r in db.execute(text("""
+            SELECT producto_id, MIN(receta_id) AS receta_id
+            FROM receta_salida GROUP BY producto_id
+        """)).mappings().all()
+    }
+
+
+def _calcular_recetas(
+    db: Session,
+    receta_ids,
+    pct_ind: float | None = None,
+    rendimiento: float | None = None,
+) -> tuple[dict[int, dict], dict[int, frozenset]]:
+    """Costeo sin cache de resultados, recorriendo las subrecetas como un DAG.
+
+    Un ingrediente que es salida de otra receta se valora al costo directo unitario
+    de esa receta (el indirecto se aplica una sola vez, en la receta final). Cada
+    nodo se calcula una vez por llamada y su unitario queda en cost_cache como
+    ("nodo", receta_id), asi que el costo es lineal en la cantidad de aristas.
+    Devuelve (resultados, dependencias por receta).
+    """
+    ids = {int(x) for x in receta_ids}
+    if not ids:
+        return {}, {}
+
+    productores = receta_por_producto(db)
+
+    # Carga por niveles: una consulta de ingredientes por nivel de profundidad,
+    # sin bajar por subrecetas cuyo nodo ya esta en cache.
+    ings_por_receta: dict[int, list] = {}
+    nodos_cache: dict[int, dict] = {}
+    pendientes = set(ids)
+    while pendientes:
+        for rid in pendientes:
+            ings_por_receta[rid] = []
+        rows = db.execute(text("""
+            SELECT i.receta_id, i.producto_id, p.nombre, i.uom_id, i.cantidad
+            FROM receta_det i
+            JOIN producto p ON p.id = i.producto_id
+            WHERE i.receta_id IN :ids
+            ORDER BY i.receta_id, i.id
+        """), {"ids": tuple(pendientes)}).mappings().all()
+        nuevos = set()
+        for r in rows:
+            ings_por_receta[int(r["receta_id"])].append(r)
+            sub = productores.get(int(r["producto_id"]))
+            if sub is None or sub in ings_por_receta or sub in nodos_cache or sub in nuevos:
+                continue
+            hit = cost_cache.get(("nodo", sub))
+            if hit is not None:
+                nodos_cache[sub] = hit
+            else:
+                nuevos.add(sub)
+        pendientes = nuevos
+
+    hojas = {
+        int(r["producto_id"])
+        for rows in ings_por_receta.values() for r in rows
+        if int(r["producto_id"]) not in productores
+    }
+    cost_map = costos_ultimos(db, hojas)
+    conv = conversor(db)
+    rend_map: dict[int, float] = {}
+    for r in db.execute(text("""
+        SELECT receta_id, producto_id, uom_id, rendimiento
+        FROM receta_salida WHERE receta_id IN :ids
+    """), {"ids": tuple(ings_por_receta)}).mappings().all():
+        rid = int(r["receta_id"])
+        rend_map[rid] = rend_map.get(rid, 0.0) + float(r["rendimiento"] or 0) * conv.factor(r["producto_id"], r["uom_id"])
+
+    nodos: dict[int, dict] = {}
+    en_curso: list[int] = []
+
+    def nodo(rid: int) -> dict:
+        if rid in nodos:
+            return nodos[rid]
+        if rid in nodos_cache:
+            return nodos_cache[rid]
+        if rid in en_curso:
+            raise CicloRecetasError(en_curso[en_curso.index(rid):] + [rid])
+        en_curso.append(rid)
+        lineas, directo, deps = [], 0.0, {("receta", rid)}
+        for it in ings_por_receta.get(rid, ()):
+            pid = int(it["producto_id"])
+            sub = productores.get(pid)
+            deps.add(("mp", pid))
+            if sub is not None:
+                n = nodo(sub)
+                unit_base = n["unitario_directo_crc"] or 0.0
+                deps |= n["deps"]
+            else:
+                unit_base = float(cost_map.get(pid, 0))
+            # costo por la uom de la linea (los costos se llevan por uom base)
+            unit = unit_base * conv.factor(pid, it["uom_id"])
+            total = unit * float(it["cantidad"] or 0)
+            lineas.append({
+                "producto_id": it["producto_id"], "nombre": it["nombre"],
+                "uom_id": it["uom_id"], "cantidad": it["cantidad"], "costo_unitario_crc": unit, "costo_total_crc": total,
+                "subreceta_id": sub,
+            })
+            directo += total
+        en_curso.pop()
+        rend = rend_map.get(rid, 0.0)
+        deps = frozenset(deps)
+        resumen = {"unitario_directo_crc": (directo / rend) if rend > 0 else None, "deps": deps}
+        cost_cache.put(("nodo", rid), resumen, deps)
+        nodos[rid] = {**resumen, "ingredientes": lineas, "costo_directo_crc": directo}
+        return nodos[rid]
+
+    if pct_ind is None:
+        tasa = overhead.tasa_mes(db)
+    else:
+        tasa = {"metodo": "PCT_DIRECTO", "tasa": float(pct_ind), "deps": []}
+
+    out: dict[int, dict] = {}
+    deps_map: dict[int, frozenset] = {}
+    for rid in sorted(ids):
+        n = nodo(rid)
+        deps_map[rid] = n["deps"] | frozenset(tasa["deps"])
+        if not n["ingredientes"]:
+            continue
+        directo = n["costo_directo_crc"]
+        rend = rendimiento or rend_map.get(rid, 0.0)
+        indirecto = overhead.indirecto(tasa, directo, unidades=rend)
+        total = directo + indirecto
+        out[rid] = {
+            "receta_id": rid,
+            "ingredientes": n["ingredientes"],
+            "costo_directo_crc": directo,
+            "costo_indirecto_crc": indirecto,
+            "metodo_indirecto": tasa["metodo"],
+            "costo_total_crc": total,
+            "rendimiento": rend,
+            "unitario_crc": (total / rend) if (rend and rend > 0) else None,
+        }
+    return out, deps_map
+
+
+# =======================
+# Costeo de tandas
+# =======================
+def costear_tandas(db: Session, tanda_ids) -> dict[int, dict]:
+    """Costea tandas con cost_cache; las que faltan se calculan en un numero fijo de consultas.
+
+    Los consumos se valoran al costo de compra a la fecha de la tanda (historial) y el
+    indirecto con la tasa de su mes. Las tandas que no existen no aparecen en el resultado.
+    """
+    out: dict[int, dict] = {}
+    faltan = []
+    for tid in sorted({int(x) for x in tanda_ids}):
+        hit = cost_cache.get(("tanda", tid))
+        if hit is None:
+            faltan.append(tid)
+        else:
+            out[tid] = hit
+    if faltan:
+        calc, deps_map = _calcular_tandas(db, faltan)
+        for tid, res in calc.items():
+            cost_cache.put(("tanda", tid), res, deps_map[tid])
+            out[tid] = res
+    return dict(sorted(out.items()))
+
+
+def _calcular_tandas(db: Session, tanda_ids) -> tuple[dict[int, dict], dict[int, list]]:
+    ids = tuple({int(x) for x in tanda_ids})
+    if not ids:
+        return {}, {}
+
+    fechas = {
+        int(r["id"]): r["fecha"]
+        for r in db.execute(text("SELECT id, fecha FROM tanda WHERE id IN :ids"), {"ids": ids}).mappings().all()
+    }
+    # ids inexistentes no se costean (ni se guardan en cache como costo cero)
+    ids = tuple(tid for tid in ids if tid in fechas)
+    if not ids:
+        return {}, {}
+    cons = db.execute(text("""
+        SELECT c.tanda_id, c.producto_id, p.nombre, c.uom_id, SUM(c.cantidad) AS cantidad
+        FROM tanda_consumo c
+        JOIN producto p ON p.id = c.producto_id
+        WHERE c.tanda_id IN :ids
+        GROUP BY c.tanda_id, c.producto_id, p.nombre, c.uom_id
+        ORDER BY c.tanda_id, c.producto_id, c.uom_id
+    """), {"ids": ids}).mappings().all()
+    # costo de cada MP a la fecha de su tanda (como fn_costo_mp_al), con una sola carga del historial
+    hist = cargar_historial(db, (r["producto_id"] for r in cons), hasta=max(fechas.values()))
+    conv = conversor(db)
+    salidas: dict[int, float] = {}
+    for r in db.execute(text("""
+        SELECT tanda_id, producto_id, uom_id, SUM(cantidad) AS cantidad
+        FROM tanda_salida WHERE tanda_id IN :ids
+        GROUP BY tanda_id, producto_id, uom_id
+    """), {"ids": ids}).mappings().all():
+        tid = int(r["tanda_id"])
+        salidas[tid] = salidas.get(tid, 0.0) + float(r["cantidad"] or 0) * conv.factor(r["producto_id"], r["uom_id"])
+    # una tasa por mes (en cache), no por tanda
+    tasas = {mes: overhead.tasa_mes(db, mes) for mes in {overhead.mes_de(f) for f in fechas.values()}}
+
+    out = {tid: {"tanda_id": tid, "fecha": fechas[tid], "consumos": [], "costo_directo_crc": 0.0} for tid in ids}
+    for it in cons:
+        res = out[int(it["tanda_id"])]
+        unit = hist.costo_al(it["producto_id"], res["fecha"]) * conv.factor(it["producto_id"], it["uom_id"])
+        total = unit * float(it["cantidad"] or 0)
+        res["consumos"].append({
+            "producto_id": it["producto_id"], "nombre": it["nombre"] or f"#{it['producto_id']}",
+            "uom_id": it["uom_id"], "cantidad": it["cantidad"], "costo_unitario_crc": unit, "costo_total_crc": total
+        })
+        res["costo_directo_crc"] += total
+
+    deps_map: dict[int, list] = {}
+    for tid, res in out.items():
+        directo = res["costo_directo_crc"]
+        outs = salidas.get(tid, 0.0)
+        deps = [("tanda", tid)] + [("mp", int(c["producto_id"])) for c in res["consumos"]]
+        tasa = tasas[overhead.mes_de(fechas[tid])]
+        indirecto = overhead.indirecto(tasa, directo, unidades=outs, horas=overhead.horas_tanda(tasa, fechas[tid]))
+        deps += tasa["deps"]
+        total = directo + indirecto
+        res.update({
+            "costo_indirecto_crc": indirecto,
+            "metodo_indirecto": tasa["metodo"],
+            "costo_total_crc": total,
+            "cantidad_salida": outs,
+            "unitario_crc": (total / outs) if outs else None,
+        })
+        deps_map[tid] = deps
+    return out, deps_map
+
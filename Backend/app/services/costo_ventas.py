@@ -0,0 +1,130 @@
+from datetime import date
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import overhead
+from .cost_history import as_date, cargar_historial
+from .costing import CicloRecetasError, costear_recetas, costos_ultimos, receta_por_producto
+from .simulacion import matriz_recetas
+from .uom import conversor
+
+
+def _estandar(db: Session, pids) -> dict[int, float]:
+    ids = tuple({int(x) for x in pids})
+    if not ids:
+        return {}
+    return {
+        int(r["id"]): float(r["costo_estandar_crc"])
+        for r in db.execute(text("""
+            SELECT id, costo_estandar_crc FROM producto WHERE id IN :ids AND costo_estandar_crc IS NOT NULL
+        """), {"ids": ids}).mappings()
+    }
+
+
+def _unitarios_actuales(db: Session, pids: set[int]) -> dict[int, float]:
+    # costos vigentes (en cache): receta del mes, estandar o ultimo costo de compra
+    unit_base: dict[int, float] = {}
+    productores = receta_por_producto(db)
+    recetas = {productores[p] for p in pids if p in productores}
+    if recetas:
+        try:
+            costos = costear_recetas(db, recetas)
+        except CicloRecetasError:
+            costos = {}
+        for p in pids:
+            res = costos.get(productores.get(p))
+            if res and res["unitario_crc"] is not None:
+                unit_base[p] = res["unitario_crc"]
+    faltan = pids - set(unit_base)
+    if faltan:
+        unit_base.update(_estandar(db, faltan))
+        unit_base.update(costos_ultimos(db, pids - set(unit_base)))
+    return unit_base
+
+
+def _unitarios_al(db: Session, pares: set[tuple[int, date]]) -> dict[tuple[int, date], float]:
+    """Unitario por uom base de cada (producto, fecha) con los costos de compra a esa fecha.
+
+    Recetas: MP aplanadas de matriz_recetas x historial de compras + indirecto con la tasa
+    del mes de la fecha (mismo criterio que costear_recetas). Sin receta: estandar o la
+    ultima compra a la fecha.
+    """
+    try:
+        m = matriz_recetas(db)
+    except CicloRecetasError:
+        m = {"receta_ids": [], "mp_ids": [], "cantidades": np.zeros((0, 0)), "rendimiento": np.zeros(0)}
+    fila = {rid: i for i, rid in enumerate(m["receta_ids"])}
+    A, rend = m["cantidades"], m["rendimiento"]
+    productores = receta_por_producto(db)
+    receta: dict[int, int] = {}
+    for pid, _ in pares:
+        i = fila.get(productores.get(pid))
+        # recetas sin ingredientes o sin rendimiento caen al estandar, como en costear_recetas
+        if i is not None and rend[i] > 0 and A[i].any():
+            receta[pid] = i
+    filas = sorted(set(receta.values()))
+    cols = np.flatnonzero(A[filas].any(axis=0)) if filas else np.zeros(0, dtype=int)
+    mps = [m["mp_ids"][j] for j in cols]
+    otros = {pid for pid, _ in pares if pid not in receta}
+    estandar = _estandar(db, otros)
+    hist = cargar_historial(db, set(mps) | (otros - set(estandar)), hasta=max(f for _, f in pares))
+
+    out: dict[tuple[int, date], float] = {}
+    for pid, fecha in pares:
+        if pid in receta:
+            i = receta[pid]
+            precios = np.array([hist.costo_al(mp, fecha) for mp in mps])
+            directo = float(A[i, cols] @ precios)
+            tasa = overhead.tasa_mes(db, overhead.mes_de(fecha))
+            out[(pid, fecha)] = float((directo + overhead.indirecto(tasa, directo, unidades=rend[i])) / rend[i])
+        elif pid in estandar:
+            out[(pid, fecha)] = estandar[pid]
+        else:
+            costo = hist.compra_al(pid, fecha)
+            if costo is not None:
+                out[(pid, fecha)] = costo
+    return out
+
+
+def costos_venta(db: Session, items: list[dict], fecha=None) -> list[float | None]:
+    """Costo unitario por la uom de cada linea, para congelarlo en venta_det.
+
+    Ventas del mes en curso: unitario de costear_recetas (directo + indirecto del mes, en
+    cache); si no, producto.costo_estandar_crc y luego el ultimo costo de compra. Ventas de
+    meses anteriores (importaciones atrasadas, backfill): los mismos criterios con los
+    costos de compra a la fecha de la venta y la tasa de indirectos de su mes.
+    None si no hay ninguno. items: [{producto_id, uom_id, fecha?}] en el mismo orden; la
+    fecha del item (si la trae) manda sobre la de la venta.
+    """
+    if not items:
+        return []
+    inicio_mes = date.today().replace(day=1)
+    # date, datetime o texto ISO; un texto no ISO lanza ValueError (validar antes de llamar)
+    fechas = [as_date(it.get("fecha") or fecha) for it in items]
+    pids = [int(it["producto_id"]) for it in items]
+    pasadas = {(p, f) for p, f in zip(pids, fechas) if f is not None and f < inicio_mes}
+    vigentes = {p for p, f in zip(pids, fechas) if (p, f) not in pasadas}
+    unit_actual = _unitarios_actuales(db, vigentes) if vigentes else {}
+    unit_al = _unitarios_al(db, pasadas) if pasadas else {}
+    conv = conversor(db)
+    out = []
+    for it, pid, f in zip(items, pids, fechas):
+        unit = unit_al.get((pid, f)) if (pid, f) in pasadas else unit_actual.get(pid)
+        out.append(unit * conv.factor(pid, it["uom_id"]) if unit is not None else None)
+    return out
+
+
+def costear_ventas_pendientes(db: Session) -> int:
+    """Llena costo_unitario_crc de las lineas de venta sin costo, con los costos de su fecha (sin commit)."""
+    lineas = db.execute(text("""
+        SELECT d.id, d.producto_id, d.uom_id, v.fecha
+        FROM venta_det d
+        JOIN venta v ON v.id = d.venta_id
+        WHERE d.costo_unitario_crc IS NULL
+    """)).mappings().all()
+    filas = [{"id": ln["id"], "costo": c} for ln, c in zip(lineas, costos_venta(db, lineas)) if c is not None]
+    if filas:
+        db.execute(text("UPDATE venta_det SET costo_unitario_crc = :costo WHERE id = :id"), filas)
+    return len(filas)
@@ -0,0 +1,150 @@
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..routers.planilla import FACTOR_DOBLE_DEFAULT, FACTOR_EXTRA_DEFAULT, FACTOR_FERIADO_DEFAULT
+from .cost_history import cargar_historial
+from .paralelo import en_paralelo
+
+
+def _dias(db: Session, rango: dict) -> dict[str, list[dict]]:
+    # una fila por dia en hecho_dia (ventas, costo de lo vendido, compras y gastos ya agregados)
+    rows = db.execute(text("""
+        SELECT fecha, ventas_crc, costo_ventas_crc, facturas, compras_crc, compras_docs, gastos_crc, gastos_docs
+        FROM hecho_dia WHERE fecha >= :ini AND fecha < :fin
+    """), rango).mappings().all()
+    out = {"ventas": [], "compras": [], "gastos": []}
+    for r in rows:
+        for k, n in (("ventas", "facturas"), ("compras", "compras_docs"), ("gastos", "gastos_docs")):
+            if r[n] or r[f"{k}_crc"]:
+                d = {"fecha": r["fecha"], "total_crc": float(r[f"{k}_crc"]), "n": int(r[n])}
+                if k == "ventas":
+                    d["costo_crc"] = float(r["costo_ventas_crc"])
+                out[k].append(d)
+    return out
+
+
+def _mermas(db: Session, rango: dict) -> list[dict]:
+    # hecho_inv por producto/dia (uom base), valorizado al costo vigente en la fecha como /inventario/mermas
+    rows = db.execute(text("""
+        SELECT fecha, producto_id, cantidad, movimientos
+        FROM hecho_inv
+        WHERE motivo = 'MERMA' AND fecha >= :ini AND fecha < :fin
+    """), rango).mappings().all()
+    hist = cargar_historial(db, (r["producto_id"] for r in rows))
+    dias: dict[date, dict] = {}
+    for r, unit in zip(rows, hist.valorar(rows)):
+        d = dias.setdefault(r["fecha"], {"fecha": r["fecha"], "total_crc": 0.0, "n": 0})
+        d["total_crc"] += unit * float(r["cantidad"] or 0)
+        d["n"] += int(r["movimientos"])
+    return list(dias.values())
+
+
+def _planillas(db: Session, rango: dict) -> list[dict]:
+    rows = db.execute(text("""
+        SELECT ps.id, ps.semana_inicio,
+               COALESCE(SUM(dd.horas_reg), 0) AS horas_reg,
+               COALESCE(SUM(dd.horas_extra), 0) AS horas_extra,
+               COALESCE(SUM(dd.horas_doble), 0) AS horas_doble,
+               COALESCE(SUM(dd.horas_feriado), 0) AS horas_feriado,
+               COUNT(DISTINCT d.id) AS colaboradores,
+               COALESCE(SUM(d.tarifa_hora_crc * (COALESCE(dd.horas_reg, 0)
+                   + COALESCE(ps.factor_extra, :fx) * COALESCE(dd.horas_extra, 0)
+                   + COALESCE(ps.factor_doble, :fd) * COALESCE(dd.horas_doble, 0)
+                   + COALESCE(ps.factor_feriado, :ff) * COALESCE(dd.horas_feriado, 0))), 0) AS total_estimado_crc
+        FROM planilla_semana ps
+        LEFT JOIN planilla_det d ON d.planilla_id = ps.id
+        LEFT JOIN planilla_det_dia dd ON dd.det_id = d.id
+        WHERE ps.semana_inicio >= :ini AND ps.semana_inicio < :fin
+        GROUP BY ps.id, ps.semana_inicio
+        ORDER BY ps.semana_inicio
+    """), dict(rango, fx=FACTOR_EXTRA_DEFAULT, fd=FACTOR_DOBLE_DEFAULT, ff=FACTOR_FERIADO_DEFAULT)).mappings().all()
+    return [{k: (v if k in ("id", "semana_inicio", "colaboradores") else float(v)) for k, v in r.items()} for r in rows]
+
+
+def _pendientes(tabla: str):
+    def consulta(db: Session, _rango: dict) -> dict:
+        # saldo a la fecha (no depende del rango): documentos pendientes y los ya vencidos
+        r = db.execute(text(f"""
+            SELECT COALESCE(SUM(total_crc), 0) AS saldo_crc, COUNT(*) AS documentos,
+                   COALESCE(SUM(CASE WHEN DATE_ADD(fecha, INTERVAL COALESCE(dias_credito, 0) DAY) < CURDATE()
+                                     THEN total_crc ELSE 0 END), 0) AS vencido_crc
+            FROM {tabla}
+            WHERE estado_cobro_pago = 'PENDIENTE'
+        """)).mappings().one()
+        return {"saldo_crc": float(r["saldo_crc"]), "vencido_crc": float(r["vencido_crc"]),
+                "documentos": int(r["documentos"])}
+    return consulta
+
+
+_CONSULTAS = {
+    "dias": _dias,
+    "mermas": _mermas,
+    "planillas": _planillas,
+    "cxc": _pendientes("venta"),
+    "cxp": _pendientes("compra"),
+}
+
+
+def kpis(ini: date, fin: date) -> dict:
+    """Indicadores del tablero para [ini, fin): totales, series por dia y por mes, planillas, CxC/CxP.
+
+    Lee los hechos diarios (a lo sumo una fila por dia) en vez de los documentos; las
+    consultas son independientes y corren a la vez, cada una en su conexion.
+    """
+    rango = {"ini": ini, "fin": fin}
+    res = en_paralelo({k: (lambda db, fn=fn: fn(db, rango)) for k, fn in _CONSULTAS.items()})
+    res.update(res.pop("dias"))
+
+    tot = {k: sum(d["total_crc"] for d in res[k]) for k in ("ventas", "compras", "gastos", "mermas")}
+    costo_ventas = sum(d["costo_crc"] for d in res["ventas"])
+    planilla = sum(p["total_estimado_crc"] for p in res["planillas"])
+    facturas = sum(d["n"] for d in res["ventas"])
+    totales = {
+        "ventas_crc": tot["ventas"],
+        "facturas": facturas,
+        "ticket_promedio_crc": tot["ventas"] / facturas if facturas else None,
+        "costo_ventas_crc": costo_ventas,
+        "compras_crc": tot["compras"],
+        "mermas_crc": tot["mermas"],
+        "planilla_crc": planilla,
+        "gastos_crc": tot["gastos"],
+        # costo congelado en cada linea de venta (ver /reportes/margen)
+        "margen_bruto_crc": tot["ventas"] - costo_ventas,
+        "resultado_operativo_crc": tot["ventas"] - tot["compras"] - tot["mermas"] - planilla - tot["gastos"],
+        "cxc": res["cxc"],
+        "cxp": res["cxp"],
+    }
+
+    cero = {"ventas": 0.0, "costo_ventas": 0.0, "compras": 0.0, "gastos": 0.0, "mermas": 0.0, "planilla": 0.0}
+    meses: dict[str, dict] = {}
+    for k in ("ventas", "compras", "gastos", "mermas"):
+        for d in res[k]:
+            m = meses.setdefault(str(d["fecha"])[:7], dict(cero))
+            m[k] += d["total_crc"]
+            m["costo_ventas"] += d.get("costo_crc", 0.0)
+    for p in res["planillas"]:
+        m = meses.setdefault(str(p["semana_inicio"])[:7], dict(cero))
+        m["planilla"] += p["total_estimado_crc"]
+    margen = []
+    for mes in sorted(meses):
+        m = meses[mes]
+        margen.append(dict(m, mes=mes, margen_bruto=m["ventas"] - m["costo_ventas"],
+                           resultado_operativo=m["ventas"] - m["compras"] - m["mermas"] - m["planilla"] - m["gastos"]))
+
+    def _serie(k):
+        return [{"fecha": d["fecha"], "total_crc": d["total_crc"]}
+                for d in sorted(res[k], key=lambda d: d["fecha"], reverse=True)]
+
+    return {
+        "desde": ini,
+        "hasta": date.fromordinal(fin.toordinal() - 1),
+        "kpis": totales,
+        "ventas": _serie("ventas"),
+        "compras": _serie("compras"),
+        "gastos": _serie("gastos"),
+        "mermas": _serie("mermas"),
+        "planillas": res["planillas"],
+        "margen": margen,
+    }
@@ -0,0 +1,330 @@
+import json
+import os
+import shutil
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..routers.planilla import FACTOR_DOBLE_DEFAULT, FACTOR_EXTRA_DEFAULT, FACTOR_FERIADO_DEFAULT
+from .uom import conversor
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # el espejo es opcional: sin pyarrow /reportes/pivot responde 503
+    pa = None
+
+# Espejo columnar de las tablas de hechos: Parquet en disco local, una carpeta por tabla
+# particionada por mes (<ESPEJO_DIR>/<tabla>/mes=YYYY-MM/part-*.parquet), mas los catalogos
+# en _dims/. Lo llena `python -m app.cli sync-espejo` (incremental, p. ej. desde cron);
+# /reportes/pivot lo consulta con pyarrow sin tocar MySQL.
+
+# Filas leidas del cursor del servidor por bloque (un archivo por mes y bloque)
+LOTE = 50000
+
+I, F, S, D = "int", "float", "str", "date"
+
+_PLANILLA_MONTO = f"""
+    d.tarifa_hora_crc * (dd.horas_reg
+        + COALESCE(ps.factor_extra, {FACTOR_EXTRA_DEFAULT}) * dd.horas_extra
+        + COALESCE(ps.factor_doble, {FACTOR_DOBLE_DEFAULT}) * dd.horas_doble
+        + COALESCE(ps.factor_feriado, {FACTOR_FERIADO_DEFAULT}) * dd.horas_feriado)
+"""
+
+# tabla -> (SELECT, columnas y tipo, marca de agua)
+# "id": solo se agregan filas con id mayor al ultimo exportado (tablas que no se editan);
+# "fecha": se reescriben los meses desde el anterior al ultimo sincronizado (planilla se edita).
+# cantidad_base se calcula al exportar (uom base del producto).
+_TABLAS = {
+    "venta_det": ("""
+        SELECT d.id, v.fecha, d.venta_id, v.cliente_id, v.ruta_id, d.producto_id, d.uom_id,
+               d.cantidad, d.precio_unitario_crc, d.descuento_crc,
+               d.cantidad * d.precio_unitario_crc - d.descuento_crc AS total_crc,
+               d.cantidad * d.costo_unitario_crc AS costo_crc
+        FROM venta_det d
+        JOIN venta v ON v.id = d.venta_id
+        WHERE d.id > :marca
+        ORDER BY d.id
+    """, {"id": I, "fecha": D, "venta_id": I, "cliente_id": I, "ruta_id": I, "producto_id": I, "uom_id": I,
+          "cantidad": F, "cantidad_base": F, "precio_unitario_crc": F, "descuento_crc": F, "total_crc": F,
+          "costo_crc": F}, "id"),
+    "compra_det": ("""
+        SELECT d.id, c.fecha, d.compra_id, c.proveedor_id, d.producto_id, d.uom_id,
+               d.cantidad, d.costo_unitario_crc, d.descuento_crc,
+               d.cantidad * d.costo_unitario_crc - d.descuento_crc AS total_crc
+        FROM compra_det d
+        JOIN compra c ON c.id = d.compra_id
+        WHERE d.id > :marca
+        ORDER BY d.id
+    """, {"id": I, "fecha": D, "compra_id": I, "proveedor_id": I, "producto_id": I, "uom_id": I,
+          "cantidad": F, "cantidad_base": F, "costo_unitario_crc": F, "descuento_crc": F, "total_crc": F}, "id"),
+    "inv_mov": ("""
+        SELECT id, fecha, producto_id, uom_id, tipo, motivo, cantidad, ubicacion_id, ref_tabla, ref_id,
+               costo_unitario_crc
+        FROM inv_mov
+        WHERE id > :marca
+        ORDER BY id
+    """, {"id": I, "fecha": D, "producto_id": I, "uom_id": I, "tipo": S, "motivo": S, "cantidad": F,
+          "cantidad_base": F, "ubicacion_id": I, "ref_tabla": S, "ref_id": I, "costo_unitario_crc": F}, "id"),
+    "tanda_consumo": ("""
+        SELECT c.id, t.fecha, c.tanda_id, t.receta_id, t.cantidad_tandas, c.producto_id, c.uom_id, c.cantidad
+        FROM tanda_consumo c
+        JOIN tanda t ON t.id = c.tanda_id
+        WHERE c.id > :marca
+        ORDER BY c.id
+    """, {"id": I, "fecha": D, "tanda_id": I, "receta_id": I, "cantidad_tandas": F, "producto_id": I,
+          "uom_id": I, "cantidad": F, "cantidad_base": F}, "id"),
+    "tanda_salida": ("""
+        SELECT s.id, t.fecha, s.tanda_id, t.receta_id, t.cantidad_tandas, s.producto_id, s.uom_id, s.cantidad
+        FROM tanda_salida s
+        JOIN tanda t ON t.id = s.tanda_id
+        WHERE s.id > :marca
+        ORDER BY s.id
+    """, {"id": I, "fecha": D, "tanda_id": I, "receta_id": I, "cantidad_tandas": F, "producto_id": I,
+          "uom_id": I, "cantidad": F, "cantidad_base": F}, "id"),
+    "planilla_det_dia": (f"""
+        SELECT dd.id, dd.fecha, d.planilla_id, dd.det_id, d.empleado_id, d.rol, d.tarifa_hora_crc,
+               dd.horas_reg, dd.horas_extra, dd.horas_doble, dd.horas_feriado,
+               {_PLANILLA_MONTO} AS monto_crc
+        FROM planilla_det_dia dd
+        JOIN planilla_det d ON d.id = dd.det_id
+        JOIN planilla_semana ps ON ps.id = d.planilla_id
+        WHERE dd.fecha >= :marca
+        ORDER BY dd.fecha, dd.id
+    """, {"id": I, "fecha": D, "planilla_id": I, "det_id": I, "empleado_id": I, "rol": S,
+          "tarifa_hora_crc": F, "horas_reg": F, "horas_extra": F, "horas_doble": F, "horas_feriado": F,
+          "monto_crc": F}, "fecha"),
+    "gasto": ("""
+        SELECT id, fecha, categoria_id, proveedor_id, metodo_pago, monto_crc
+        FROM gasto
+        WHERE id > :marca
+        ORDER BY id
+    """, {"id": I, "fecha": D, "categoria_id": I, "proveedor_id": I, "metodo_pago": S, "monto_crc": F}, "id"),
+}
+
+# Catalogos (se reescriben completos en cada sincronizacion) y la columna que los referencia
+_DIMS = {
+    "producto": ("producto_id", "SELECT id, nombre, sku, tipo FROM producto"),
+    "cliente": ("cliente_id", "SELECT id, nombre FROM cliente"),
+    "proveedor": ("proveedor_id", "SELECT id, nombre FROM proveedor"),
+    "ruta": ("ruta_id", "SELECT id, nombre FROM ruta"),
+    "empleado": ("empleado_id", "SELECT id, nombre FROM empleado"),
+    "categoria_gasto": ("categoria_id", "SELECT id, nombre FROM categoria_gasto"),
+    "receta": ("receta_id", "SELECT id, nombre FROM receta"),
+    "uom": ("uom_id", "SELECT id, nombre FROM uom"),
+}
+
+AGREGADOS = ("sum", "mean", "min", "max", "count", "count_distinct")
+
+
+class EspejoNoDisponible(RuntimeError):
+    """Falta pyarrow o el espejo aun no se ha sincronizado."""
+
+
+def _requiere_pyarrow():
+    if pa is None:
+        raise EspejoNoDisponible("espejo analitico no disponible: instale pyarrow")
+
+
+def _tipos():
+    return {I: pa.int64(), F: pa.float64(), S: pa.string(), D: pa.date32()}
+
+
+def _valor(v, tipo: str):
+    if v is None:
+        return None
+    if tipo == F:
+        return float(v)
+    if tipo == I:
+        return int(v)
+    if tipo == D:
+        return v.date() if isinstance(v, datetime) else v
+    return str(v)
+
+
+def _ruta(*partes: str) -> str:
+    return os.path.join(settings.ESPEJO_DIR, *partes)
+
+
+def _leer_estado() -> dict:
+    try:
+        with open(_ruta("_estado.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _guardar_estado(estado: dict):
+    tmp = _ruta(".estado.json")
+    with open(tmp, "w") as f:
+        json.dump(estado, f, indent=2)
+    os.replace(tmp, _ruta("_estado.json"))
+
+
+def _escribir(carpeta: str, nombre: str, tabla):
+    # se escribe con prefijo "." (pyarrow.dataset lo ignora) y se renombra al terminar
+    os.makedirs(carpeta, exist_ok=True)
+    tmp = os.path.join(carpeta, "." + nombre)
+    pq.write_table(tabla, tmp)
+    os.replace(tmp, os.path.join(carpeta, nombre))
+
+
+def _por_mes(bloque, cols: dict[str, str], conv) -> dict[str, "pa.Table"]:
+    """Convierte un bloque de filas en una tabla Arrow por mes."""
+    meses: dict[str, dict[str, list]] = {}
+    for r in bloque:
+        r = r._mapping
+        fecha = _valor(r["fecha"], D)
+        datos = meses.get(f"{fecha:%Y-%m}")
+        if datos is None:
+            datos = meses[f"{fecha:%Y-%m}"] = {c: [] for c in cols}
+        for c, tipo in cols.items():
+            if c == "cantidad_base":
+                datos[c].append(float(r["cantidad"] or 0) * conv.factor(r["producto_id"], r["uom_id"]))
+            else:
+                datos[c].append(_valor(r[c], tipo))
+    tipos = _tipos()
+    return {mes: pa.table({c: pa.array(v, type=tipos[cols[c]]) for c, v in datos.items()})
+            for mes, datos in meses.items()}
+
+
+def _sync_por_id(db: Session, conv, tabla: str, sql: str, cols: dict, estado: dict) -> int:
+    marca = int(estado.get(tabla, {}).get("id", 0))
+    carpeta = _ruta(tabla)
+    # archivos de una corrida interrumpida (id inicial mayor a la marca): se vuelven a exportar
+    for raiz, _dirs, archivos in os.walk(carpeta):
+        for a in archivos:
+            if a.startswith("part-") and int(a[5:].split(".")[0]) > marca:
+                os.remove(os.path.join(raiz, a))
+    res = db.execute(text(sql), {"marca": marca}, execution_options={"stream_results": True, "yield_per": LOTE})
+    n = 0
+    for bloque in res.partitions():
+        nombre = f"part-{int(bloque[0].id):012d}.parquet"
+        for mes, t in _por_mes(bloque, cols, conv).items():
+            _escribir(os.path.join(carpeta, f"mes={mes}"), nombre, t)
+        marca = int(bloque[-1].id)
+        n += len(bloque)
+        estado[tabla] = {"id": marca}
+        _guardar_estado(estado)
+    return n
+
+
+def _sync_por_fecha(db: Session, conv, tabla: str, sql: str, cols: dict, estado: dict) -> int:
+    # reescribe desde el mes anterior al ultimo sincronizado (ediciones tardias de la semana)
+    ultimo = estado.get(tabla, {}).get("mes")
+    if ultimo:
+        a, m = int(ultimo[:4]), int(ultimo[5:7])
+        desde = date(a - (m == 1), (m - 2) % 12 + 1, 1)
+    else:
+        desde = date(1900, 1, 1)
+    carpeta = _ruta(tabla)
+    nueva = _ruta(f".{tabla}")
+    shutil.rmtree(nueva, ignore_errors=True)
+    res = db.execute(text(sql), {"marca": desde}, execution_options={"stream_results": True, "yield_per": LOTE})
+    n = 0
+    for i, bloque in enumerate(res.partitions()):
+        for mes, t in _por_mes(bloque, cols, conv).items():
+            _escribir(os.path.join(nueva, f"mes={mes}"), f"part-{i:012d}.parquet", t)
+        n += len(bloque)
+    os.makedirs(carpeta, exist_ok=True)
+    for d in os.listdir(carpeta):
+        if d.startswith("mes=") and d[4:] >= f"{desde:%Y-%m}":
+            shutil.rmtree(os.path.join(carpeta, d))
+    if os.path.isdir(nueva):
+        for d in os.listdir(nueva):
+            os.replace(os.path.join(nueva, d), os.path.join(carpeta, d))
+        shutil.rmtree(nueva)
+    estado[tabla] = {"mes": f"{date.today():%Y-%m}"}
+    _guardar_estado(estado)
+    return n
+
+
+def sincronizar(db: Session, completo: bool = False) -> dict[str, int]:
+    """Exporta al espejo las filas nuevas de cada tabla y reescribe los catalogos (solo lee MySQL).
+
+    completo=True borra el espejo y lo regenera (tras cargas directas o `costear-ventas`).
+    Devuelve filas exportadas por tabla.
+    """
+    _requiere_pyarrow()
+    if completo:
+        shutil.rmtree(settings.ESPEJO_DIR, ignore_errors=True)
+    os.makedirs(settings.ESPEJO_DIR, exist_ok=True)
+    estado = _leer_estado()
+    conv = conversor(db)
+    out = {}
+    for tabla, (sql, cols, marca) in _TABLAS.items():
+        sync = _sync_por_id if marca == "id" else _sync_por_fecha
+        out[tabla] = sync(db, conv, tabla, sql, cols, estado)
+    for dim, (_col, sql) in _DIMS.items():
+        filas = [dict(r) for r in db.execute(text(sql)).mappings()]
+        _escribir(_ruta("_dims"), f"{dim}.parquet", pa.Table.from_pylist(filas))
+    return out
+
+
+def _nombres(dim: str) -> dict[int, str]:
+    t = pq.read_table(_ruta("_dims", f"{dim}.parquet"))
+    if t.num_rows == 0:
+        return {}
+    return dict(zip(t.column("id").to_pylist(), t.column("nombre").to_pylist()))
+
+
+def columnas(tabla: str) -> list[str]:
+    return list(_TABLAS[tabla][1]) + ["mes"]
+
+
+def pivot(
+    tabla: str,
+    filas: list[str],
+    medidas: list[tuple[str, str]],
+    desde: date | None = None,
+    hasta: date | None = None,
+    top: int | None = None,
+) -> list[dict]:
+    """Agrupa una tabla del espejo por `filas` y calcula `medidas` [(columna, agregado)].
+
+    Filtra por fecha (las particiones por mes fuera del rango no se leen). Ordena por la
+    primera medida, de mayor a menor; las columnas *_id con catalogo traen su *_nombre.
+    Lanza ValueError si la consulta no es valida y EspejoNoDisponible si no hay espejo.
+    """
+    _requiere_pyarrow()
+    if tabla not in _TABLAS:
+        raise ValueError(f"tabla no disponible; use una de: {', '.join(_TABLAS)}")
+    validas = columnas(tabla)
+    if not filas:
+        raise ValueError("filas requerido (columnas de agrupacion)")
+    for c in filas + [c for c, _a in medidas]:
+        if c not in validas:
+            raise ValueError(f"columna '{c}' no existe en {tabla}; columnas: {', '.join(validas)}")
+    for _c, a in medidas:
+        if a not in AGREGADOS:
+            raise ValueError(f"agregado '{a}' no valido; use uno de: {', '.join(AGREGADOS)}")
+    carpeta = _ruta(tabla)
+    if not os.path.isdir(carpeta):
+        raise EspejoNoDisponible("espejo vacio: ejecute `python -m app.cli sync-espejo`")
+
+    datos = ds.dataset(carpeta, format="parquet",
+                       partitioning=ds.partitioning(pa.schema([("mes", pa.string())]), flavor="hive"))
+    filtro = None
+    if desde:
+        filtro = (ds.field("mes") >= f"{desde:%Y-%m}") & (ds.field("fecha") >= pa.scalar(desde, pa.date32()))
+    if hasta:
+        cond = (ds.field("mes") <= f"{hasta:%Y-%m}") & (ds.field("fecha") <= pa.scalar(hasta, pa.date32()))
+        filtro = cond if filtro is None else filtro & cond
+    usadas = list(dict.fromkeys(filas + [c for c, _a in medidas]))
+    t = datos.to_table(columns=usadas, filter=filtro)
+    res = t.group_by(filas).aggregate(list(medidas))
+    if medidas:
+        res = res.sort_by([(f"{medidas[0][0]}_{medidas[0][1]}", "descending")])
+    if top and top > 0:
+        res = res.slice(0, top)
+    out = res.to_pylist()
+
+    for dim, (col, _sql) in _DIMS.items():
+        if col in filas and os.path.exists(_ruta("_dims", f"{dim}.parquet")):
+            nombres = _nombres(dim)
+            for r in out:
+                r[col.removesuffix("_id") + "_nombre"] = nombres.get(r[col])
+    return out
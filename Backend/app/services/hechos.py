@@ -0,0 +1,218 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .uom import conversor, crear_tabla_factores
+
+# Hechos diarios para reportes: los mantiene la app en cada escritura (como inv_saldo);
+# `python -m app.cli rebuild-hechos` los recalcula desde los documentos.
+
+_UPSERT_DIA = text("""
+    INSERT INTO hecho_dia (fecha, ventas_crc, costo_ventas_crc, facturas, compras_crc, compras_docs,
+                           gastos_crc, gastos_docs)
+    VALUES (:fecha, :ventas_crc, :costo_ventas_crc, :facturas, :compras_crc, :compras_docs,
+            :gastos_crc, :gastos_docs)
+    ON DUPLICATE KEY UPDATE
+      ventas_crc = ventas_crc + VALUES(ventas_crc),
+      costo_ventas_crc = costo_ventas_crc + VALUES(costo_ventas_crc),
+      facturas = facturas + VALUES(facturas),
+      compras_crc = compras_crc + VALUES(compras_crc),
+      compras_docs = compras_docs + VALUES(compras_docs),
+      gastos_crc = gastos_crc + VALUES(gastos_crc),
+      gastos_docs = gastos_docs + VALUES(gastos_docs)
+""")
+
+_UPSERT_COMPRA = text("""
+    INSERT INTO hecho_compra (fecha, proveedor_id, producto_id, cantidad, total_crc, lineas)
+    VALUES (:fecha, :tercero, :producto_id, :cantidad, :total_crc, :lineas)
+    ON DUPLICATE KEY UPDATE
+      cantidad = cantidad + VALUES(cantidad),
+      total_crc = total_crc + VALUES(total_crc),
+      lineas = lineas + VALUES(lineas)
+""")
+
+# ruta_id 0 = venta sin ruta; costo_crc sale del costo congelado en venta_det
+_UPSERT_VENTA = text("""
+    INSERT INTO hecho_venta (fecha, cliente_id, producto_id, ruta_id, cantidad, total_crc, costo_crc,
+                             lineas, lineas_sin_costo)
+    VALUES (:fecha, :tercero, :producto_id, :ruta_id, :cantidad, :total_crc, :costo_crc,
+            :lineas, :lineas_sin_costo)
+    ON DUPLICATE KEY UPDATE
+      cantidad = cantidad + VALUES(cantidad),
+      total_crc = total_crc + VALUES(total_crc),
+      costo_crc = costo_crc + VALUES(costo_crc),
+      lineas = lineas + VALUES(lineas),
+      lineas_sin_costo = lineas_sin_costo + VALUES(lineas_sin_costo)
+""")
+
+_UPSERT_INV = text("""
+    INSERT INTO hecho_inv (fecha, producto_id, motivo, cantidad, movimientos)
+    VALUES (:fecha, :producto_id, :motivo, :cantidad, :movimientos)
+    ON DUPLICATE KEY UPDATE
+      cantidad = cantidad + VALUES(cantidad),
+      movimientos = movimientos + VALUES(movimientos)
+""")
+
+_DIA_CERO = {"ventas_crc": 0.0, "costo_ventas_crc": 0.0, "facturas": 0, "compras_crc": 0.0, "compras_docs": 0,
+             "gastos_crc": 0.0, "gastos_docs": 0}
+
+
+def _fecha(valor) -> str:
+    return str(valor)[:10]
+
+
+def _dia(dias: dict, fecha) -> dict:
+    f = _fecha(fecha)
+    d = dias.get(f)
+    if d is None:
+        d = dias[f] = dict(_DIA_CERO, fecha=f)
+    return d
+
+
+def _documentos(db: Session, upsert, tercero: str, precio: str, docs: list[dict], col_total: str, col_docs: str,
+                ventas: bool = False):
+    conv = conversor(db)
+    dias: dict[str, dict] = {}
+    lineas: dict[tuple, dict] = {}
+    for doc in docs:
+        d = _dia(dias, doc["fecha"])
+        if doc.get("nuevo", True):
+            d[col_docs] += 1
+        for it in doc.get("items") or ():
+            pid = int(it["producto_id"])
+            cantidad = float(it["cantidad"] or 0)
+            total = cantidad * float(it[precio] or 0) - float(it.get("descuento_crc") or 0)
+            d[col_total] += total
+            ruta = int(doc.get("ruta_id") or 0) if ventas else 0
+            key = (d["fecha"], int(doc[tercero]), pid, ruta)
+            h = lineas.get(key)
+            if h is None:
+                h = lineas[key] = {"fecha": key[0], "tercero": key[1], "producto_id": pid, "ruta_id": ruta,
+                                   "cantidad": 0.0, "total_crc": 0.0, "costo_crc": 0.0,
+                                   "lineas": 0, "lineas_sin_costo": 0}
+            h["cantidad"] += cantidad * conv.factor(pid, it["uom_id"])
+            h["total_crc"] += total
+            h["lineas"] += 1
+            if ventas:
+                if it.get("costo_unitario_crc") is None:
+                    h["lineas_sin_costo"] += 1
+                else:
+                    costo = cantidad * float(it["costo_unitario_crc"])
+                    h["costo_crc"] += costo
+                    d["costo_ventas_crc"] += costo
+    if dias:
+        db.execute(_UPSERT_DIA, list(dias.values()))
+    if lineas:
+        db.execute(upsert, list(lineas.values()))
+
+
+def registrar_ventas(db: Session, ventas: list[dict]):
+    """Suma ventas a los hechos diarios (sin commit).
+
+    ventas: [{fecha, cliente_id, ruta_id, nuevo (cuenta la factura, por defecto True), items: [...]}]
+    con items como venta_det (producto_id, uom_id, cantidad, precio_unitario_crc, descuento_crc,
+    costo_unitario_crc).
+    """
+    _documentos(db, _UPSERT_VENTA, "cliente_id", "precio_unitario_crc", ventas, "ventas_crc", "facturas",
+                ventas=True)
+
+
+def registrar_compras(db: Session, compras: list[dict]):
+    """Igual que registrar_ventas, para compras (proveedor_id, costo_unitario_crc)."""
+    _documentos(db, _UPSERT_COMPRA, "proveedor_id", "costo_unitario_crc", compras, "compras_crc", "compras_docs")
+
+
+def registrar_gastos(db: Session, gastos: list[dict]):
+    """gastos: [{fecha, monto_crc}] (sin commit)."""
+    dias: dict[str, dict] = {}
+    for g in gastos:
+        d = _dia(dias, g["fecha"])
+        d["gastos_crc"] += float(g["monto_crc"] or 0)
+        d["gastos_docs"] += 1
+    if dias:
+        db.execute(_UPSERT_DIA, list(dias.values()))
+
+
+def registrar_movs(db: Session, movs: list[dict], cantidades_base: list[float]):
+    """Suma movimientos de kardex (produccion, consumo, merma, ...) por dia/producto/motivo."""
+    hechos: dict[tuple, dict] = {}
+    for m, cantidad in zip(movs, cantidades_base):
+        key = (_fecha(m["fecha"]), int(m["producto_id"]), m["motivo"])
+        h = hechos.setdefault(key, {"fecha": key[0], "producto_id": key[1], "motivo": key[2],
+                                    "cantidad": 0.0, "movimientos": 0})
+        h["cantidad"] += cantidad
+        h["movimientos"] += 1
+    if hechos:
+        db.execute(_UPSERT_INV, list(hechos.values()))
+
+
+def rebuild_hechos(db: Session, producto_ids=None) -> dict[str, int]:
+    """Recalcula las tablas de hechos desde ventas, compras, gastos e inv_mov (sin commit).
+
+    Con producto_ids solo se recalculan las filas por producto de esos productos
+    (hecho_venta, hecho_compra, hecho_inv); hecho_dia no tiene cantidades y no se toca.
+    """
+    ids = tuple({int(x) for x in producto_ids}) if producto_ids is not None else None
+    if ids == ():
+        return {}
+    filtro = "WHERE producto_id IN :ids" if ids else ""
+    params = {"ids": ids} if ids else {}
+    crear_tabla_factores(db, f"""
+        SELECT producto_id, uom_id FROM venta_det {filtro}
+        UNION SELECT producto_id, uom_id FROM compra_det {filtro}
+        UNION SELECT producto_id, uom_id FROM inv_mov {filtro}
+    """, params)
+    out = {}
+    for tabla in ("hecho_venta", "hecho_compra", "hecho_inv") if ids else ("hecho_dia", "hecho_venta", "hecho_compra", "hecho_inv"):
+        db.execute(text(f"DELETE FROM {tabla} {filtro}"), params)
+    if not ids:
+        db.execute(text("""
+            INSERT INTO hecho_dia (fecha, ventas_crc, costo_ventas_crc, facturas, compras_crc, compras_docs,
+                                   gastos_crc, gastos_docs)
+            SELECT fecha, SUM(v), SUM(cv), SUM(nv), SUM(c), SUM(nc), SUM(g), SUM(ng)
+            FROM (
+                SELECT fecha, total_crc AS v, 0 AS cv, 1 AS nv, 0 AS c, 0 AS nc, 0 AS g, 0 AS ng FROM venta
+                UNION ALL SELECT v.fecha, 0, SUM(d.cantidad * d.costo_unitario_crc), 0, 0, 0, 0, 0
+                          FROM venta_det d JOIN venta v ON v.id = d.venta_id
+                          WHERE d.costo_unitario_crc IS NOT NULL GROUP BY v.fecha
+                UNION ALL SELECT fecha, 0, 0, 0, total_crc, 1, 0, 0 FROM compra
+                UNION ALL SELECT fecha, 0, 0, 0, 0, 0, monto_crc, 1 FROM gasto
+            ) x
+            GROUP BY fecha
+        """))
+        out["hecho_dia"] = db.execute(text("SELECT COUNT(*) FROM hecho_dia")).scalar()
+    out["hecho_venta"] = db.execute(text(f"""
+        INSERT INTO hecho_venta (fecha, cliente_id, producto_id, ruta_id, cantidad, total_crc, costo_crc,
+                                 lineas, lineas_sin_costo)
+        SELECT v.fecha, v.cliente_id, d.producto_id, COALESCE(v.ruta_id, 0),
+               SUM(d.cantidad * COALESCE(f.factor, 1)),
+               SUM(d.cantidad * d.precio_unitario_crc - COALESCE(d.descuento_crc, 0)),
+               SUM(d.cantidad * COALESCE(d.costo_unitario_crc, 0)),
+               COUNT(*), SUM(d.costo_unitario_crc IS NULL)
+        FROM venta_det d
+        JOIN venta v ON v.id = d.venta_id
+        LEFT JOIN tmp_uom_factor f ON f.producto_id = d.producto_id AND f.uom_id = d.uom_id
+        {filtro.replace("producto_id", "d.producto_id")}
+        GROUP BY v.fecha, v.cliente_id, d.producto_id, COALESCE(v.ruta_id, 0)
+    """), params).rowcount
+    out["hecho_compra"] = db.execute(text(f"""
+        INSERT INTO hecho_compra (fecha, proveedor_id, producto_id, cantidad, total_crc, lineas)
+        SELECT c.fecha, c.proveedor_id, d.producto_id,
+               SUM(d.cantidad * COALESCE(f.factor, 1)),
+               SUM(d.cantidad * d.costo_unitario_crc - COALESCE(d.descuento_crc, 0)),
+               COUNT(*)
+        FROM compra_det d
+        JOIN compra c ON c.id = d.compra_id
+        LEFT JOIN tmp_uom_factor f ON f.producto_id = d.producto_id AND f.uom_id = d.uom_id
+        {filtro.replace("producto_id", "d.producto_id")}
+        GROUP BY c.fecha, c.proveedor_id, d.producto_id
+    """), params).rowcount
+    out["hecho_inv"] = db.execute(text(f"""
+        INSERT INTO hecho_inv (fecha, producto_id, motivo, cantidad, movimientos)
+        SELECT DATE(m.fecha), m.producto_id, m.motivo, SUM(m.cantidad * COALESCE(f.factor, 1)), COUNT(*)
+        FROM inv_mov m
+        LEFT JOIN tmp_uom_factor f ON f.producto_id = m.producto_id AND f.uom_id = m.uom_id
+        {filtro.replace("producto_id", "m.producto_id")}
+        GROUP BY DATE(m.fecha), m.producto_id, m.motivo
+    """), params).rowcount
+    return out
+
@@ -0,0 +1,262 @@
+import codecs
+import csv
+import hashlib
+import json
+from datetime import date
+from typing import AsyncIterator
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from . import hechos
+from .costo_ventas import costos_venta
+from .inventory import insert_inv_movs
+
+SCOPE = "venta_import"
+
+
+async def lineas_texto(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Convierte el cuerpo (bytes por bloques) en lineas de texto, conservando el salto."""
+    dec = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    resto = ""
+    async for chunk in chunks:
+        resto += dec.decode(chunk)
+        partes = resto.splitlines(keepends=True)
+        resto = partes.pop() if partes and not partes[-1].endswith(("\n", "\r")) else ""
+        for p in partes:
+            yield p
+    resto += dec.decode(b"", final=True)
+    if resto:
+        yield resto
+
+
+async def registros(chunks: AsyncIterator[bytes], formato: str) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """(numero de linea, fila como dict | None, error | None) para CSV con encabezado o NDJSON."""
+    n = 0
+    if formato == "ndjson":
+        async for linea in lineas_texto(chunks):
+            n += 1
+            if not linea.strip():
+                continue
+            try:
+                fila = json.loads(linea)
+            except ValueError:
+                yield n, None, "JSON invalido"
+                continue
+            if isinstance(fila, dict):
+                yield n, fila, None
+            else:
+                yield n, None, "se esperaba un objeto JSON"
+        return
+    encabezado = None
+    pendiente: list[str] = []
+    async for linea in lineas_texto(chunks):
+        # una linea fisica puede no cerrar un campo entre comillas: se acumula hasta completar
+        pendiente.append(linea)
+        if "".join(pendiente).count('"') % 2:
+            continue
+        n += 1
+        valores = next(csv.reader(pendiente), [])
+        pendiente = []
+        if not any(v.strip() for v in valores):
+            continue
+        if encabezado is None:
+            encabezado = [v.strip().lower() for v in valores]
+            continue
+        yield n, dict(zip(encabezado, (v.strip() for v in valores))), None
+
+
+class Catalogos:
+    """Lookups en memoria (sku, clientes, uom) cargados una vez por importacion."""
+
+    def __init__(self, db: Session):
+        self.productos = {}
+        self.skus = {}
+        for r in db.execute(text("SELECT id, sku, uom_base_id FROM producto")).mappings():
+            self.productos[int(r["id"])] = r["uom_base_id"]
+            if r["sku"]:
+                self.skus[r["sku"].strip().lower()] = int(r["id"])
+        self.clientes = set()
+        self.clientes_doc = {}
+        self.clientes_nombre = {}
+        for r in db.execute(text("SELECT id, nombre, num_doc FROM cliente")).mappings():
+            self.clientes.add(int(r["id"]))
+            if r["num_doc"]:
+                self.clientes_doc[r["num_doc"].strip().lower()] = int(r["id"])
+            self.clientes_nombre.setdefault((r["nombre"] or "").strip().lower(), int(r["id"]))
+        self.uoms = {}
+        for r in db.execute(text("SELECT id, codigo, nombre FROM uom")).mappings():
+            self.uoms[int(r["id"])] = int(r["id"])
+            self.uoms[(r["codigo"] or "").strip().lower()] = int(r["id"])
+            self.uoms.setdefault((r["nombre"] or "").strip().lower(), int(r["id"]))
+
+    def cliente(self, fila: dict) -> int:
+        if fila.get("cliente_id"):
+            cid = int(fila["cliente_id"])
+            if cid not in self.clientes:
+                raise ValueError(f"cliente_id {cid} no existe")
+            return cid
+        clave = str(fila.get("cliente") or "").strip().lower()
+        cid = self.clientes_doc.get(clave) or self.clientes_nombre.get(clave)
+        if not cid:
+            raise ValueError(f"cliente '{fila.get('cliente') or ''}' no encontrado")
+        return cid
+
+    def producto(self, fila: dict) -> int:
+        if fila.get("producto_id"):
+            pid = int(fila["producto_id"])
+            if pid not in self.productos:
+                raise ValueError(f"producto_id {pid} no existe")
+            return pid
+        pid = self.skus.get(str(fila.get("sku") or "").strip().lower())
+        if not pid:
+            raise ValueError(f"sku '{fila.get('sku') or ''}' no encontrado")
+        return pid
+
+    def uom(self, fila: dict, producto_id: int) -> int:
+        clave = fila.get("uom_id") or fila.get("uom")
+        if not clave:
+            return self.productos[producto_id]
+        uid = self.uoms.get(int(clave) if str(clave).isdigit() else str(clave).strip().lower())
+        if not uid:
+            raise ValueError(f"uom '{clave}' no encontrada")
+        return uid
+
+
+def _num(fila: dict, campo: str) -> float:
+    v = fila.get(campo)
+    return float(str(v).replace(",", ".")) if v not in (None, "") else 0.0
+
+
+def _fecha(fila: dict) -> str:
+    v = str(fila["fecha"]).strip()
+    try:
+        return date.fromisoformat(v).isoformat()
+    except ValueError:
+        raise ValueError(f"fecha '{v}' invalida (YYYY-MM-DD)")
+
+
+def armar_ticket(cat: Catalogos, lineas: list[tuple[int, dict]]) -> dict:
+    """Encabezado + items de un ticket. Lanza ValueError (con la linea) si alguna fila es invalida."""
+    n0, f0 = lineas[0]
+    if not f0.get("fecha"):
+        raise ValueError(f"linea {n0}: fecha requerida")
+    try:
+        venta = {
+            "codigo_factura": str(f0["codigo_factura"]).strip(),
+            "fecha": _fecha(f0),
+            "cliente_id": cat.cliente(f0),
+            "condicion_pago": (f0.get("condicion_pago") or "CONTADO").upper(),
+            "dias_credito": int(f0["dias_credito"]) if f0.get("dias_credito") else None,
+            "moneda": (f0.get("moneda") or "CRC").upper(),
+            "ruta_id": int(f0["ruta_id"]) if f0.get("ruta_id") else None,
+            "nota": f0.get("nota") or None,
+        }
+    except ValueError as exc:
+        raise ValueError(f"linea {n0}: {exc}")
+    items = []
+    for n, f in lineas:
+        try:
+            pid = cat.producto(f)
+            it = {
+                "producto_id": pid,
+                "uom_id": cat.uom(f, pid),
+                "cantidad": _num(f, "cantidad"),
+                "precio_unitario_crc": _num(f, "precio_unitario_crc"),
+                "descuento_crc": _num(f, "descuento_crc"),
+            }
+        except ValueError as exc:
+            raise ValueError(f"linea {n}: {exc}")
+        if it["cantidad"] <= 0:
+            raise ValueError(f"linea {n}: cantidad > 0 requerida")
+        items.append(it)
+    venta["items"] = items
+    huella = {k: venta[k] for k in ("fecha", "cliente_id")} | {"items": items}
+    venta["hash"] = hashlib.sha256(json.dumps(huella, sort_keys=True).encode()).hexdigest()
+    return venta
+
+
+def _insertar(db: Session, tickets: list[dict]) -> dict[str, int]:
+    """Inserta encabezados, detalle, kardex y llaves de idempotencia (sin commit)."""
+    db.execute(text("""
+        INSERT INTO venta (codigo_factura, fecha, cliente_id, condicion_pago, dias_credito, moneda, ruta_id, nota)
+        VALUES (:codigo_factura, :fecha, :cliente_id, :condicion_pago, :dias_credito, :moneda, :ruta_id, :nota)
+    """), [{k: t[k] for k in ("codigo_factura", "fecha", "cliente_id", "condicion_pago",
+                              "dias_credito", "moneda", "ruta_id", "nota")} for t in tickets])
+    ids = {r["codigo_factura"]: int(r["id"]) for r in db.execute(
+        text("SELECT id, codigo_factura FROM venta WHERE codigo_factura IN :cods"),
+        {"cods": tuple(t["codigo_factura"] for t in tickets)},
+    ).mappings()}
+    items = [it for t in tickets for it in t["items"]]
+    con_fecha = [{**it, "fecha": t["fecha"]} for t in tickets for it in t["items"]]
+    for it, costo in zip(items, costos_venta(db, con_fecha)):
+        it["costo_unitario_crc"] = costo
+    det, movs = [], []
+    for t in tickets:
+        vid = ids[t["codigo_factura"]]
+        for it in t["items"]:
+            det.append({"venta_id": vid, **it})
+            movs.append(dict(fecha=t["fecha"], producto_id=it["producto_id"], uom_id=it["uom_id"], tipo="OUT",
+                             cantidad=it["cantidad"], motivo="VENTA", ref_tabla="venta", ref_id=vid))
+    db.execute(text("""
+        INSERT INTO venta_det (venta_id, producto_id, uom_id, cantidad, precio_unitario_crc, descuento_crc,
+                               costo_unitario_crc)
+        VALUES (:venta_id, :producto_id, :uom_id, :cantidad, :precio_unitario_crc, :descuento_crc,
+                :costo_unitario_crc)
+    """), det)
+    insert_inv_movs(db, movs)
+    hechos.registrar_ventas(db, tickets)
+    db.execute(text("""
+        INSERT INTO idempotency_key (scope, idempotency_key, request_hash, response_json)
+        VALUES (:s, :k, :h, :r)
+    """), [{"s": SCOPE, "k": t["codigo_factura"], "h": t["hash"],
+            "r": json.dumps({"venta_id": ids[t["codigo_factura"]]})} for t in tickets])
+    return ids
+
+
+def guardar_lote(db: Session, tickets: list[dict], res: dict):
+    """Guarda un lote de tickets en una transaccion, descartando los ya importados.
+
+    Un codigo_factura ya registrado con la misma huella cuenta como duplicado (reintento);
+    con otra huella, o cargado a mano, se reporta como error. Si el lote falla en la base,
+    se reintenta ticket por ticket para aislar el que falla.
+    """
+    if not tickets:
+        return
+    cods = tuple(t["codigo_factura"] for t in tickets)
+    existentes = set(db.execute(text("SELECT codigo_factura FROM venta WHERE codigo_factura IN :cods"),
+                                {"cods": cods}).scalars())
+    huellas = {r[0]: r[1] for r in db.execute(text("""
+        SELECT idempotency_key, request_hash FROM idempotency_key WHERE scope = :s AND idempotency_key IN :cods
+    """), {"s": SCOPE, "cods": cods})}
+    nuevos = []
+    for t in tickets:
+        cod = t["codigo_factura"]
+        if cod not in existentes:
+            nuevos.append(t)
+        elif huellas.get(cod) == t["hash"]:
+            res["duplicadas"] += 1
+        else:
+            res["errores"].append({"linea": t["linea"], "codigo_factura": cod,
+                                   "error": "codigo_factura ya existe con otro contenido"})
+    if not nuevos:
+        return
+    try:
+        _insertar(db, nuevos)
+        db.commit()
+        res["ventas"] += len(nuevos)
+        res["items"] += sum(len(t["items"]) for t in nuevos)
+        return
+    except (SQLAlchemyError, ValueError):
+        db.rollback()
+    for t in nuevos:
+        try:
+            _insertar(db, [t])
+            db.commit()
+            res["ventas"] += 1
+            res["items"] += len(t["items"])
+        except (SQLAlchemyError, ValueError) as exc:
+            db.rollback()
+            res["errores"].append({"linea": t["linea"], "codigo_factura": t["codigo_factura"],
+                                   "error": str(getattr(exc, "orig", exc))[:240]})
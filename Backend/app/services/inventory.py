@@ -1,15 +1,156 @@
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
+from . import costing, hechos, pronostico, varianzas
+from .uom import conversor, crear_tabla_factores, invalidar_conversor
+
+# Acumulados de inv_saldo por motivo del kardex
+_MOTIVO_COLS = {
+    "COMPRA": "total_compra",
+    "PRODUCCION_SALIDA": "total_produccion",
+    "CONSUMO_RECETA": "total_consumo",
+    "VENTA": "total_venta",
+    "MERMA": "total_merma",
+    "AJUSTE": "total_ajuste",
+}
+
+_INSERT_MOV = text("""
+    INSERT INTO inv_mov (fecha,producto_id,uom_id,tipo,cantidad,motivo,ref_tabla,ref_id,ubicacion_id,nota,costo_unitario_crc)
+    VALUES (:fecha,:producto_id,:uom_id,:tipo,:cantidad,:motivo,:ref_tabla,:ref_id,:ubicacion_id,:nota,:costo_unitario_crc)
+""")
+
+_UPSERT_SALDO = text("""
+    INSERT INTO inv_saldo (producto_id, ubicacion_id, existencias,
+                           total_compra, total_produccion, total_consumo, total_venta, total_merma, total_ajuste,
+                           ultima_entrada, ultima_salida)
+    VALUES (:producto_id, :ubicacion_id, :existencias,
+            :total_compra, :total_produccion, :total_consumo, :total_venta, :total_merma, :total_ajuste,
+            :ultima_entrada, :ultima_salida)
+    ON DUPLICATE KEY UPDATE
+      existencias = existencias + VALUES(existencias),
+      total_compra = total_compra + VALUES(total_compra),
+      total_produccion = total_produccion + VALUES(total_produccion),
+      total_consumo = total_consumo + VALUES(total_consumo),
+      total_venta = total_venta + VALUES(total_venta),
+      total_merma = total_merma + VALUES(total_merma),
+      total_ajuste = total_ajuste + VALUES(total_ajuste),
+      ultima_entrada = GREATEST(COALESCE(ultima_entrada, VALUES(ultima_entrada)), COALESCE(VALUES(ultima_entrada), ultima_entrada)),
+      ultima_salida = GREATEST(COALESCE(ultima_salida, VALUES(ultima_salida)), COALESCE(VALUES(ultima_salida), ultima_salida))
+""")
+
+
+def _max_fecha(actual, nueva):
+    if nueva is None:
+        return actual
+    nueva = str(nueva)
+    return nueva if actual is None or nueva > actual else actual
+
+
+def _aplicar_saldos(db: Session, movs: list[dict], cantidades: list[float]):
+    # Agrupa por (producto, ubicacion) para un solo upsert por llave; cantidades en uom base
+    saldos: dict[tuple[int, int], dict] = {}
+    for m, cantidad in zip(movs, cantidades):
+        key = (int(m["producto_id"]), int(m.get("ubicacion_id") or 0))
+        s = saldos.get(key)
+        if s is None:
+            s = {"producto_id": key[0], "ubicacion_id": key[1], "existencias": 0.0,
+                 "ultima_entrada": None, "ultima_salida": None}
+            s.update({col: 0.0 for col in _MOTIVO_COLS.values()})
+            saldos[key] = s
+        if m["tipo"] == "IN":
+            s["existencias"] += cantidad
+            s["ultima_entrada"] = _max_fecha(s["ultima_entrada"], m["fecha"])
+        elif m["tipo"] == "OUT":
+            s["existencias"] -= cantidad
+            s["ultima_salida"] = _max_fecha(s["ultima_salida"], m["fecha"])
+        col = _MOTIVO_COLS.get(m["motivo"])
+        if col:
+            s[col] += cantidad
+    if saldos:
+        db.execute(_UPSERT_SALDO, list(saldos.values()))
+
+
+def insert_inv_movs(db: Session, movs: list[dict]):
+    """Inserta movimientos de kardex y actualiza inv_saldo y hecho_inv en la misma transaccion (sin commit)."""
+    if not movs:
+        return
+    rows = [{
+        "fecha": m["fecha"], "producto_id": m["producto_id"], "uom_id": m["uom_id"],
+        "tipo": m["tipo"], "cantidad": m["cantidad"], "motivo": m["motivo"],
+        "ref_tabla": m.get("ref_tabla"), "ref_id": m.get("ref_id"),
+        "ubicacion_id": m.get("ubicacion_id"), "nota": m.get("nota"),
+        "costo_unitario_crc": m.get("costo_unitario_crc"),
+    } for m in movs]
+    db.execute(_INSERT_MOV, rows)
+    cantidades = conversor(db).a_base(
+        (m["producto_id"] for m in rows), (m["uom_id"] for m in rows), (m["cantidad"] for m in rows)
+    )
+    _aplicar_saldos(db, rows, cantidades)
+    hechos.registrar_movs(db, rows, cantidades)
+
+
 def insert_inv_mov(
     db: Session, *, fecha, producto_id, uom_id, tipo, cantidad,
-    motivo, ref_tabla=None, ref_id=None, ubicacion_id=None, nota=None
+    motivo, ref_tabla=None, ref_id=None, ubicacion_id=None, nota=None, costo_unitario_crc=None
 ):
-    q = text("""
-        INSERT INTO inv_mov (fecha,producto_id,uom_id,tipo,cantidad,motivo,ref_tabla,ref_id,ubicacion_id,nota)
-        VALUES (:fecha,:producto_id,:uom_id,:tipo,:cantidad,:motivo,:ref_tabla,:ref_id,:ubicacion_id,:nota)
-    """)
-    db.execute(q, dict(
+    insert_inv_movs(db, [dict(
         fecha=fecha, producto_id=producto_id, uom_id=uom_id, tipo=tipo, cantidad=cantidad,
-        motivo=motivo, ref_tabla=ref_tabla, ref_id=ref_id, ubicacion_id=ubicacion_id, nota=nota
-    ))
+        motivo=motivo, ref_tabla=ref_tabla, ref_id=ref_id, ubicacion_id=ubicacion_id, nota=nota,
+        costo_unitario_crc=costo_unitario_crc,
+    )])
+
+
+def rebuild_inv_saldo(db: Session, producto_ids=None) -> int:
+    """Recalcula inv_saldo desde el kardex (inv_mov); completo o solo producto_ids. Devuelve filas generadas."""
+    ids = tuple({int(x) for x in producto_ids}) if producto_ids is not None else None
+    if ids == ():
+        return 0
+    filtro = "WHERE producto_id IN :ids" if ids else ""
+    params = {"ids": ids} if ids else {}
+    crear_tabla_factores(db, f"SELECT DISTINCT producto_id, uom_id FROM inv_mov {filtro}", params)
+    db.execute(text(f"DELETE FROM inv_saldo {filtro}"), params)
+    res = db.execute(text(f"""
+        INSERT INTO inv_saldo (producto_id, ubicacion_id, existencias,
+                               total_compra, total_produccion, total_consumo, total_venta, total_merma, total_ajuste,
+                               ultima_entrada, ultima_salida)
+        SELECT m.producto_id, COALESCE(m.ubicacion_id, 0),
+               SUM(CASE WHEN m.tipo='IN' THEN m.cantidad_base WHEN m.tipo='OUT' THEN -m.cantidad_base ELSE 0 END),
+               SUM(CASE WHEN m.motivo='COMPRA' THEN m.cantidad_base ELSE 0 END),
+               SUM(CASE WHEN m.motivo='PRODUCCION_SALIDA' THEN m.cantidad_base ELSE 0 END),
+               SUM(CASE WHEN m.motivo='CONSUMO_RECETA' THEN m.cantidad_base ELSE 0 END),
+               SUM(CASE WHEN m.motivo='VENTA' THEN m.cantidad_base ELSE 0 END),
+               SUM(CASE WHEN m.motivo='MERMA' THEN m.cantidad_base ELSE 0 END),
+               SUM(CASE WHEN m.motivo='AJUSTE' THEN m.cantidad_base ELSE 0 END),
+               MAX(CASE WHEN m.tipo='IN' THEN m.fecha END),
+               MAX(CASE WHEN m.tipo='OUT' THEN m.fecha END)
+        FROM (
+            SELECT i.producto_id, i.ubicacion_id, i.tipo, i.motivo, i.fecha,
+                   i.cantidad * COALESCE(f.factor, 1) AS cantidad_base
+            FROM inv_mov i
+            LEFT JOIN tmp_uom_factor f ON f.producto_id = i.producto_id AND f.uom_id = i.uom_id
+            {filtro.replace("producto_id", "i.producto_id")}
+        ) m
+        GROUP BY m.producto_id, COALESCE(m.ubicacion_id, 0)
+    """), params)
+    return res.rowcount
+
+
+def reconvertir(db: Session, producto_ids=None) -> dict[str, int]:
+    """Recalcula lo guardado en uom base (inv_saldo, mp_costo, hechos) con las conversiones actuales.
+
+    Para usar despues de cambiar una conversion o la uom base de un producto, dentro de la
+    misma transaccion (sin commit). producto_ids=None recalcula todos los productos. La cache
+    de varianzas de esos productos se descarta y se recalcula al pedirla.
+    """
+    invalidar_conversor()
+    out = {
+        "inv_saldo": rebuild_inv_saldo(db, producto_ids),
+        "mp_costo": costing.rebuild_mp_costo(db, producto_ids),
+    }
+    out.update(hechos.rebuild_hechos(db, producto_ids))
+    pronostico.descartar()
+    if producto_ids is None:
+        out["varianza_mes"] = varianzas.descartar_cache(db)
+    else:
+        out["varianza_mes"] = varianzas.descartar_productos(db, producto_ids)
+    return out
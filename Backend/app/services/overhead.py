@@ -0,0 +1,160 @@
+import json
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cost_cache import cost_cache
+from .uom import conversor
+
+# PORCENTAJE_GLOBAL es el nombre que usa /finanzas/config/indirectos para PCT_DIRECTO
+METODOS = ("PCT_DIRECTO", "POR_HORA", "POR_UNIDAD")
+
+
+def mes_rango(mes: str) -> tuple[date, date]:
+    """[primer dia del mes, primer dia del siguiente) para filtrar con rangos que usen indices."""
+    ini = date.fromisoformat(f"{mes}-01")
+    fin = date(ini.year + (ini.month == 12), ini.month % 12 + 1, 1)
+    return ini, fin
+
+
+def mes_de(fecha) -> str:
+    if fecha is None:
+        return date.today().strftime("%Y-%m")
+    return str(fecha)[:7]
+
+
+def _num(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def config_indirectos(db: Session) -> dict:
+    """Metodo y parametros de config_costeo (id=1), normalizados."""
+    row = db.execute(text("SELECT metodo, parametro_json FROM config_costeo WHERE id = 1")).mappings().first()
+    row = row or {}
+    pj = row.get("parametro_json") or {}
+    if isinstance(pj, (str, bytes)):
+        try:
+            pj = json.loads(pj)
+        except ValueError:
+            pj = {}
+    metodo = row.get("metodo") or "PCT_DIRECTO"
+    if metodo not in METODOS:
+        metodo = "PCT_DIRECTO"
+    return {
+        "metodo": metodo,
+        "pct": _num(pj.get("pct", pj.get("porcentaje"))),
+        "tarifa_h": _num(pj.get("tarifa_h")),
+        "tarifa_unidad": _num(pj.get("tarifa_unidad")),
+    }
+
+
+def tasa_mes(db: Session, mes: str | None = None) -> dict:
+    """Tasa de indirectos del mes (YYYY-MM) segun el metodo configurado, en cost_cache.
+
+    - PCT_DIRECTO: pct fijo o, si no hay, pool / costo directo consumido en tandas del mes.
+    - POR_HORA: tarifa_h fija o pool / horas de planilla (planilla_det_dia) del mes.
+    - POR_UNIDAD: tarifa_unidad fija o pool / unidades producidas (tanda_salida) del mes.
+    El pool es costo_indirecto activo + gastos del mes. "deps" lista las dependencias
+    que debe heredar cualquier costeo que use la tasa.
+    """
+    mes = mes_de(mes)
+    hit = cost_cache.get(("tasa_indirecto", mes))
+    if hit is not None:
+        return hit
+
+    cfg = config_indirectos(db)
+    metodo = cfg["metodo"]
+    ini, fin = mes_rango(mes)
+    rango = {"ini": ini, "fin": fin}
+    res = {"mes": mes, "metodo": metodo, "pool_crc": None, "base": None, "tasa": 0.0,
+           "horas_por_tanda": {}, "horas_promedio_tanda": 0.0}
+    deps = [("config",)]
+    fija = {"PCT_DIRECTO": cfg["pct"], "POR_HORA": cfg["tarifa_h"], "POR_UNIDAD": cfg["tarifa_unidad"]}[metodo]
+
+    if metodo == "POR_HORA":
+        # Horas por tanda: horas de planilla del dia repartidas entre las tandas de ese dia
+        horas = {str(r["fecha"]): float(r["horas"] or 0) for r in db.execute(text("""
+            SELECT fecha, SUM(horas_reg + horas_extra + horas_doble + horas_feriado) AS horas
+            FROM planilla_det_dia WHERE fecha >= :ini AND fecha < :fin
+            GROUP BY fecha
+        """), rango).mappings().all()}
+        tandas = {str(r["fecha"]): int(r["n"]) for r in db.execute(text("""
+            SELECT fecha, COUNT(*) AS n FROM tanda WHERE fecha >= :ini AND fecha < :fin GROUP BY fecha
+        """), rango).mappings().all()}
+        total_h, total_t = sum(horas.values()), sum(tandas.values())
+        res["horas_por_tanda"] = {f: horas.get(f, 0.0) / n for f, n in tandas.items() if n}
+        res["horas_promedio_tanda"] = (total_h / total_t) if total_t else 0.0
+        res["base"] = total_h
+        deps += [("planilla", mes), ("produccion", mes)]
+    elif metodo == "POR_UNIDAD" and fija is None:
+        conv = conversor(db)
+        rows = db.execute(text("""
+            SELECT ts.producto_id, ts.uom_id, SUM(ts.cantidad) AS cantidad
+            FROM tanda_salida ts
+            JOIN tanda t ON t.id = ts.tanda_id
+            WHERE t.fecha >= :ini AND t.fecha < :fin
+            GROUP BY ts.producto_id, ts.uom_id
+        """), rango).mappings().all()
+        res["base"] = sum(conv.a_base(
+            (r["producto_id"] for r in rows), (r["uom_id"] for r in rows), (r["cantidad"] for r in rows)
+        ))
+        deps.append(("produccion", mes))
+    elif metodo == "PCT_DIRECTO" and fija is None:
+        conv = conversor(db)
+        rows = db.execute(text("""
+            SELECT tc.producto_id, tc.uom_id, SUM(tc.cantidad) AS cantidad,
+                   MAX(mc.ultimo_costo_crc) AS costo
+            FROM tanda_consumo tc
+            JOIN tanda t ON t.id = tc.tanda_id
+            LEFT JOIN mp_costo mc ON mc.producto_id = tc.producto_id
+            WHERE t.fecha >= :ini AND t.fecha < :fin
+            GROUP BY tc.producto_id, tc.uom_id
+        """), rango).mappings().all()
+        cantidades = conv.a_base(
+            (r["producto_id"] for r in rows), (r["uom_id"] for r in rows), (r["cantidad"] for r in rows)
+        )
+        res["base"] = sum(q * float(r["costo"] or 0) for q, r in zip(cantidades, rows))
+        deps.append(("produccion", mes))
+        deps += [("mp", int(r["producto_id"])) for r in rows]
+
+    if fija is not None:
+        res["tasa"] = fija
+    else:
+        pool = db.execute(text("""
+            SELECT (SELECT COALESCE(SUM(monto_mensual_crc), 0) FROM costo_indirecto WHERE activo = 1)
+                 + (SELECT COALESCE(SUM(monto_crc), 0) FROM gasto WHERE fecha >= :ini AND fecha < :fin)
+        """), rango).scalar()
+        res["pool_crc"] = float(pool or 0)
+        res["tasa"] = (res["pool_crc"] / res["base"]) if res["base"] else 0.0
+        deps += [("indirectos",), ("gastos", mes)]
+
+    res["deps"] = deps
+    cost_cache.put(("tasa_indirecto", mes), res, deps)
+    return res
+
+
+def indirecto(tasa: dict, directo, unidades=0.0, horas=None):
+    """Indirecto asignado con la tasa del mes; acepta escalares o arrays de NumPy."""
+    if tasa["metodo"] == "POR_HORA":
+        return tasa["tasa"] * (tasa["horas_promedio_tanda"] if horas is None else horas)
+    if tasa["metodo"] == "POR_UNIDAD":
+        return tasa["tasa"] * unidades
+    return directo * tasa["tasa"]
+
+
+def horas_tanda(tasa: dict, fecha) -> float:
+    """Horas asignadas a una tanda: las del dia repartidas entre sus tandas, o el promedio del mes."""
+    h = tasa["horas_por_tanda"].get(str(fecha)[:10])
+    return h if h else tasa["horas_promedio_tanda"]
+
+
+def invalidar(tipo: str, fecha=None):
+    """Invalida la tasa del mes (y lo que la usa) cuando cambia una de sus entradas."""
+    if fecha is None:
+        cost_cache.invalidate((tipo,))
+    else:
+        cost_cache.invalidate((tipo, mes_de(fecha)))
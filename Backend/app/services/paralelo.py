@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..db import SessionLocal
+
+# Mantenerlo por debajo del pool de conexiones (pool_size 5 + overflow 10) para no acapararlo
+_EXECUTOR = ThreadPoolExecutor(max_workers=max(settings.REPORT_WORKERS, 1), thread_name_prefix="consultas")
+
+
+def _con_sesion(fn: Callable[[Session], object]):
+    with SessionLocal() as db:
+        return fn(db)
+
+
+def en_paralelo(tareas: dict[str, Callable[[Session], object]]) -> dict[str, object]:
+    """Ejecuta consultas independientes a la vez, cada una con su propia conexion del pool.
+
+    tareas: {nombre: fn(db)}. Devuelve {nombre: resultado}; si alguna falla se propaga
+    su excepcion.
+    """
+    if len(tareas) < 2:
+        return {k: _con_sesion(fn) for k, fn in tareas.items()}
+    futuros = {k: _EXECUTOR.submit(_con_sesion, fn) for k, fn in tareas.items()}
+    return {k: f.result() for k, f in futuros.items()}
@@ -0,0 +1,76 @@
+from datetime import date
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .simulacion import matriz_recetas
+
+
+def requerimientos(db: Session, plan: list[dict], ubicacion_id: int | None = None) -> list[dict]:
+    """Requerimientos de MP (uom base) para un plan de tandas, netos contra inv_saldo.
+
+    plan: [{receta_id, fecha (date), cantidad_tandas}]. Las subrecetas vienen aplanadas
+    en matriz_recetas, asi que el plan completo se resuelve con un producto matricial
+    (fechas x recetas) @ (recetas x MP) y un acumulado por fecha para ubicar el quiebre.
+    Los intermedios se explotan completos hasta MP: sus existencias no se descuentan.
+    Lanza KeyError con el receta_id si el plan trae una receta inexistente.
+    """
+    m = matriz_recetas(db)
+    fila = {rid: i for i, rid in enumerate(m["receta_ids"])}
+    fechas = sorted({p["fecha"] for p in plan})
+    pos = {f: i for i, f in enumerate(fechas)}
+    P = np.zeros((len(fechas), len(fila)))
+    for p in plan:
+        rid = int(p["receta_id"])
+        if rid not in fila:
+            raise KeyError(rid)
+        P[pos[p["fecha"]], fila[rid]] += float(p["cantidad_tandas"])
+
+    acumulado = np.cumsum(P @ m["cantidades"], axis=0)
+    bruto = acumulado[-1] if len(fechas) else np.zeros(len(m["mp_ids"]))
+    usadas = np.flatnonzero(bruto > 0)
+    if not len(usadas):
+        return []
+    mp_ids = [m["mp_ids"][j] for j in usadas]
+    acumulado, bruto = acumulado[:, usadas], bruto[usadas]
+
+    params = {"ids": tuple(mp_ids)}
+    filtro = ""
+    if ubicacion_id is not None:
+        filtro = " AND s.ubicacion_id = :ubicacion_id"
+        params["ubicacion_id"] = ubicacion_id
+    rows = db.execute(text(f"""
+        SELECT p.id, p.sku, p.nombre, p.uom_base_id, u.nombre AS uom_nombre,
+               COALESCE(SUM(s.existencias), 0) AS existencias
+        FROM producto p
+        LEFT JOIN uom u ON u.id = p.uom_base_id
+        LEFT JOIN inv_saldo s ON s.producto_id = p.id{filtro}
+        WHERE p.id IN :ids
+        GROUP BY p.id, p.sku, p.nombre, p.uom_base_id, u.nombre
+    """), params).mappings().all()
+    info = {int(r["id"]): r for r in rows}
+    stock = np.array([float(info[mp]["existencias"]) if mp in info else 0.0 for mp in mp_ids])
+
+    # primer dia en que el consumo acumulado supera las existencias
+    falta = acumulado > np.maximum(stock, 0) + 1e-9
+    hay_quiebre = falta.any(axis=0)
+    dia_quiebre = falta.argmax(axis=0)
+    por_comprar = np.maximum(bruto - np.maximum(stock, 0), 0)
+
+    out = []
+    for j, mp in enumerate(mp_ids):
+        r = info.get(mp) or {}
+        out.append({
+            "producto_id": mp,
+            "sku": r.get("sku"),
+            "nombre": r.get("nombre"),
+            "uom_id": r.get("uom_base_id"),
+            "uom_nombre": r.get("uom_nombre"),
+            "requerido": float(bruto[j]),
+            "existencias": float(stock[j]),
+            "por_comprar": float(por_comprar[j]),
+            "fecha_quiebre": fechas[dia_quiebre[j]] if hay_quiebre[j] else None,
+        })
+    out.sort(key=lambda x: (x["fecha_quiebre"] is None, x["fecha_quiebre"] or date.max, x["nombre"] or ""))
+    return out
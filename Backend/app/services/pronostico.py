@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+from threading import Lock
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+METODOS = ("perfil", "suavizado", "estacional")
+
+# Ultimo pronostico por juego de parametros: (horizonte, historia, metodo, alpha) ->
+# (hoy, ultima venta_det.id, resultado). Un dia o una venta nueva lo reemplazan.
+_MAX_PARAMETROS = 16
+_cache: OrderedDict = OrderedDict()
+_lock = Lock()
+
+
+def _historia(db: Session, ini: date, fin: date) -> tuple[list[int], np.ndarray]:
+    """Ventas diarias (uom base) de PT en [ini, fin) como matriz producto x dia, en una consulta."""
+    rows = db.execute(text("""
+        SELECT h.producto_id, h.fecha, SUM(h.cantidad) AS cantidad
+        FROM hecho_venta h
+        JOIN producto p ON p.id = h.producto_id
+        WHERE p.tipo = 'PT' AND h.fecha >= :ini AND h.fecha < :fin
+        GROUP BY h.producto_id, h.fecha
+    """), {"ini": ini, "fin": fin}).all()
+    ids = sorted({int(r[0]) for r in rows})
+    fila = {pid: i for i, pid in enumerate(ids)}
+    Y = np.zeros((len(ids), (fin - ini).days))
+    if rows:
+        i = np.fromiter((fila[int(r[0])] for r in rows), dtype=np.int64, count=len(rows))
+        j = np.fromiter(((r[1] - ini).days for r in rows), dtype=np.int64, count=len(rows))
+        np.add.at(Y, (i, j), np.fromiter((float(r[2] or 0) for r in rows), dtype=float, count=len(rows)))
+    return ids, Y
+
+
+def _indice_semanal(Y: np.ndarray) -> np.ndarray:
+    """Indice por posicion en la semana (P x 7) relativo al promedio diario; 1 sin historia."""
+    T = Y.shape[1]
+    pos = np.arange(T) % 7
+    suma = np.zeros((Y.shape[0], 7))
+    np.add.at(suma.T, pos, Y.T)
+    dias = np.bincount(pos, minlength=7)
+    medias = suma / np.maximum(dias, 1)
+    nivel = Y.mean(axis=1, keepdims=True)
+    return np.divide(medias, nivel, out=np.ones_like(medias), where=nivel > 0)
+
+
+def ajustar(Y: np.ndarray, horizonte: int, metodo: str, alpha: float = 0.3) -> np.ndarray:
+    """Pronostico (P x horizonte) para todos los productos a la vez.
+
+    Los dias futuros siguen a la ultima columna de Y; la posicion en la semana se cuenta
+    desde la primera columna. perfil: promedio de cada dia de la semana en las ultimas
+    8 semanas. suavizado: suavizado exponencial simple de la serie desestacionalizada
+    por dia de la semana (un paso por dia para todos los productos). estacional: la
+    ultima semana se repite.
+    """
+    P, T = Y.shape
+    fut = (T + np.arange(horizonte)) % 7
+    if P == 0 or T < 7:
+        return np.zeros((P, horizonte))
+    if metodo == "estacional":
+        ultima = Y[:, T - 7:]
+        return ultima[:, (fut - (T - 7)) % 7]
+    if metodo == "perfil":
+        k = min(8, T // 7)
+        ventana = Y[:, T - 7 * k:].reshape(P, k, 7).mean(axis=1)
+        return ventana[:, (fut - (T - 7 * k)) % 7]
+    idx = _indice_semanal(Y)
+    pos = np.arange(T) % 7
+    Z = np.divide(Y, idx[:, pos], out=Y.copy(), where=idx[:, pos] > 0)
+    nivel = Z[:, 0].copy()
+    for t in range(1, T):
+        nivel += alpha * (Z[:, t] - nivel)
+    return nivel[:, None] * idx[:, fut]
+
+
+def _error_pct(Y: np.ndarray, metodo: str, alpha: float) -> np.ndarray:
+    # WAPE de las ultimas 4 semanas pronosticadas con la historia previa (backtest)
+    B = 28
+    if Y.shape[1] < 2 * B:
+        return np.full(Y.shape[0], np.nan)
+    F = ajustar(Y[:, :-B], B, metodo, alpha)
+    real = Y[:, -B:]
+    den = real.sum(axis=1)
+    return np.divide(np.abs(F - real).sum(axis=1), den, out=np.full(len(den), np.nan), where=den > 0) * 100
+
+
+def descartar():
+    """Vacia la cache (p. ej. cuando cambian las cantidades base de hecho_venta)."""
+    with _lock:
+        _cache.clear()
+
+
+def pronosticar(
+    db: Session,
+    horizonte: int = 28,
+    historia: int = 364,
+    metodo: str = "perfil",
+    alpha: float = 0.3,
+    hoy: date | None = None,
+) -> dict:
+    """Pronostico diario por PT desde hoy (la historia termina ayer).
+
+    Devuelve {desde, fechas, producto_ids, pronostico (P x horizonte), promedio_diario,
+    error_pct}. Se guarda solo el ultimo resultado por juego de parametros, valido
+    mientras no cambie el dia ni llegue una venta nueva.
+    """
+    hoy = hoy or date.today()
+    firma = db.execute(text("SELECT MAX(id) FROM venta_det")).scalar()
+    key = (horizonte, historia, metodo, alpha)
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[:2] == (hoy, firma):
+            _cache.move_to_end(key)
+            return hit[2]
+
+    ids, Y = _historia(db, hoy - timedelta(days=historia), hoy)
+    res = {
+        "desde": hoy,
+        "fechas": [hoy + timedelta(days=i) for i in range(horizonte)],
+        "producto_ids": ids,
+        "pronostico": np.maximum(ajustar(Y, horizonte, metodo, alpha), 0),
+        "promedio_diario": Y.mean(axis=1) if Y.shape[1] else np.zeros(len(ids)),
+        "error_pct": _error_pct(Y, metodo, alpha),
+    }
+    with _lock:
+        _cache[key] = (hoy, firma, res)
+        _cache.move_to_end(key)
+        while len(_cache) > _MAX_PARAMETROS:
+            _cache.popitem(last=False)
+    return res
@@ -0,0 +1,158 @@
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import overhead
+from .cost_cache import cost_cache
+from .costing import CicloRecetasError, costos_ultimos
+from .uom import conversor
+
+
+def matriz_recetas(db: Session) -> dict:
+    """Matriz receta x MP con la cantidad (uom base) de cada MP hoja por tanda de receta.
+
+    Las subrecetas se aplanan: un ingrediente producido por otra receta aporta sus MP
+    en proporcion a cantidad / rendimiento. Se guarda en cost_cache hasta que cambie
+    alguna receta o las conversiones de uom (los precios de venta se leen aparte).
+    """
+    hit = cost_cache.get(("matriz_recetas",))
+    if hit is not None:
+        return hit
+
+    recetas = db.execute(text("""
+        SELECT id, nombre, producto_salida_id FROM receta ORDER BY id
+    """)).mappings().all()
+    ings = db.execute(text("""
+        SELECT receta_id, producto_id, uom_id, cantidad FROM receta_det ORDER BY receta_id, id
+    """)).mappings().all()
+    salidas = db.execute(text("""
+        SELECT receta_id, producto_id, uom_id, rendimiento FROM receta_salida
+    """)).mappings().all()
+
+    conv = conversor(db)
+    productores: dict[int, int] = {}
+    rend: dict[int, float] = {}
+    for s in salidas:
+        rid, pid = int(s["receta_id"]), int(s["producto_id"])
+        productores[pid] = min(productores.get(pid, rid), rid)
+        rend[rid] = rend.get(rid, 0.0) + float(s["rendimiento"] or 0) * conv.factor(pid, s["uom_id"])
+    lineas: dict[int, list[tuple[int, float]]] = {}
+    for it in ings:
+        pid = int(it["producto_id"])
+        qty = float(it["cantidad"] or 0) * conv.factor(pid, it["uom_id"])
+        lineas.setdefault(int(it["receta_id"]), []).append((pid, qty))
+
+    # Vector disperso {mp: cantidad} por receta, memoizado (lineal en aristas)
+    hojas: dict[int, dict[int, float]] = {}
+    en_curso: list[int] = []
+
+    def aplanar(rid: int) -> dict[int, float]:
+        if rid in hojas:
+            return hojas[rid]
+        if rid in en_curso:
+            raise CicloRecetasError(en_curso[en_curso.index(rid):] + [rid])
+        en_curso.append(rid)
+        vec: dict[int, float] = {}
+        for pid, qty in lineas.get(rid, ()):
+            sub = productores.get(pid)
+            if sub is None:
+                vec[pid] = vec.get(pid, 0.0) + qty
+                continue
+            rs = rend.get(sub, 0.0)
+            if rs <= 0:
+                continue
+            for mp, q in aplanar(sub).items():
+                vec[mp] = vec.get(mp, 0.0) + qty * q / rs
+        en_curso.pop()
+        hojas[rid] = vec
+        return vec
+
+    receta_ids = [int(r["id"]) for r in recetas]
+    for rid in receta_ids:
+        aplanar(rid)
+    mp_ids = sorted({mp for rid in receta_ids for mp in hojas[rid]})
+    col = {mp: j for j, mp in enumerate(mp_ids)}
+    A = np.zeros((len(receta_ids), len(mp_ids)))
+    for i, rid in enumerate(receta_ids):
+        for mp, q in hojas[rid].items():
+            A[i, col[mp]] = q
+
+    res = {
+        "receta_ids": receta_ids,
+        "nombres": [r["nombre"] for r in recetas],
+        "producto_salida_ids": [r["producto_salida_id"] for r in recetas],
+        "rendimiento": np.array([rend.get(rid, 0.0) for rid in receta_ids]),
+        "mp_ids": mp_ids,
+        "cantidades": A,
+    }
+    cost_cache.put(("matriz_recetas",), res, [("recetas",), ("uom",)])
+    return res
+
+
+def _precios_venta(db: Session, producto_ids: list) -> np.ndarray:
+    # sin precio de venta (p. ej. intermedios) el margen queda en None
+    ids = tuple({int(x) for x in producto_ids if x})
+    precios = {}
+    if ids:
+        precios = dict(db.execute(text("""
+            SELECT id, precio_venta_crc FROM producto WHERE id IN :ids
+        """), {"ids": ids}).all())
+    return np.array([
+        float(precios[p]) if p and precios.get(p) is not None else np.nan for p in producto_ids
+    ])
+
+
+def simular(db: Session, shocks: list[dict], pct_ind: float | None = None) -> list[dict]:
+    """Costo unitario y margen por receta con shocks de precio por MP.
+
+    El escenario actual usa la tasa de indirectos del mes; pct_ind la reemplaza
+    por un porcentaje sobre el directo en el escenario nuevo.
+
+    shock: {producto_id, pct} (0.10 = +10%) y/o {producto_id, delta_crc} (por uom base).
+    """
+    m = matriz_recetas(db)
+    mp_ids = m["mp_ids"]
+    col = {mp: j for j, mp in enumerate(mp_ids)}
+    costos = costos_ultimos(db, mp_ids)
+    p0 = np.array([costos.get(mp, 0.0) for mp in mp_ids])
+    factor = np.ones(len(mp_ids))
+    delta = np.zeros(len(mp_ids))
+    for s in shocks:
+        j = col.get(int(s["producto_id"]))
+        if j is None:
+            continue
+        factor[j] *= 1 + float(s.get("pct") or 0)
+        delta[j] += float(s.get("delta_crc") or 0)
+    p1 = np.maximum(p0 * factor + delta, 0)
+
+    tasa = overhead.tasa_mes(db)
+    tasa_nueva = tasa if pct_ind is None else {"metodo": "PCT_DIRECTO", "tasa": float(pct_ind)}
+    A, rend = m["cantidades"], m["rendimiento"]
+    precio = _precios_venta(db, m["producto_salida_ids"])
+    d0, d1 = A @ p0, A @ p1
+    t0 = d0 + overhead.indirecto(tasa, d0, unidades=rend)
+    t1 = d1 + overhead.indirecto(tasa_nueva, d1, unidades=rend)
+    con_rend = rend > 0
+    div = np.where(con_rend, rend, 1)
+    u0 = np.where(con_rend, t0 / div, np.nan)
+    u1 = np.where(con_rend, t1 / div, np.nan)
+    mg0, mg1 = precio - u0, precio - u1
+
+    def _num(x):
+        return None if np.isnan(x) else float(x)
+
+    out = []
+    for i, rid in enumerate(m["receta_ids"]):
+        out.append({
+            "receta_id": rid,
+            "nombre": m["nombres"][i],
+            "producto_salida_id": m["producto_salida_ids"][i],
+            "precio_venta_crc": _num(precio[i]),
+            "unitario_actual_crc": _num(u0[i]),
+            "unitario_nuevo_crc": _num(u1[i]),
+            "delta_unitario_crc": _num(u1[i] - u0[i]),
+            "margen_actual_crc": _num(mg0[i]),
+            "margen_nuevo_crc": _num(mg1[i]),
+            "delta_margen_crc": _num(mg1[i] - mg0[i]),
+        })
+    return out
@@ -0,0 +1,44 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# cabecera -> (detalle, fk, precio/costo unitario)
+_DOCUMENTOS = {
+    "venta": ("venta_det", "venta_id", "precio_unitario_crc"),
+    "compra": ("compra_det", "compra_id", "costo_unitario_crc"),
+}
+
+
+def _detalle(tabla: str) -> str:
+    det, fk, precio = _DOCUMENTOS[tabla]
+    return f"""
+        SELECT {fk} AS id, SUM(cantidad * {precio} - COALESCE(descuento_crc, 0)) AS total, COUNT(*) AS n
+        FROM {det} GROUP BY {fk}
+    """
+
+
+def verificar_totales(db: Session, tolerancia: float = 0.01) -> dict[str, list[dict]]:
+    """Cabeceras cuyo total_crc/lineas (mantenidos por triggers) no cuadran con su detalle."""
+    out = {}
+    for tabla in _DOCUMENTOS:
+        out[tabla] = [dict(r) for r in db.execute(text(f"""
+            SELECT h.id, h.total_crc, h.lineas,
+                   COALESCE(d.total, 0) AS total_detalle, COALESCE(d.n, 0) AS lineas_detalle
+            FROM {tabla} h
+            LEFT JOIN ({_detalle(tabla)}) d ON d.id = h.id
+            WHERE ABS(h.total_crc - COALESCE(d.total, 0)) > :tol OR h.lineas <> COALESCE(d.n, 0)
+            ORDER BY h.id
+        """), {"tol": tolerancia}).mappings().all()]
+    return out
+
+
+def rebuild_totales(db: Session) -> dict[str, int]:
+    """Recalcula total_crc y lineas de todas las cabeceras desde el detalle. Devuelve filas cambiadas."""
+    out = {}
+    for tabla in _DOCUMENTOS:
+        res = db.execute(text(f"""
+            UPDATE {tabla} h
+            LEFT JOIN ({_detalle(tabla)}) d ON d.id = h.id
+            SET h.total_crc = COALESCE(d.total, 0), h.lineas = COALESCE(d.n, 0)
+        """))
+        out[tabla] = res.rowcount
+    return out
@@ -0,0 +1,125 @@
+from collections import deque
+from threading import Lock
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cost_cache import cost_cache
+
+
+class ConversorUom:
+    """Factores de conversion hacia la uom base de cada producto (cantidad_base = cantidad * factor).
+
+    Usa uom_conversion: filas genericas (producto_id NULL, p. ej. G -> KG) y filas
+    por producto (p. ej. UN de huevo -> KG). Las conversiones se recorren en ambos
+    sentidos y en cadena; si no hay camino se asume factor 1.
+    """
+
+    def __init__(self, conversiones: list[dict], base: dict[int, int]):
+        self._base = base
+        self._genericas: dict[int, list] = {}
+        self._por_producto: dict[int, dict[int, list]] = {}
+        for c in conversiones:
+            o, d, f = int(c["uom_origen_id"]), int(c["uom_destino_id"]), float(c["factor"])
+            if f <= 0:
+                continue
+            grafo = self._genericas if c["producto_id"] is None else \
+                self._por_producto.setdefault(int(c["producto_id"]), {})
+            grafo.setdefault(o, []).append((d, f))
+            grafo.setdefault(d, []).append((o, 1 / f))
+        self._memo: dict[tuple[int, int], float] = {}
+
+    def uom_base(self, producto_id) -> int | None:
+        return self._base.get(int(producto_id))
+
+    def factor(self, producto_id, uom_id) -> float:
+        pid = int(producto_id)
+        uom = int(uom_id) if uom_id is not None else None
+        base = self._base.get(pid)
+        if uom is None or base is None or uom == base:
+            return 1.0
+        key = (pid, uom)
+        f = self._memo.get(key)
+        if f is None:
+            f = self._memo[key] = self._buscar(pid, uom, base)
+        return f
+
+    def a_base(self, producto_ids, uom_ids, cantidades) -> list[float]:
+        """Convierte listas paralelas de cantidades a la uom base de su producto."""
+        return [float(c or 0) * self.factor(p, u) for p, u, c in zip(producto_ids, uom_ids, cantidades)]
+
+    def _buscar(self, pid: int, origen: int, destino: int) -> float:
+        # BFS sobre conversiones genericas + las propias del producto
+        propias = self._por_producto.get(pid, {})
+        vistos = {origen: 1.0}
+        cola = deque([origen])
+        while cola:
+            u = cola.popleft()
+            if u == destino:
+                return vistos[u]
+            for v, f in propias.get(u, []) + self._genericas.get(u, []):
+                if v not in vistos:
+                    vistos[v] = vistos[u] * f
+                    cola.append(v)
+        return 1.0
+
+
+_conversor: ConversorUom | None = None
+_lock = Lock()
+
+
+def cargar_conversor(db: Session) -> ConversorUom:
+    conversiones = db.execute(text("""
+        SELECT producto_id, uom_origen_id, uom_destino_id, factor FROM uom_conversion
+    """)).mappings().all()
+    base = {
+        int(r["id"]): int(r["uom_base_id"])
+        for r in db.execute(text("SELECT id, uom_base_id FROM producto")).mappings().all()
+    }
+    return ConversorUom(conversiones, base)
+
+
+def conversor(db: Session) -> ConversorUom:
+    """Conversor en memoria; se carga una vez por proceso hasta invalidar_conversor()."""
+    global _conversor
+    c = _conversor
+    if c is None:
+        with _lock:
+            if _conversor is None:
+                _conversor = cargar_conversor(db)
+            c = _conversor
+    return c
+
+
+def invalidar_conversor():
+    global _conversor
+    _conversor = None
+    # lo guardado en cost_cache con factores ya aplicados depende de ("uom",)
+    cost_cache.invalidate(("uom",))
+
+
+def crear_tabla_factores(db: Session, pares_sql: str, params: dict | None = None):
+    """Llena la tabla temporal tmp_uom_factor para los pares (producto_id, uom_id) del SELECT dado.
+
+    Permite que las reconstrucciones en SQL (mp_costo, inv_saldo) conviertan a uom base
+    con el mismo criterio que el conversor en memoria.
+    """
+    conv = conversor(db)
+    pares = db.execute(text(pares_sql), params or {}).all()
+    db.execute(text("DROP TEMPORARY TABLE IF EXISTS tmp_uom_factor"))
+    db.execute(text("""
+        CREATE TEMPORARY TABLE tmp_uom_factor (
+          producto_id BIGINT NOT NULL,
+          uom_id BIGINT NOT NULL,
+          factor DECIMAL(24,12) NOT NULL,
+          PRIMARY KEY (producto_id, uom_id)
+        )
+    """))
+    filas = [
+        {"producto_id": p, "uom_id": u, "factor": conv.factor(p, u)}
+        for p, u in pares if u is not None
+    ]
+    if filas:
+        db.execute(text("""
+            INSERT INTO tmp_uom_factor (producto_id, uom_id, factor) VALUES (:producto_id, :uom_id, :factor)
+        """), filas)
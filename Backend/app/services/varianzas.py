@@ -0,0 +1,220 @@
+from datetime import date, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cost_history import cargar_historial
+from .overhead import mes_de
+from .uom import conversor
+
+_COLS = ("tanda_id", "tipo", "producto_id", "mes", "fecha", "receta_id", "cantidad_tandas",
+         "cantidad_real", "cantidad_std", "costo_unitario_crc", "varianza_crc")
+
+
+def _meses(desde: date, hasta: date) -> list[str]:
+    out, d = [], date(desde.year, desde.month, 1)
+    while d <= hasta:
+        out.append(d.strftime("%Y-%m"))
+        d = date(d.year + (d.month == 12), d.month % 12 + 1, 1)
+    return out
+
+
+def _acumular(db: Session, rows, key, valor) -> dict[int, dict[int, float]]:
+    conv = conversor(db)
+    out: dict[int, dict[int, float]] = {}
+    for r in rows:
+        pid = int(r["producto_id"])
+        lineas = out.setdefault(int(r[key]), {})
+        lineas[pid] = lineas.get(pid, 0.0) + float(r[valor] or 0) * conv.factor(pid, r["uom_id"])
+    return out
+
+
+def calcular(db: Session, ini: date, fin: date) -> list[dict]:
+    """Lineas de varianza (uom base) de las tandas con receta en [ini, fin).
+
+    CONSUMO: (real - receta x cantidad_tandas) x costo de la MP a la fecha de la tanda.
+    SALIDA: (estandar - real) x unitario estandar de la receta. Positivo = desfavorable.
+    Los estandares se cargan una vez por receta, no por tanda.
+    """
+    rango = {"ini": ini, "fin": fin}
+    tandas = db.execute(text("""
+        SELECT id, fecha, receta_id, cantidad_tandas FROM tanda
+        WHERE fecha >= :ini AND fecha < :fin AND receta_id IS NOT NULL
+    """), rango).mappings().all()
+    if not tandas:
+        return []
+    real_c = _acumular(db, db.execute(text("""
+        SELECT c.tanda_id, c.producto_id, c.uom_id, SUM(c.cantidad) AS cantidad
+        FROM tanda_consumo c
+        JOIN tanda t ON t.id = c.tanda_id
+        WHERE t.fecha >= :ini AND t.fecha < :fin AND t.receta_id IS NOT NULL
+        GROUP BY c.tanda_id, c.producto_id, c.uom_id
+    """), rango).mappings().all(), "tanda_id", "cantidad")
+    real_s = _acumular(db, db.execute(text("""
+        SELECT s.tanda_id, s.producto_id, s.uom_id, SUM(s.cantidad) AS cantidad
+        FROM tanda_salida s
+        JOIN tanda t ON t.id = s.tanda_id
+        WHERE t.fecha >= :ini AND t.fecha < :fin AND t.receta_id IS NOT NULL
+        GROUP BY s.tanda_id, s.producto_id, s.uom_id
+    """), rango).mappings().all(), "tanda_id", "cantidad")
+    rids = {"rids": tuple({int(t["receta_id"]) for t in tandas})}
+    std_c = _acumular(db, db.execute(text("""
+        SELECT receta_id, producto_id, uom_id, cantidad FROM receta_det WHERE receta_id IN :rids
+    """), rids).mappings().all(), "receta_id", "cantidad")
+    std_s = _acumular(db, db.execute(text("""
+        SELECT receta_id, producto_id, uom_id, rendimiento FROM receta_salida WHERE receta_id IN :rids
+    """), rids).mappings().all(), "receta_id", "rendimiento")
+
+    mps = {pid for lineas in real_c.values() for pid in lineas} | {pid for lineas in std_c.values() for pid in lineas}
+    hist = cargar_historial(db, mps, hasta=fin)
+
+    out = []
+    for t in tandas:
+        tid, rid, fecha = int(t["id"]), int(t["receta_id"]), t["fecha"]
+        n = float(t["cantidad_tandas"] or 1)
+        base = {"tanda_id": tid, "mes": mes_de(fecha), "fecha": fecha, "receta_id": rid, "cantidad_tandas": n}
+        receta, consumido = std_c.get(rid, {}), real_c.get(tid, {})
+        costos = {pid: hist.costo_al(pid, fecha) for pid in set(receta) | set(consumido)}
+        for pid, costo in costos.items():
+            real, std = consumido.get(pid, 0.0), receta.get(pid, 0.0) * n
+            out.append(dict(base, tipo="CONSUMO", producto_id=pid, cantidad_real=real, cantidad_std=std,
+                            costo_unitario_crc=costo, varianza_crc=(real - std) * costo))
+        rend = std_s.get(rid, {})
+        rend_total = sum(rend.values())
+        unitario = sum(q * costos[pid] for pid, q in receta.items()) / rend_total if rend_total > 0 else 0.0
+        producido = real_s.get(tid, {})
+        for pid in set(rend) | set(producido):
+            real, std = producido.get(pid, 0.0), rend.get(pid, 0.0) * n
+            out.append(dict(base, tipo="SALIDA", producto_id=pid, cantidad_real=real, cantidad_std=std,
+                            costo_unitario_crc=unitario, varianza_crc=(std - real) * unitario))
+    return out
+
+
+def descartar_mes(db: Session, fecha):
+    """Borra (sin commit) la cache del mes de la tanda, para que se recalcule al pedirlo."""
+    db.execute(text("DELETE FROM varianza_mes WHERE mes = :mes"), {"mes": mes_de(fecha)})
+
+
+def _descartar_meses(db: Session, filtro: str, params: dict) -> int:
+    # los meses se leen antes: el DELETE en cascada no puede leer varianza_tanda en la misma sentencia
+    meses = db.execute(text(f"SELECT DISTINCT mes FROM varianza_tanda WHERE {filtro}"), params).scalars().all()
+    if meses:
+        db.execute(text("DELETE FROM varianza_mes WHERE mes IN :meses"), {"meses": tuple(meses)})
+    return len(meses)
+
+
+def descartar_receta(db: Session, receta_id: int) -> int:
+    """Borra (sin commit) la cache de los meses con tandas de la receta (cambio de estandar)."""
+    return _descartar_meses(db, "receta_id = :rid", {"rid": receta_id})
+
+
+def descartar_productos(db: Session, producto_ids, desde=None) -> int:
+    """Borra (sin commit) la cache de los meses, desde la fecha dada, con lineas de esos productos.
+
+    Para compras con fecha pasada (cambia el costo historico) o conversiones por producto.
+    """
+    ids = tuple({int(x) for x in producto_ids})
+    if not ids:
+        return 0
+    filtro, params = "producto_id IN :ids", {"ids": ids}
+    if desde is not None:
+        filtro += " AND mes >= :mes"
+        params["mes"] = mes_de(desde)
+    return _descartar_meses(db, filtro, params)
+
+
+def descartar_cache(db: Session) -> int:
+    """Borra la cache de todos los meses (p. ej. tras corregir recetas o conversiones)."""
+    return db.execute(text("DELETE FROM varianza_mes")).rowcount
+
+
+def lineas(db: Session, desde: date, hasta: date) -> list[dict]:
+    """Lineas de varianza de tandas entre desde y hasta (inclusive).
+
+    Los meses cerrados se calculan una sola vez y quedan en varianza_tanda (esta lectura
+    hace commit de la cache); el mes en curso (y cualquier mes cerrado aun sin cache) se
+    calcula en una sola pasada. Las escrituras que cambian un mes cerrado lo descartan:
+    tandas, recetas, compras con fecha pasada y conversiones de uom.
+    """
+    meses = _meses(desde, hasta)
+    actual = mes_de(None)
+    en_cache = set(db.execute(text("SELECT mes FROM varianza_mes WHERE mes IN :meses"),
+                              {"meses": tuple(meses)}).scalars().all())
+    calcular_meses = [m for m in meses if m not in en_cache]
+    nuevos = []
+    if calcular_meses:
+        ini = date.fromisoformat(f"{calcular_meses[0]}-01")
+        fin = (date.fromisoformat(f"{calcular_meses[-1]}-01") + timedelta(days=32)).replace(day=1)
+        nuevos = [r for r in calcular(db, ini, fin) if r["mes"] in calcular_meses]
+        cerrar = [m for m in calcular_meses if m < actual]
+        if cerrar:
+            db.execute(text("INSERT IGNORE INTO varianza_mes (mes) VALUES (:mes)"), [{"mes": m} for m in cerrar])
+            filas = [r for r in nuevos if r["mes"] in cerrar]
+            if filas:
+                db.execute(text(f"""
+                    INSERT IGNORE INTO varianza_tanda ({", ".join(_COLS)})
+                    VALUES ({", ".join(":" + c for c in _COLS)})
+                """), filas)
+            db.commit()
+
+    cache = []
+    if en_cache:
+        cache = [dict(r) for r in db.execute(text(f"""
+            SELECT {", ".join(_COLS)} FROM varianza_tanda
+            WHERE mes IN :meses AND fecha >= :desde AND fecha <= :hasta
+        """), {"meses": tuple(en_cache), "desde": desde, "hasta": hasta}).mappings().all()]
+        for r in cache:
+            for c in ("cantidad_tandas", "cantidad_real", "cantidad_std", "costo_unitario_crc", "varianza_crc"):
+                r[c] = float(r[c])
+    return cache + [r for r in nuevos if desde <= r["fecha"] <= hasta]
+
+
+def resumen(db: Session, filas: list[dict]) -> dict:
+    """Agrupa las lineas por tanda, por receta y mes, y por ingrediente."""
+    recetas = {int(r["receta_id"]) for r in filas}
+    productos = {int(r["producto_id"]) for r in filas}
+    nombres_r = {int(r["id"]): r["nombre"] for r in db.execute(text(
+        "SELECT id, nombre FROM receta WHERE id IN :ids"), {"ids": tuple(recetas)}).mappings().all()} if recetas else {}
+    nombres_p = {int(r["id"]): r["nombre"] for r in db.execute(text(
+        "SELECT id, nombre FROM producto WHERE id IN :ids"), {"ids": tuple(productos)}).mappings().all()} if productos else {}
+
+    def _grupo(dest, key, r, **extra):
+        g = dest.get(key)
+        if g is None:
+            g = dest[key] = dict(extra, var_uso_crc=0.0, var_rendimiento_crc=0.0, var_total_crc=0.0,
+                                 salida_real=0.0, salida_std=0.0)
+        campo = "var_uso_crc" if r["tipo"] == "CONSUMO" else "var_rendimiento_crc"
+        g[campo] += r["varianza_crc"]
+        g["var_total_crc"] += r["varianza_crc"]
+        if r["tipo"] == "SALIDA":
+            g["salida_real"] += r["cantidad_real"]
+            g["salida_std"] += r["cantidad_std"]
+        return g
+
+    tandas, por_receta, ingredientes = {}, {}, {}
+    for r in sorted(filas, key=lambda x: (x["fecha"], x["tanda_id"], x["tipo"], x["producto_id"])):
+        rid = int(r["receta_id"])
+        t = _grupo(tandas, r["tanda_id"], r, tanda_id=r["tanda_id"], fecha=r["fecha"], mes=r["mes"],
+                   receta_id=rid, receta_nombre=nombres_r.get(rid), cantidad_tandas=r["cantidad_tandas"], lineas=[])
+        t["lineas"].append({k: r[k] for k in ("tipo", "producto_id", "cantidad_real", "cantidad_std",
+                                              "costo_unitario_crc", "varianza_crc")}
+                           | {"producto_nombre": nombres_p.get(int(r["producto_id"]))})
+        g = _grupo(por_receta, (r["mes"], rid), r, mes=r["mes"], receta_id=rid,
+                   receta_nombre=nombres_r.get(rid), tandas=0)
+        if len(t["lineas"]) == 1:
+            g["tandas"] += 1
+        if r["tipo"] == "CONSUMO":
+            k = (r["mes"], rid, int(r["producto_id"]))
+            i = ingredientes.setdefault(k, {
+                "mes": r["mes"], "receta_id": rid, "producto_id": k[2], "producto_nombre": nombres_p.get(k[2]),
+                "cantidad_real": 0.0, "cantidad_std": 0.0, "varianza_crc": 0.0,
+            })
+            i["cantidad_real"] += r["cantidad_real"]
+            i["cantidad_std"] += r["cantidad_std"]
+            i["varianza_crc"] += r["varianza_crc"]
+
+    return {
+        "tandas": list(tandas.values()),
+        "recetas": sorted(por_receta.values(), key=lambda g: (g["mes"], -abs(g["var_total_crc"]))),
+        "ingredientes": sorted(ingredientes.values(), key=lambda i: (i["mes"], -abs(i["varianza_crc"]))),
+    }
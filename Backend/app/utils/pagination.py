@@ -0,0 +1,73 @@
+import base64
+import json
+
+from fastapi import HTTPException, Response
+
+MAX_LIMIT = 1000
+DEFAULT_LIMIT = 100
+CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode(valores: list) -> str:
+    raw = json.dumps(valores, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode(cursor: str, n: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valores = json.loads(raw)
+    except ValueError:
+        raise HTTPException(400, "cursor invalido")
+    if not isinstance(valores, list) or len(valores) != n:
+        raise HTTPException(400, "cursor invalido")
+    return valores
+
+
+class Keyset:
+    """Paginacion por cursor sobre un orden estable.
+
+    orden: [(expr_sql, clave_en_fila, "ASC" | "DESC"), ...]; la ultima columna debe ser
+    unica (normalmente el id). La pagina trae limit filas (DEFAULT_LIMIT si no se indica,
+    nunca mas de MAX_LIMIT) y el cursor de la siguiente va en el header X-Next-Cursor.
+    """
+
+    def __init__(self, orden: list[tuple[str, str, str]], after: str | None, limit: int | None):
+        self.orden = orden
+        self.limit = min(limit or DEFAULT_LIMIT, MAX_LIMIT)
+        self.valores = _decode(after, len(orden)) if after else None
+
+    def where(self) -> str | None:
+        """Condicion "despues del cursor", expandida para que MySQL use el indice."""
+        if self.valores is None:
+            return None
+        ramas = []
+        for i, (expr, _, direccion) in enumerate(self.orden):
+            iguales = [f"{e} = :_k{j}" for j, (e, _, _) in enumerate(self.orden[:i])]
+            op = "<" if direccion == "DESC" else ">"
+            ramas.append("(" + " AND ".join(iguales + [f"{expr} {op} :_k{i}"]) + ")")
+        return "(" + " OR ".join(ramas) + ")"
+
+    def params(self) -> dict:
+        out = {f"_k{i}": v for i, v in enumerate(self.valores or [])}
+        out["_klimit"] = self.limit + 1
+        return out
+
+    def order_by(self) -> str:
+        sql = " ORDER BY " + ", ".join(f"{expr} {direccion}" for expr, _, direccion in self.orden)
+        return sql + " LIMIT :_klimit"
+
+    def pagina(self, rows, response: Response) -> list[dict]:
+        rows = [dict(r) for r in rows]
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            response.headers[CURSOR_HEADER] = _encode([rows[-1][clave] for _, clave, _ in self.orden])
+        return rows
+
+
+def proyectar(rows: list[dict], fields: str | None) -> list[dict]:
+    """Deja solo los campos pedidos en fields= (separados por coma)."""
+    if not fields:
+        return rows
+    campos = [f.strip() for f in fields.split(",") if f.strip()]
+    return [{k: r[k] for k in campos if k in r} for r in rows]
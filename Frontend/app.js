@@ -66,6 +66,19 @@ async function fetchJSON(url, opts) {
   if (!r.ok) throw new Error(await r.text().catch(()=>r.statusText) || r.statusText);
   return r.json();
 }
+// Listados paginados por cursor: sigue X-Next-Cursor hasta traer todas las filas
+async function fetchAll(url, limit=1000) {
+  const out = [];
+  const sep = url.includes('?') ? '&' : '?';
+  let after = '';
+  do {
+    const r = await fetch(`${url}${sep}limit=${limit}${after ? `&after=${encodeURIComponent(after)}` : ''}`);
+    if (!r.ok) throw new Error(await r.text().catch(()=>r.statusText) || r.statusText);
+    out.push(...await r.json());
+    after = r.headers.get('X-Next-Cursor') || '';
+  } while (after);
+  return out;
+}
 const debounce = (fn, ms=300) => { let t; return (...a)=>{ clearTimeout(t); t=setTimeout(()=>fn(...a), ms); }; };
 const fmt = {
   money: (n) => new Intl.NumberFormat('es-CR', {style:'currency', currency:'CRC', maximumFractionDigits:2}).format(Number(n||0)),
@@ -91,14 +104,10 @@ async function getCostosMP(ids=[]) {
 // === Helper costo unitario de PT (por receta o costo estándar) ===
 async function getCostoUnitarioPT(productoId) {
   try {
-    // 1) Buscar receta cuyo producto de salida sea este PT
-    const recetas = await fetchJSON(api('/recetas')).catch(()=>[]);
-    const rec = (recetas||[]).find(r => Number(r.producto_salida_id)===Number(productoId));
-    if (rec) {
-      const res = await fetchJSON(api(`/costeo/recetas/${rec.id}`)).catch(()=>null);
-      const unit = Number(res?.unitario_crc||0);
-      if (unit>0) return unit;
-    }
+    // 1) Costear en una sola llamada las recetas cuyo producto de salida sea este PT
+    const costeos = await fetchJSON(api(`/costeo/recetas?producto_salida_id=${productoId}`)).catch(()=>[]);
+    const unit = Number((costeos||[])[0]?.unitario_crc||0);
+    if (unit>0) return unit;
     // 2) Fallback: usar costo_estandar_crc del producto
     const prod = Store.state.productos.find(p=> Number(p.id)===Number(productoId));
     if (prod && Number(prod.costo_estandar_crc||0)>0) return Number(prod.costo_estandar_crc);
@@ -117,10 +126,10 @@ async function loadCatalogs() {
   try{
     const [uoms, productos, clientes, proveedores, empleados] = await Promise.all([
       fetchJSON(api('/uom')),
-      fetchJSON(api('/productos')),
-      fetchJSON(api('/contactos/clientes')),
-      fetchJSON(api('/contactos/proveedores')),
-      fetchJSON(api('/contactos/empleados')),
+      fetchAll(api('/productos')),
+      fetchAll(api('/contactos/clientes')),
+      fetchAll(api('/contactos/proveedores')),
+      fetchAll(api('/contactos/empleados')),
     ]);
     Store.set({uoms, productos, clientes, proveedores, empleados});
   }catch(e){ Toast('No se pudieron cargar catálogos','error'); }
@@ -318,7 +327,7 @@ route('#/productos', (root) => {
 
   async function refreshProductos() {
     try {
-      const productos = await fetchJSON(api('/productos'));
+      const productos = await fetchAll(api('/productos'));
       if (Array.isArray(productos)) {
         Store.set({ productos });
       }
@@ -488,7 +497,7 @@ route('#/contactos', (root) => {
   async function refresh(kind) {
     const base = meta[kind].plural;
     try {
-      const data = await fetchJSON(api(`/contactos/${base}`));
+      const data = await fetchAll(api(`/contactos/${base}`));
       Store.set({ [base]: data });
       render(kind);
     } catch (err) {
@@ -786,10 +795,9 @@ route('#/ventas', (root) => {
         }
         // Buscar receta del PT y costear
         try{
-          const recetas = await fetchJSON(api('/recetas')).catch(()=>[]);
-          const rec = recetas.find(r => Number(r.producto_salida_id)===pid);
-          if (rec) {
-            const res = await fetchJSON(api(`/costeo/recetas/${rec.id}`)).catch(()=>null);
+          const costeos = await fetchJSON(api(`/costeo/recetas?producto_salida_id=${pid}`)).catch(()=>[]);
+          const res = (costeos||[])[0];
+          if (res) {
             const unit = Number(res?.unitario_crc||0);
             row.querySelector('input[name="costo_estimado_crc"]').value = unit ? String(unit.toFixed(2)) : '0';
             recalcPrecioSugerido();
@@ -820,9 +828,14 @@ route('#/ventas', (root) => {
     if (!payload.codigo_factura) { Toast('Código de factura requerido','error'); return; }
     payload.codigo_factura = payload.codigo_factura.toUpperCase();
     payload.moneda='CRC';
+    // Las líneas ya capturadas viajan con el encabezado (una sola transacción)
+    const rows = $$('.line', lines).filter(row=>row.querySelector('select[name="producto_id"]').value);
+    payload.items = rows.map(row=>Object.fromEntries($$('select,input', row).map(el=>[el.name, el.value])));
     try{
       const res = await fetchJSON(api('/ventas'), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(payload)});
       ventaId = res.id; facturaLabel.textContent = `Factura: ${payload.codigo_factura}`; Toast(`Venta ${payload.codigo_factura} creada`,'success');
+      rows.forEach(row=>{ row.dataset.guardada='1'; });
+      $('#ventaTotal').textContent = fmt.money(res.total_crc||0);
     }catch(err){ Toast(err.message,'error'); }
   });
 
@@ -830,10 +843,12 @@ route('#/ventas', (root) => {
   lines.addEventListener('change', debounce(async (e)=>{
     if (!ventaId) return;
     const row = e.target.closest('.line'); if(!row) return;
+    if (row.dataset.guardada) return;
     const data = Object.fromEntries($$('select,input', row).map(el=>[el.name, el.value]));
     if (!data.producto_id) return;
     try{
       await fetchJSON(api(`/ventas/${ventaId}/items`), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(data)});
+      row.dataset.guardada='1';
       const tot = await fetchJSON(api(`/ventas/${ventaId}/totales`));
       $('#ventaTotal').textContent = fmt.money(tot.total_crc||0);
       Toast('Ítem guardado','success');
@@ -873,7 +888,7 @@ route('#/ventas', (root) => {
         if (payload.costo_estandar_crc !== undefined && payload.costo_estandar_crc !== '') payload.costo_estandar_crc = Number(payload.costo_estandar_crc);
         try{
           const created = await fetchJSON(api('/productos'), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(payload)});
-          const productos = await fetchJSON(api('/productos')); Store.set({productos});
+          const productos = await fetchAll(api('/productos')); Store.set({productos});
           if (selectEl) {
             selectEl.innerHTML='';
             const ph = document.createElement('option'); ph.value=''; ph.textContent='Seleccione.'; selectEl.appendChild(ph);
@@ -973,20 +988,26 @@ route('#/compras', (root) => {
     e.preventDefault();
     const payload=Object.fromEntries(new FormData(form).entries());
     payload.moneda='CRC';
+    // Las líneas ya capturadas viajan con el encabezado (una sola transacción)
+    const rows = $$('.line', lines).filter(row=>row.querySelector('select[name="producto_id"]').value);
+    payload.items = rows.map(row=>Object.fromEntries($$('select,input',row).map(el=>[el.name, el.value])));
     try{
       const res=await fetchJSON(api('/compras'), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(payload)});
       compraId=res.id; Toast(`Compra #${compraId} creada`,'success');
+      rows.forEach(row=>{ row.dataset.guardada='1'; });
+      $('#compraTotal').textContent = fmt.money(res.total_crc||0);
     }catch(e){ Toast(e.message,'error'); }
   });
 
   // Delegación para cada fila
   lines.addEventListener('change', debounce(async (e)=>{
     if (!compraId) return;
-    const row=e.target.closest('.line'); if(!row) return;
+    const row=e.target.closest('.line'); if(!row || row.dataset.guardada) return;
     const data=Object.fromEntries($$('select,input',row).map(el=>[el.name, el.value]));
     if (!data.producto_id) return;
     try{
       await fetchJSON(api(`/compras/${compraId}/items`), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(data)});
+      row.dataset.guardada='1';
       const tot = await fetchJSON(api(`/compras/${compraId}/totales`));
       $('#compraTotal').textContent = fmt.money(tot.total_crc||0);
       Toast('Ítem guardado','success');
@@ -1026,7 +1047,7 @@ route('#/compras', (root) => {
         if (payload.costo_estandar_crc !== undefined && payload.costo_estandar_crc !== '') payload.costo_estandar_crc = Number(payload.costo_estandar_crc);
         try{
           const created = await fetchJSON(api('/productos'), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(payload)});
-          const productos = await fetchJSON(api('/productos')); Store.set({productos});
+          const productos = await fetchAll(api('/productos')); Store.set({productos});
           if (selectEl) {
             selectEl.innerHTML='';
             const ph = document.createElement('option'); ph.value=''; ph.textContent='Seleccione.'; selectEl.appendChild(ph);
@@ -1527,10 +1548,11 @@ route('#/produccion', (root)=>{
   const form = document.createElement('form'); form.className='panel form-grid';
   const fecha = Field('Fecha', Input({name:'fecha', type:'date', required:true, value: today()}));
   const receta= Field('Receta', Select({name:'receta_id', items:[], placeholder:'(Ninguna)'}));
+  const veces = Field('Cantidad de tandas', Input({name:'cantidad_tandas', type:'number', step:'0.01', min:'0.01', value:'1'}));
   const btn = document.createElement('button'); btn.type='submit'; btn.className='btn-primary'; btn.textContent='Crear tanda';
   const cancel = document.createElement('button'); cancel.type='button'; cancel.className='btn'; cancel.textContent='Cancelar'; cancel.onclick=()=>form.reset();
   const actions = document.createElement('div'); actions.className='form-actions'; actions.append(btn,cancel);
-  form.append(fecha, receta, actions);
+  form.append(fecha, receta, veces, actions);
   root.appendChild(form);
 
   (async ()=>{
@@ -1589,6 +1611,25 @@ route('#/produccion', (root)=>{
     }catch(e){ /* silencioso */ }
   }
 
+  // Cada fila se guarda con su boton (ya completa) y queda bloqueada: el kardex no se reescribe
+  const bloquearFila=(row)=>{ row.dataset.guardada='1'; $$('select,input,button', row).forEach(el=>{ el.disabled = true; }); };
+  const saveBtn=(row, ruta, msg)=>{
+    const b=document.createElement('button'); b.type='button'; b.className='icon-btn'; b.textContent='💾'; b.title='Guardar'; b.setAttribute('aria-label','Guardar');
+    b.onclick=async ()=>{
+      if (!tandaId || row.dataset.guardada) return;
+      const data=Object.fromEntries($$('select,input',row).map(el=>[el.name, el.value]));
+      if (!data.producto_id || !(Number(data.cantidad) > 0)) return Toast('Producto y cantidad > 0 requeridos','error');
+      b.disabled=true;
+      try{
+        await fetchJSON(api(`/produccion/tandas/${tandaId}/${ruta}`), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(data)});
+        bloquearFila(row);
+        Toast(msg,'success');
+        await refreshTandaCost();
+      }catch(err){ b.disabled=false; Toast(err.message,'error'); }
+    };
+    return b;
+  };
+
   // Filas con UOM bloqueada a la base del producto
   const cRow=()=> {
     const row=document.createElement('div'); row.className='line';
@@ -1601,6 +1642,7 @@ route('#/produccion', (root)=>{
       uomFld,
       Field('Cantidad', Input({name:'cantidad', type:'number', step:'0.000001', value:'1', required:true}))
     );
+    row.appendChild(saveBtn(row, 'consumos', 'Consumo guardado'));
     row.addEventListener('change', (e)=>{
       if (e.target.name === 'producto_id') {
         const pid = Number(e.target.value||0);
@@ -1620,6 +1662,7 @@ route('#/produccion', (root)=>{
       Field('UOM', uomSel),
       Field('Cantidad', Input({name:'cantidad', type:'number', step:'0.000001', value:'1', required:true}))
     );
+    row.appendChild(saveBtn(row, 'salidas', 'Salida guardada'));
     row.addEventListener('change', (e)=>{
       if (e.target.name === 'producto_id') {
         const pid = Number(e.target.value||0);
@@ -1638,23 +1681,27 @@ route('#/produccion', (root)=>{
       const t=await fetchJSON(api('/produccion/tandas'), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(payload)});
       tandaId=t.id; Toast(`Tanda #${tandaId} creada`,'success');
 
+      // El backend ya registró consumos, salidas y kardex de la receta: las filas se muestran
+      // marcadas como guardadas y de solo lectura para que un cambio no las vuelva a enviar
       if (payload.receta_id) {
         try {
-          const ings = await fetchJSON(api(`/recetas/${payload.receta_id}/ingredientes`)).catch(()=>[]);
-          const outs = await fetchJSON(api(`/recetas/${payload.receta_id}/salidas`)).catch(()=>[]);
+          const ings = t.consumos || [];
+          const outs = t.salidas || [];
           cLines.innerHTML=''; sLines.innerHTML='';
           ings.forEach(i=>{
             const r=cRow();
             r.querySelector('select[name="producto_id"]').value = i.producto_id;
             r.querySelector('select[name="uom_id"]').value = i.uom_id;
             r.querySelector('input[name="cantidad"]').value = i.cantidad;
+            bloquearFila(r);
             cLines.appendChild(r);
           });
           outs.forEach(o=>{
             const r=sRow();
             r.querySelector('select[name="producto_id"]').value = o.producto_id;
             r.querySelector('select[name="uom_id"]').value = o.uom_id;
-            r.querySelector('input[name="cantidad"]').value = o.cantidad || o.rendimiento || 1;
+            r.querySelector('input[name="cantidad"]').value = o.cantidad;
+            bloquearFila(r);
             sLines.appendChild(r);
           });
         } catch(_){}
@@ -1665,28 +1712,6 @@ route('#/produccion', (root)=>{
 
   addC.onclick=()=> { if (!tandaId) return Toast('Primero crea la tanda','error'); cLines.appendChild(cRow()); };
   addS.onclick=()=> { if (!tandaId) return Toast('Primero crea la tanda','error'); sLines.appendChild(sRow()); };
-
-  // Delegación: guarda la fila que cambia
-  cLines.addEventListener('change', debounce(async (e)=>{
-    if (!tandaId) return;
-    const row=e.target.closest('.line'); if(!row) return;
-    const data=Object.fromEntries($$('select,input',row).map(el=>[el.name, el.value]));
-    try{
-      await fetchJSON(api(`/produccion/tandas/${tandaId}/consumos`), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(data)});
-      Toast('Consumo guardado','success');
-      await refreshTandaCost();
-    }catch(err){ Toast(err.message,'error'); }
-  }, 400));
-  sLines.addEventListener('change', debounce(async (e)=>{
-    if (!tandaId) return;
-    const row=e.target.closest('.line'); if(!row) return;
-    const data=Object.fromEntries($$('select,input',row).map(el=>[el.name, el.value]));
-    try{
-      await fetchJSON(api(`/produccion/tandas/${tandaId}/salidas`), {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(data)});
-      Toast('Salida guardada','success');
-      await refreshTandaCost();
-    }catch(err){ Toast(err.message,'error'); }
-  }, 400));
 });
 
 /* ================= INVENTARIO ================= */
@@ -1704,7 +1729,7 @@ route('#/inventario', async (root)=>{
   async function load(kind){
     cont.innerHTML='Cargando…';
     if (kind==='mermas') {
-      const data = await fetchJSON(api(`/inventario/mermas`)).catch(()=>[]);
+      const data = await fetchAll(api(`/inventario/mermas`)).catch(()=>[]);
       const cols = [
         {key:'fecha',label:'Fecha',format:fmt.date},
         {key:'producto_nombre',label:'Producto'},
@@ -1799,8 +1824,8 @@ route('#/finanzas', async (root)=>{
 
     const grid=document.createElement('div'); grid.className='grid-2'; cont.appendChild(grid);
     const [cxc, cxp] = await Promise.all([
-      fetchJSON(api('/finanzas/cxc')).catch(()=>[]),
-      fetchJSON(api('/finanzas/cxp')).catch(()=>[])
+      fetchAll(api('/finanzas/cxc')).catch(()=>[]),
+      fetchAll(api('/finanzas/cxp')).catch(()=>[])
     ]);
     grid.append(
       Table({columns:[
@@ -1836,16 +1861,25 @@ route('#/finanzas', async (root)=>{
         <label class="field"><span>Método</span>
           <select id="indMethod">
             <option value="PORCENTAJE_GLOBAL">Porcentaje global sobre costo directo</option>
+            <option value="PCT_DIRECTO">% sobre costo directo (pool / directo del mes)</option>
+            <option value="POR_HORA">Por hora de planilla</option>
+            <option value="POR_UNIDAD">Por unidad producida</option>
           </select>
         </label>
         <label class="field"><span>% Global</span>
-          <input id="indPct" type="number" step="0.01" placeholder="18 = 18%">
+          <input id="indPct" type="number" step="0.01" placeholder="18 = 18% (vacío = pool del mes)">
+        </label>
+        <label class="field"><span>Tarifa por hora (CRC)</span>
+          <input id="indTarifaH" type="number" step="0.01" placeholder="vacío = pool / horas del mes">
+        </label>
+        <label class="field"><span>Tarifa por unidad (CRC)</span>
+          <input id="indTarifaU" type="number" step="0.01" placeholder="vacío = pool / unidades del mes">
         </label>
         <div class="form-actions">
           <button id="btnSaveCfg" class="btn-primary">Guardar</button>
         </div>
       </div>
-      <small class="muted">Este % se puede sobreescribir al costear una receta o tanda.</small>
+      <small class="muted">Solo se usa el parámetro del método elegido; el % se puede sobreescribir al costear una receta o tanda.</small>
     `;
     wrap.appendChild(cfgCard);
 
@@ -1868,12 +1902,21 @@ route('#/finanzas', async (root)=>{
     wrap.appendChild(crud);
 
     // cargar config
-    let cfg = await fetchJSON(api('/finanzas/config/indirectos')).catch(()=>({method:'PORCENTAJE_GLOBAL', pct:0}));
+    let cfg = await fetchJSON(api('/finanzas/config/indirectos')).catch(()=>({method:'PORCENTAJE_GLOBAL', pct:null}));
     $('#indMethod', cfgCard).value = cfg.method || 'PORCENTAJE_GLOBAL';
-    $('#indPct', cfgCard).value = (Number(cfg.pct||0)*100).toFixed(2);
+    $('#indPct', cfgCard).value = cfg.pct == null ? '' : (Number(cfg.pct)*100).toFixed(2);
+    $('#indTarifaH', cfgCard).value = cfg.tarifa_h ?? '';
+    $('#indTarifaU', cfgCard).value = cfg.tarifa_unidad ?? '';
 
+    // Campo vacío = null: la tasa se calcula del pool del mes en vez de fijarse en 0
+    const valor = (id, escala=1)=>{ const v=$(id, cfgCard).value; return v === '' ? null : Number(v)/escala; };
     $('#btnSaveCfg', cfgCard).onclick = async ()=>{
-      const body = { method: $('#indMethod', cfgCard).value, pct: Number($('#indPct', cfgCard).value||0)/100 };
+      const body = {
+        method: $('#indMethod', cfgCard).value,
+        pct: valor('#indPct', 100),
+        tarifa_h: valor('#indTarifaH'),
+        tarifa_unidad: valor('#indTarifaU'),
+      };
       try{
         await fetchJSON(api('/finanzas/config/indirectos'), {method:'PUT', headers:{'Content-Type':'application/json'}, body: JSON.stringify(body)});
         Toast('Configuración guardada','success');
@@ -1927,7 +1970,7 @@ route('#/finanzas', async (root)=>{
     cont.appendChild(card);
     const selP = card.querySelector('select[name="g_prov"]'); selP.innerHTML='<option value="">—</option>'; (Store.state.proveedores||[]).forEach(p=> selP.appendChild(new Option(p.nombre, p.id)));
     async function load(){
-      const rows = await fetchJSON(api('/finanzas/gastos')).catch(()=>[]);
+      const rows = await fetchAll(api('/finanzas/gastos')).catch(()=>[]);
       const box = card.querySelector('#tablaGastos'); box.innerHTML='';
       box.appendChild(Table({columns:[
         {key:'fecha',label:'Fecha',format:fmt.date},
@@ -19,15 +19,6 @@
     return formatDateKey(new Date(value));
   };
 
-  const formatMonthKey = (value) => {
-    const key = formatDateKey(value);
-    return key ? key.slice(0, 7) : '';
-  };
-
-  const sumBy = (list, getter) => {
-    return (list || []).reduce((acc, item) => acc + toNumber(getter(item)), 0);
-  };
-
   const formatQty = (value) => toNumber(value).toFixed(2);
 
   const buildCard = (title) => {
@@ -74,29 +65,6 @@
     charts[key] = new Chart(canvas, { type, ...config });
   };
 
-  const ventaTotal = (venta) => {
-    const direct = toNumber(venta?.total_crc ?? venta?.total ?? venta?.monto_total_crc ?? venta?.monto_crc);
-    if (direct > 0) return direct;
-    return sumBy(venta?.items || venta?.detalles || venta?.lineas || [], (item) => {
-      const base = toNumber(item?.total_crc ?? item?.total ?? item?.subtotal);
-      if (base > 0) return base;
-      return toNumber(item?.cantidad ?? item?.qty ?? item?.unidades) * toNumber(item?.precio_unitario_crc ?? item?.precio_unitario ?? item?.precio);
-    });
-  };
-
-  const compraTotal = (compra) => {
-    const direct = toNumber(compra?.total_crc ?? compra?.monto_total_crc ?? compra?.total ?? compra?.monto);
-    if (direct > 0) return direct;
-    const items = compra?.items || compra?.detalles || compra?.lineas || [];
-    if (!Array.isArray(items) || !items.length) return direct;
-    return items.reduce((acc, item) => {
-      const cantidad = toNumber(item?.cantidad ?? item?.qty ?? item?.unidades);
-      const costo = toNumber(item?.costo_unitario_crc ?? item?.costo_unitario ?? item?.costo ?? item?.precio ?? 0);
-      const descuento = toNumber(item?.descuento_crc ?? item?.descuento ?? 0);
-      return acc + (cantidad * costo - descuento);
-    }, 0);
-  };
-
   const planillaTotal = (planilla) => {
     const direct = toNumber(planilla?.total_estimado_crc ?? planilla?.total_crc ?? planilla?.monto_total_crc ?? planilla?.total_planilla_crc ?? planilla?.total ?? 0);
     if (direct > 0) return direct;
@@ -105,33 +73,16 @@
     return detalles.reduce((acc, det) => acc + toNumber(det?.costo_total_crc ?? det?.total_crc ?? det?.total ?? 0), 0);
   };
 
-  const aggregateByMonth = (list, dateGetter, valueGetter) => {
-    const map = new Map();
-    (list || []).forEach((item) => {
-      const monthKey = formatMonthKey(dateGetter(item));
-      if (!monthKey) return;
-      const current = map.get(monthKey) || 0;
-      map.set(monthKey, current + toNumber(valueGetter(item)));
-    });
-    return Array.from(map.entries()).sort(([a], [b]) => a.localeCompare(b));
-  };
-
-  const renderTrendChart = (target, { ventas, compras, gastos }) => {
+  const renderTrendChart = (target, margen) => {
     if (!target) return;
-    const ventasMes = aggregateByMonth(ventas, (v) => v?.fecha || v?.fecha_emision || v?.created_at || v?.createdAt, ventaTotal);
-    const comprasMes = aggregateByMonth(compras, (c) => c?.fecha || c?.fecha_documento || c?.created_at, compraTotal);
-    const gastosMes = aggregateByMonth(gastos, (g) => g?.fecha || g?.fecha_gasto || g?.created_at, (g) => toNumber(g?.monto_crc || g?.monto || 0));
-    const labels = Array.from(new Set([...ventasMes.map(([m]) => m), ...comprasMes.map(([m]) => m), ...gastosMes.map(([m]) => m)])).sort();
+    const labels = (margen || []).map((m) => m.mes);
     if (!labels.length) {
       setEmpty(target, 'No hay datos en el rango seleccionado.');
       return;
     }
-    const ventasMap = new Map(ventasMes);
-    const comprasMap = new Map(comprasMes);
-    const gastosMap = new Map(gastosMes);
-    const dataVentas = labels.map((label) => toNumber(ventasMap.get(label)));
-    const dataCompras = labels.map((label) => toNumber(comprasMap.get(label)));
-    const dataGastos = labels.map((label) => toNumber(gastosMap.get(label)));
+    const dataVentas = margen.map((m) => toNumber(m.ventas));
+    const dataCompras = margen.map((m) => toNumber(m.compras));
+    const dataGastos = margen.map((m) => toNumber(m.gastos));
     const moneyFormatter = (value) => new Intl.NumberFormat('es-CR', { style:'currency', currency:'CRC', maximumFractionDigits:0 }).format(value);
     createChart('trend', target, 'line', {
       data: {
@@ -157,22 +108,18 @@
     });
   };
 
-  const renderIndicadores = (target, { ventas, compras, gastos, planillas }) => {
+  const renderIndicadores = (target, k) => {
     if (!target) return;
-    const hasData = (ventas && ventas.length) || (compras && compras.length) || (gastos && gastos.length) || (planillas && planillas.length);
-    if (!hasData) {
+    if (!k || !(k.ventas_crc || k.compras_crc || k.gastos_crc || k.planilla_crc)) {
       setEmpty(target, 'Sin datos suficientes para indicadores.');
       return;
     }
-    const totalVentas = sumBy(ventas, ventaTotal);
-    const totalCompras = sumBy(compras, compraTotal);
-    const totalGastos = sumBy(gastos, (g) => toNumber(g?.monto_crc ?? g?.monto ?? 0));
-    const totalPlanillas = sumBy(planillas, planillaTotal);
-    const totalOperativo = totalGastos + totalPlanillas;
-    const margenBruto = totalVentas - totalCompras;
-    const margenOperativo = totalVentas - totalCompras - totalOperativo;
-    const ventasCount = Array.isArray(ventas) ? ventas.length : 0;
-    const avgTicket = ventasCount ? totalVentas / ventasCount : 0;
+    const totalVentas = toNumber(k.ventas_crc);
+    const totalOperativo = toNumber(k.gastos_crc) + toNumber(k.planilla_crc);
+    const margenBruto = toNumber(k.margen_bruto_crc);
+    const margenOperativo = totalVentas - toNumber(k.compras_crc) - totalOperativo;
+    const ventasCount = toNumber(k.facturas);
+    const avgTicket = toNumber(k.ticket_promedio_crc);
     const money = (value) => (window.fmt && typeof fmt.money === 'function') ? fmt.money(value || 0) : `CRC ${Number(value || 0).toFixed(2)}`;
     const pct = (value, base) => {
       if (!base) return 'N/D';
@@ -247,16 +194,16 @@
     }
   };
 
-  const renderContabilidad = (body, { ventas, compras, mermas, planillas, gastos, cxc, cxp }) => {
+  const renderContabilidad = (body, k) => {
     if (!body) return;
-    const totalVentas = sumBy(ventas, ventaTotal);
-    const totalCompras = sumBy(compras, compraTotal);
-    const totalMermas = sumBy(mermas, (row) => toNumber(row?.monto_crc ?? row?.total_crc ?? 0));
-    const totalPlanillas = sumBy(planillas, planillaTotal);
-    const totalGastos = sumBy(gastos, (row) => toNumber(row?.monto_crc ?? row?.monto ?? 0));
-    const cuentasPorCobrar = sumBy(cxc, (row) => toNumber(row?.saldo_crc ?? row?.saldo ?? 0));
-    const cuentasPorPagar = sumBy(cxp, (row) => toNumber(row?.saldo_crc ?? row?.saldo ?? 0));
-    const margenOperativo = totalVentas - totalCompras - totalMermas - totalPlanillas - totalGastos;
+    const totalVentas = toNumber(k?.ventas_crc);
+    const totalCompras = toNumber(k?.compras_crc);
+    const totalMermas = toNumber(k?.mermas_crc);
+    const totalPlanillas = toNumber(k?.planilla_crc);
+    const totalGastos = toNumber(k?.gastos_crc);
+    const cuentasPorCobrar = toNumber(k?.cxc?.saldo_crc);
+    const cuentasPorPagar = toNumber(k?.cxp?.saldo_crc);
+    const margenOperativo = toNumber(k?.resultado_operativo_crc);
 
     body.innerHTML = `
       <p><strong>Ingresos</strong>: ${fmt.money(totalVentas)}</p>
@@ -333,52 +280,16 @@
       const params = new URLSearchParams();
       if (desde) params.set('desde', desde);
       if (hasta) params.set('hasta', hasta);
-      params.set('include', 'items');
-      const ventasUrl = params.toString() ? `/ventas?${params.toString()}` : '/ventas';
 
       try {
-        const [ventasRaw, comprasRaw, mermasRaw, planillasRaw, cxcRaw, cxpRaw, gastosRaw] = await Promise.all([
-          fetchJSON(api(ventasUrl)).catch(() => []),
-          fetchJSON(api('/compras')).catch(() => []),
-          fetchJSON(api('/inventario/mermas')).catch(() => []),
-          fetchJSON(api('/planillas')).catch(() => []),
-          fetchJSON(api('/finanzas/cxc')).catch(() => []),
-          fetchJSON(api('/finanzas/cxp')).catch(() => []),
-          fetchJSON(api('/finanzas/gastos')).catch(() => [])
-        ]);
+        const data = await fetchJSON(api(`/reportes/dashboard?${params.toString()}`));
 
         if (token !== currentToken) return;
 
-        const ventas = ventasRaw.filter((venta) => {
-          const key = formatDateKey(venta?.fecha || venta?.fecha_emision || venta?.created_at || venta?.createdAt);
-          if (!key) return true;
-          return (!desde || key >= desde) && (!hasta || key <= hasta);
-        });
-        const compras = comprasRaw.filter((compra) => {
-          const key = formatDateKey(compra?.fecha || compra?.fecha_documento || compra?.created_at);
-          if (!key) return true;
-          return (!desde || key >= desde) && (!hasta || key <= hasta);
-        });
-        const mermas = mermasRaw.filter((merma) => {
-          const key = formatDateKey(merma?.fecha || merma?.created_at);
-          if (!key) return true;
-          return (!desde || key >= desde) && (!hasta || key <= hasta);
-        });
-        const planillas = planillasRaw.filter((p) => {
-          const key = formatDateKey(p?.semana_inicio || p?.periodo_inicio || p?.fecha || p?.created_at);
-          if (!key) return true;
-          return (!desde || key >= desde) && (!hasta || key <= hasta);
-        });
-        const gastosFiltrados = gastosRaw.filter((row) => {
-          const key = formatDateKey(row?.fecha || row?.fecha_gasto || row?.created_at);
-          if (!key) return true;
-          return (!desde || key >= desde) && (!hasta || key <= hasta);
-        });
-
-        renderTrendChart(trendArea, { ventas, compras, gastos: gastosFiltrados });
-        renderIndicadores(indicadoresArea, { ventas, compras, gastos: gastosFiltrados, planillas });
-        renderPlanillasChart(planillasArea, planillasSummary, planillas);
-        renderContabilidad(contabilidadCard.body, { ventas, compras, mermas, planillas, gastos: gastosFiltrados, cxc: cxcRaw, cxp: cxpRaw });
+        renderTrendChart(trendArea, data.margen);
+        renderIndicadores(indicadoresArea, data.kpis);
+        renderPlanillasChart(planillasArea, planillasSummary, data.planillas);
+        renderContabilidad(contabilidadCard.body, data.kpis);
       } catch (error) {
         if (token !== currentToken) return;
         console.error(error);
@@ -33,7 +33,7 @@
   async function ensureEmpleados() {
     if (Array.isArray(Store?.state?.empleados) && Store.state.empleados.length) return;
     try {
-      const empleados = await fetchJSON(api('/contactos/empleados'));
+      const empleados = await fetchAll(api('/contactos/empleados'));
       if (Array.isArray(empleados)) Store.set({ empleados });
     } catch (err) {
       console.error('No se pudieron cargar empleados', err);
@@ -59,6 +59,25 @@ CREATE TABLE producto (
 
 CREATE INDEX ix_producto_nombre ON producto(nombre);
 
+-- Conversiones de uom: 1 uom_origen = factor uom_destino.
+-- producto_id NULL = conversion generica (G -> KG); con producto aplica solo a ese producto (UN -> KG).
+-- La app convierte a producto.uom_base_id en costeo (mp_costo) y saldos (inv_saldo).
+CREATE TABLE uom_conversion (
+  id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  producto_id BIGINT NULL,
+  producto_key BIGINT AS (COALESCE(producto_id, 0)) STORED,
+  uom_origen_id BIGINT NOT NULL,
+  uom_destino_id BIGINT NOT NULL,
+  factor DECIMAL(24,12) NOT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
+  UNIQUE KEY uq_uomconv (producto_key, uom_origen_id, uom_destino_id),
+  CONSTRAINT fk_uomconv_producto FOREIGN KEY (producto_id) REFERENCES producto(id) ON DELETE CASCADE,
+  CONSTRAINT fk_uomconv_origen FOREIGN KEY (uom_origen_id) REFERENCES uom(id),
+  CONSTRAINT fk_uomconv_destino FOREIGN KEY (uom_destino_id) REFERENCES uom(id),
+  CONSTRAINT ck_uomconv_factor CHECK (factor > 0)
+) ENGINE=InnoDB;
+
 CREATE TABLE cliente (
   id BIGINT PRIMARY KEY AUTO_INCREMENT,
   nombre VARCHAR(160) NOT NULL,
@@ -181,6 +200,7 @@ CREATE TABLE tanda (
   id BIGINT PRIMARY KEY AUTO_INCREMENT,
   fecha DATE NOT NULL,
   receta_id BIGINT,
+  cantidad_tandas DECIMAL(12,4) NOT NULL DEFAULT 1, -- multiplo de la receta (estandar = receta x cantidad_tandas)
   ubicacion_origen_id BIGINT,
   ubicacion_destino_id BIGINT,
   nota VARCHAR(240),
@@ -221,6 +241,31 @@ CREATE TABLE tanda_salida (
   CONSTRAINT ck_tsalida_cantidad CHECK (cantidad > 0)
 ) ENGINE=InnoDB;
 
+-- Varianzas de tandas contra el estandar de su receta (cache por mes cerrado; la llena /produccion/varianzas).
+-- tipo CONSUMO: (real - estandar) x costo de la MP; tipo SALIDA: (estandar - real) x unitario estandar.
+-- Cantidades en uom base; varianza_crc > 0 es desfavorable.
+CREATE TABLE varianza_mes (
+  mes CHAR(7) PRIMARY KEY,
+  calculado_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB;
+
+CREATE TABLE varianza_tanda (
+  tanda_id BIGINT NOT NULL,
+  tipo ENUM('CONSUMO','SALIDA') NOT NULL,
+  producto_id BIGINT NOT NULL,
+  mes CHAR(7) NOT NULL,
+  fecha DATE NOT NULL,
+  receta_id BIGINT NOT NULL,
+  cantidad_tandas DECIMAL(12,4) NOT NULL,
+  cantidad_real DECIMAL(18,6) NOT NULL,
+  cantidad_std DECIMAL(18,6) NOT NULL,
+  costo_unitario_crc DECIMAL(18,6) NOT NULL,
+  varianza_crc DECIMAL(18,6) NOT NULL,
+  PRIMARY KEY (tanda_id, tipo, producto_id),
+  KEY ix_vtanda_mes (mes, receta_id),
+  CONSTRAINT fk_vtanda_mes FOREIGN KEY (mes) REFERENCES varianza_mes(mes) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
 -- ======================================================================
 -- 4) Compras / Ventas
 -- ======================================================================
@@ -235,6 +280,8 @@ CREATE TABLE compra (
   fecha_limite DATE,
   estado_cobro_pago ENUM('PENDIENTE','PAGADO') NOT NULL DEFAULT 'PENDIENTE',
   nota VARCHAR(240),
+  total_crc DECIMAL(18,6) NOT NULL DEFAULT 0,  -- SUM(cantidad*costo - descuento) de compra_det (triggers)
+  lineas INT NOT NULL DEFAULT 0,
   factor_extra DECIMAL(6,3) DEFAULT NULL,
   factor_doble DECIMAL(6,3) DEFAULT NULL,
   factor_feriado DECIMAL(6,3) DEFAULT NULL,
@@ -263,6 +310,23 @@ CREATE TABLE compra_det (
   CONSTRAINT ck_cdet_desc     CHECK (descuento_crc >= 0)
 ) ENGINE=InnoDB;
 
+-- Ultimo costo y acumulados para promedio ponderado por MP.
+-- Lo mantiene la app al insertar compra_det (rebuild: python -m app.cli rebuild-costos).
+CREATE TABLE mp_costo (
+  producto_id BIGINT PRIMARY KEY,
+  ultimo_costo_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  ultima_fecha DATE NULL,
+  ultimo_det_id BIGINT NULL,
+  cantidad_acum DECIMAL(24,6) NOT NULL DEFAULT 0,
+  costo_acum_crc DECIMAL(24,6) NOT NULL DEFAULT 0,
+  descuento_acum_crc DECIMAL(24,6) NOT NULL DEFAULT 0,
+  costo_promedio_crc DECIMAL(18,6) AS (
+    CASE WHEN cantidad_acum > 0 THEN costo_acum_crc / cantidad_acum ELSE NULL END
+  ) STORED,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  CONSTRAINT fk_mpcosto_producto FOREIGN KEY (producto_id) REFERENCES producto(id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
 CREATE TABLE venta (
   id BIGINT PRIMARY KEY AUTO_INCREMENT,
   codigo_factura VARCHAR(40) NOT NULL,
@@ -276,6 +340,8 @@ CREATE TABLE venta (
   estado_cobro_pago ENUM('PENDIENTE','PAGADO') NOT NULL DEFAULT 'PENDIENTE',
   ruta_id BIGINT,
   nota VARCHAR(240),
+  total_crc DECIMAL(18,6) NOT NULL DEFAULT 0,  -- SUM(cantidad*precio - descuento) de venta_det (triggers)
+  lineas INT NOT NULL DEFAULT 0,
   factor_extra DECIMAL(6,3) DEFAULT NULL,
   factor_doble DECIMAL(6,3) DEFAULT NULL,
   factor_feriado DECIMAL(6,3) DEFAULT NULL,
@@ -298,6 +364,7 @@ CREATE TABLE venta_det (
   cantidad DECIMAL(18,6) NOT NULL,
   precio_unitario_crc DECIMAL(18,6) NOT NULL,
   descuento_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  costo_unitario_crc DECIMAL(18,6) NULL,  -- costo de lo vendido congelado al vender (uom de la linea)
   CONSTRAINT fk_vdet_venta FOREIGN KEY (venta_id) REFERENCES venta(id) ON DELETE CASCADE,
   CONSTRAINT fk_vdet_prod  FOREIGN KEY (producto_id) REFERENCES producto(id),
   CONSTRAINT fk_vdet_uom   FOREIGN KEY (uom_id) REFERENCES uom(id),
@@ -538,6 +605,7 @@ CREATE TABLE inv_mov (
   ref_id BIGINT,
   ubicacion_id BIGINT,
   nota VARCHAR(240),
+  costo_unitario_crc DECIMAL(18,6) DEFAULT NULL,
   factor_extra DECIMAL(6,3) DEFAULT NULL,
   factor_doble DECIMAL(6,3) DEFAULT NULL,
   factor_feriado DECIMAL(6,3) DEFAULT NULL,
@@ -551,6 +619,25 @@ CREATE TABLE inv_mov (
 CREATE INDEX ix_imov_prod_fecha ON inv_mov(producto_id, fecha);
 CREATE INDEX ix_imov_tipo ON inv_mov(tipo);
 
+-- Saldo incremental por producto/ubicacion (lo mantiene la app en cada escritura de inv_mov).
+-- ubicacion_id = 0 agrupa los movimientos sin ubicacion.
+CREATE TABLE inv_saldo (
+  producto_id BIGINT NOT NULL,
+  ubicacion_id BIGINT NOT NULL DEFAULT 0,
+  existencias DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_compra DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_produccion DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_consumo DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_venta DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_merma DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_ajuste DECIMAL(18,6) NOT NULL DEFAULT 0,
+  ultima_entrada DATETIME NULL,
+  ultima_salida DATETIME NULL,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (producto_id, ubicacion_id),
+  CONSTRAINT fk_isaldo_producto FOREIGN KEY (producto_id) REFERENCES producto(id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
 CREATE TABLE merma (
   id BIGINT PRIMARY KEY AUTO_INCREMENT,
   fecha DATE NOT NULL,
@@ -573,6 +660,57 @@ CREATE TABLE merma (
 CREATE INDEX ix_merma_fecha ON merma(fecha);
 CREATE INDEX ix_merma_prod  ON merma(producto_id);
 
+-- Hechos diarios para reportes (los mantiene la app en cada escritura, como inv_saldo;
+-- `python -m app.cli rebuild-hechos` los recalcula desde los documentos).
+CREATE TABLE hecho_dia (
+  fecha DATE PRIMARY KEY,
+  ventas_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  costo_ventas_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  facturas INT NOT NULL DEFAULT 0,
+  compras_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  compras_docs INT NOT NULL DEFAULT 0,
+  gastos_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  gastos_docs INT NOT NULL DEFAULT 0
+) ENGINE=InnoDB;
+
+CREATE TABLE hecho_venta (
+  fecha DATE NOT NULL,
+  cliente_id BIGINT NOT NULL,
+  producto_id BIGINT NOT NULL,
+  ruta_id BIGINT NOT NULL DEFAULT 0,          -- 0 = venta sin ruta
+  cantidad DECIMAL(18,6) NOT NULL DEFAULT 0,  -- uom base del producto
+  total_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  costo_crc DECIMAL(18,6) NOT NULL DEFAULT 0, -- SUM(cantidad * venta_det.costo_unitario_crc)
+  lineas INT NOT NULL DEFAULT 0,
+  lineas_sin_costo INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (fecha, cliente_id, producto_id, ruta_id),
+  KEY ix_hventa_prod (producto_id, fecha),
+  KEY ix_hventa_cli (cliente_id, fecha),
+  KEY ix_hventa_ruta (ruta_id, fecha)
+) ENGINE=InnoDB;
+
+CREATE TABLE hecho_compra (
+  fecha DATE NOT NULL,
+  proveedor_id BIGINT NOT NULL,
+  producto_id BIGINT NOT NULL,
+  cantidad DECIMAL(18,6) NOT NULL DEFAULT 0,  -- uom base del producto
+  total_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  lineas INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (fecha, proveedor_id, producto_id),
+  KEY ix_hcompra_prod (producto_id, fecha)
+) ENGINE=InnoDB;
+
+-- Kardex por dia/producto/motivo: produccion (PRODUCCION_SALIDA/CONSUMO_RECETA), merma, etc.
+CREATE TABLE hecho_inv (
+  fecha DATE NOT NULL,
+  producto_id BIGINT NOT NULL,
+  motivo ENUM('COMPRA','PRODUCCION_SALIDA','CONSUMO_RECETA','VENTA','MERMA','AJUSTE') NOT NULL,
+  cantidad DECIMAL(18,6) NOT NULL DEFAULT 0,  -- uom base del producto
+  movimientos INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (fecha, producto_id, motivo),
+  KEY ix_hinv_motivo (motivo, fecha)
+) ENGINE=InnoDB;
+
 -- ======================================================================
 -- 9) Costos indirectos (para costeo)
 -- ======================================================================
@@ -629,21 +767,14 @@ LEFT JOIN (
 WHERE p.tipo = 'PT';
 
 -- Totales por cabecera (compras/ventas) - base para CxP/CxC
+-- total_crc lo mantienen los triggers trg_*_det_total (seccion 6); verificar con `python -m app.cli verificar-totales`
 CREATE OR REPLACE VIEW v_compra_totales AS
-SELECT
-  c.id, c.fecha, c.proveedor_id,
-  SUM((cd.costo_unitario_crc * cd.cantidad) - cd.descuento_crc) AS total_crc
-FROM compra c
-LEFT JOIN compra_det cd ON cd.compra_id = c.id
-GROUP BY c.id, c.fecha, c.proveedor_id;
+SELECT c.id, c.fecha, c.proveedor_id, c.total_crc
+FROM compra c;
 
 CREATE OR REPLACE VIEW v_venta_totales AS
-SELECT
-  v.id, v.fecha, v.cliente_id, v.ruta_id,
-  SUM((vd.precio_unitario_crc * vd.cantidad) - vd.descuento_crc) AS total_crc
-FROM venta v
-LEFT JOIN venta_det vd ON vd.venta_id = v.id
-GROUP BY v.id, v.fecha, v.cliente_id, v.ruta_id;
+SELECT v.id, v.fecha, v.cliente_id, v.ruta_id, v.total_crc
+FROM venta v;
 
 -- Sugerencias por frecuencia
 CREATE OR REPLACE VIEW v_producto_sugerencias AS
@@ -667,29 +798,21 @@ JOIN ruta_entrega re ON re.ruta_id = r.id
 JOIN cliente c       ON c.id = re.cliente_id
 ORDER BY r.id, re.orden;
 
--- Resumen por movimientos (últimas entradas/salidas + saldo por kardex)
+-- Resumen por movimientos (últimas entradas/salidas + saldo por kardex, vía inv_saldo)
 CREATE OR REPLACE VIEW v_inventario_resumen AS
 SELECT
   p.id AS producto_id, p.sku, p.nombre, p.tipo,
-  MAX(CASE WHEN im.tipo='IN'  THEN im.fecha END)  AS ultima_entrada,
-  MAX(CASE WHEN im.tipo='OUT' THEN im.fecha END)  AS ultima_salida,
-  SUM(CASE WHEN im.tipo='IN'  THEN im.cantidad ELSE 0 END)
-  - SUM(CASE WHEN im.tipo='OUT' THEN im.cantidad ELSE 0 END) AS existencias_mov
+  MAX(s.ultima_entrada) AS ultima_entrada,
+  MAX(s.ultima_salida)  AS ultima_salida,
+  COALESCE(SUM(s.existencias), 0) AS existencias_mov
 FROM producto p
-LEFT JOIN inv_mov im ON im.producto_id = p.id
+LEFT JOIN inv_saldo s ON s.producto_id = p.id
 GROUP BY p.id, p.sku, p.nombre, p.tipo;
 
 -- Último costo de compra por producto
 CREATE OR REPLACE VIEW v_ultimo_costo_compra AS
-SELECT
-  cd.producto_id,
-  CAST(SUBSTRING_INDEX(
-    GROUP_CONCAT(cd.costo_unitario_crc ORDER BY c.fecha DESC, cd.id DESC),
-    ',', 1
-  ) AS DECIMAL(18,6)) AS costo_unitario_crc
-FROM compra_det cd
-JOIN compra c ON c.id = cd.compra_id
-GROUP BY cd.producto_id;
+SELECT mc.producto_id, mc.ultimo_costo_crc AS costo_unitario_crc
+FROM mp_costo mc;
 
 -- Costo directo por receta
 CREATE OR REPLACE VIEW v_costo_receta_directo AS
@@ -802,14 +925,15 @@ JOIN v_compra_totales ct ON ct.id = c.id
 GROUP BY c.fecha
 ORDER BY c.fecha DESC;
 
+-- Margen por mes con el costo congelado en venta_det (ver /reportes/margen)
 CREATE OR REPLACE VIEW v_margen_directo_mes AS
 SELECT
   DATE_FORMAT(v.fecha,'%Y-%m') AS ym,
-  SUM(vt.total_crc) AS ventas_crc,
-  COALESCE((SELECT SUM(crd.costo_directo_crc) FROM v_costo_receta_directo crd),0) AS costo_directo_crc_aprox,
-  SUM(vt.total_crc) - COALESCE((SELECT SUM(crd.costo_directo_crc) FROM v_costo_receta_directo crd),0) AS margen_directo_crc
+  SUM(d.cantidad * d.precio_unitario_crc - d.descuento_crc) AS ventas_crc,
+  SUM(d.cantidad * COALESCE(d.costo_unitario_crc, 0)) AS costo_directo_crc_aprox,
+  SUM(d.cantidad * (d.precio_unitario_crc - COALESCE(d.costo_unitario_crc, 0)) - d.descuento_crc) AS margen_directo_crc
 FROM venta v
-JOIN v_venta_totales vt ON vt.id = v.id
+JOIN venta_det d ON d.venta_id = v.id
 GROUP BY ym
 ORDER BY ym DESC;
 
@@ -832,7 +956,7 @@ CREATE TABLE IF NOT EXISTS costo_indirecto (
 
 CREATE TABLE IF NOT EXISTS config_costeo (
   id TINYINT PRIMARY KEY DEFAULT 1,
-  metodo ENUM('PCT_DIRECTO','POR_HORA','POR_UNIDAD') NOT NULL DEFAULT 'PCT_DIRECTO',
+  metodo ENUM('PCT_DIRECTO','POR_HORA','POR_UNIDAD','PORCENTAJE_GLOBAL') NOT NULL DEFAULT 'PCT_DIRECTO',
   parametro_json JSON NULL,     -- ej: {"porcentaje":0.18} o {"tarifa_h":2500} o {"tarifa_unidad":35}
   updated_at TIMESTAMP NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP
 ) ENGINE=InnoDB;
@@ -843,13 +967,11 @@ VALUES (1, 'PCT_DIRECTO', JSON_OBJECT('porcentaje', NULL)); -- NULL => se calcul
 -- 2) Costo promedio de MP (basado en compras)
 CREATE OR REPLACE VIEW v_mp_costo_promedio AS
 SELECT
-  cd.producto_id,
-  CASE WHEN SUM(cd.cantidad) > 0
-       THEN SUM((cd.costo_unitario_crc * cd.cantidad) - cd.descuento_crc) / SUM(cd.cantidad)
+  mc.producto_id,
+  CASE WHEN mc.cantidad_acum > 0
+       THEN (mc.costo_acum_crc - mc.descuento_acum_crc) / mc.cantidad_acum
        ELSE 0 END AS costo_prom_crc
-FROM compra_det cd
-JOIN compra c ON c.id = cd.compra_id
-GROUP BY cd.producto_id;
+FROM mp_costo mc;
 
 -- 3) Costo directo por receta (componentes MP * costo promedio)
 CREATE OR REPLACE VIEW v_costo_receta_directo AS
@@ -1012,32 +1134,75 @@ SET @sql := IF (
 );
 PREPARE stmt FROM @sql; EXECUTE stmt; DEALLOCATE PREPARE stmt;
 
+-- ============= 1.1) Conversiones de uom =============
+-- Tras cargar conversiones con datos existentes: python -m app.cli rebuild-costos / rebuild-saldos
+CREATE TABLE IF NOT EXISTS uom_conversion (
+  id BIGINT PRIMARY KEY AUTO_INCREMENT,
+  producto_id BIGINT NULL,
+  producto_key BIGINT AS (COALESCE(producto_id, 0)) STORED,
+  uom_origen_id BIGINT NOT NULL,
+  uom_destino_id BIGINT NOT NULL,
+  factor DECIMAL(24,12) NOT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
+  UNIQUE KEY uq_uomconv (producto_key, uom_origen_id, uom_destino_id),
+  CONSTRAINT fk_uomconv_producto FOREIGN KEY (producto_id) REFERENCES producto(id) ON DELETE CASCADE,
+  CONSTRAINT fk_uomconv_origen FOREIGN KEY (uom_origen_id) REFERENCES uom(id),
+  CONSTRAINT fk_uomconv_destino FOREIGN KEY (uom_destino_id) REFERENCES uom(id),
+  CONSTRAINT ck_uomconv_factor CHECK (factor > 0)
+) ENGINE=InnoDB;
+
+INSERT IGNORE INTO uom_conversion (producto_id, uom_origen_id, uom_destino_id, factor)
+SELECT NULL, kg.id, g.id, 1000
+FROM uom kg JOIN uom g ON g.codigo = 'G'
+WHERE kg.codigo = 'KG';
+
 -- ================== 2) Vistas de costo de MP ==================
+-- 2.0 Indice mantenido de costos por MP (mp_costo) + carga inicial
+CREATE TABLE IF NOT EXISTS mp_costo (
+  producto_id BIGINT PRIMARY KEY,
+  ultimo_costo_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  ultima_fecha DATE NULL,
+  ultimo_det_id BIGINT NULL,
+  cantidad_acum DECIMAL(24,6) NOT NULL DEFAULT 0,
+  costo_acum_crc DECIMAL(24,6) NOT NULL DEFAULT 0,
+  descuento_acum_crc DECIMAL(24,6) NOT NULL DEFAULT 0,
+  costo_promedio_crc DECIMAL(18,6) AS (
+    CASE WHEN cantidad_acum > 0 THEN costo_acum_crc / cantidad_acum ELSE NULL END
+  ) STORED,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  CONSTRAINT fk_mpcosto_producto FOREIGN KEY (producto_id) REFERENCES producto(id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+DELETE FROM mp_costo;
+INSERT INTO mp_costo (producto_id, ultimo_costo_crc, ultima_fecha, ultimo_det_id,
+                      cantidad_acum, costo_acum_crc, descuento_acum_crc)
+SELECT a.producto_id, u.costo_unitario_crc, u.fecha, u.id,
+       a.cantidad_acum, a.costo_acum_crc, a.descuento_acum_crc
+FROM (
+  SELECT producto_id,
+         SUM(cantidad) AS cantidad_acum,
+         SUM(cantidad * costo_unitario_crc) AS costo_acum_crc,
+         SUM(descuento_crc) AS descuento_acum_crc
+  FROM compra_det
+  GROUP BY producto_id
+) a
+JOIN (
+  SELECT d.producto_id, d.id, c.fecha, d.costo_unitario_crc,
+         ROW_NUMBER() OVER (PARTITION BY d.producto_id ORDER BY c.fecha DESC, d.id DESC) AS rn
+  FROM compra_det d
+  JOIN compra c ON c.id = d.compra_id
+) u ON u.producto_id = a.producto_id AND u.rn = 1;
+
 -- 2.1 Último costo registrado por MP (en CRC)
 CREATE OR REPLACE VIEW v_costo_mp_ultimo AS
-SELECT
-  cd.producto_id,
-  CAST(
-    SUBSTRING_INDEX(
-      GROUP_CONCAT(cd.costo_unitario_crc ORDER BY c.fecha DESC, cd.id DESC),
-      ',', 1
-    ) AS DECIMAL(18,6)
-  ) AS costo_unitario_crc
-FROM compra_det cd
-JOIN compra c ON c.id = cd.compra_id
-GROUP BY cd.producto_id;
+SELECT mc.producto_id, mc.ultimo_costo_crc AS costo_unitario_crc
+FROM mp_costo mc;
 
 -- 2.2 Promedio ponderado histórico por MP
 CREATE OR REPLACE VIEW v_costo_mp_promedio AS
-SELECT
-  cd.producto_id,
-  CASE
-    WHEN SUM(cd.cantidad) > 0
-      THEN CAST(SUM(cd.costo_unitario_crc * cd.cantidad) / SUM(cd.cantidad) AS DECIMAL(18,6))
-    ELSE NULL
-  END AS costo_unitario_crc
-FROM compra_det cd
-GROUP BY cd.producto_id;
+SELECT mc.producto_id, mc.costo_promedio_crc AS costo_unitario_crc
+FROM mp_costo mc;
 
 -- 2.3 Costo “actual” por MP: último -> promedio -> costo_estandar -> 0
 CREATE OR REPLACE VIEW v_costo_mp_actual AS
@@ -1092,6 +1257,7 @@ LEFT JOIN v_receta_rendimiento r ON r.receta_id = d.receta_id
 GROUP BY d.receta_id, r.rendimiento_total;
 
 -- ========= 4) Función costo MP “a la fecha” (para tandas/valorizar) =========
+-- Nota: la API usa services/cost_history.py (mismo criterio, en lote) para no invocarla por fila.
 DROP FUNCTION IF EXISTS fn_costo_mp_al;
 DELIMITER $$
 CREATE FUNCTION fn_costo_mp_al(fecha_ref DATE, mp_id BIGINT)
@@ -1145,6 +1311,46 @@ DROP TRIGGER IF EXISTS trg_tconsumo_only_mp;
 DROP TRIGGER IF EXISTS trg_tconsumo_only_mp_upd;
 DROP TRIGGER IF EXISTS trg_tsalida_only_pt;
 DROP TRIGGER IF EXISTS trg_tsalida_only_pt_upd;
+DROP TRIGGER IF EXISTS trg_compra_det_total_ins;
+DROP TRIGGER IF EXISTS trg_compra_det_total_upd;
+DROP TRIGGER IF EXISTS trg_compra_det_total_del;
+DROP TRIGGER IF EXISTS trg_venta_det_total_ins;
+DROP TRIGGER IF EXISTS trg_venta_det_total_upd;
+DROP TRIGGER IF EXISTS trg_venta_det_total_del;
+
+-- Totales por cabecera (compra/venta.total_crc y lineas)
+SET @sql := IF (
+  (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+   WHERE TABLE_SCHEMA = DATABASE()
+     AND TABLE_NAME = 'compra'
+     AND COLUMN_NAME = 'total_crc') = 0,
+  'ALTER TABLE compra ADD COLUMN total_crc DECIMAL(18,6) NOT NULL DEFAULT 0 AFTER nota, ADD COLUMN lineas INT NOT NULL DEFAULT 0 AFTER total_crc;',
+  'SELECT 1;'
+); PREPARE stmt_compra_total FROM @sql; EXECUTE stmt_compra_total; DEALLOCATE PREPARE stmt_compra_total;
+
+SET @sql := IF (
+  (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+   WHERE TABLE_SCHEMA = DATABASE()
+     AND TABLE_NAME = 'venta'
+     AND COLUMN_NAME = 'total_crc') = 0,
+  'ALTER TABLE venta ADD COLUMN total_crc DECIMAL(18,6) NOT NULL DEFAULT 0 AFTER nota, ADD COLUMN lineas INT NOT NULL DEFAULT 0 AFTER total_crc;',
+  'SELECT 1;'
+); PREPARE stmt_venta_total FROM @sql; EXECUTE stmt_venta_total; DEALLOCATE PREPARE stmt_venta_total;
+
+-- Carga inicial (equivale a `python -m app.cli rebuild-totales`)
+UPDATE compra c
+LEFT JOIN (
+  SELECT compra_id, SUM(cantidad * costo_unitario_crc - COALESCE(descuento_crc, 0)) AS total, COUNT(*) AS n
+  FROM compra_det GROUP BY compra_id
+) d ON d.compra_id = c.id
+SET c.total_crc = COALESCE(d.total, 0), c.lineas = COALESCE(d.n, 0);
+
+UPDATE venta v
+LEFT JOIN (
+  SELECT venta_id, SUM(cantidad * precio_unitario_crc - COALESCE(descuento_crc, 0)) AS total, COUNT(*) AS n
+  FROM venta_det GROUP BY venta_id
+) d ON d.venta_id = v.id
+SET v.total_crc = COALESCE(d.total, 0), v.lineas = COALESCE(d.n, 0);
 
 DELIMITER $$
 
@@ -1240,6 +1446,75 @@ BEGIN
   END IF;
 END$$
 
+-- COMPRA_DET / VENTA_DET: mantienen total_crc y lineas de la cabecera
+CREATE TRIGGER trg_compra_det_total_ins
+AFTER INSERT ON compra_det
+FOR EACH ROW
+BEGIN
+  UPDATE compra
+     SET total_crc = total_crc + (NEW.cantidad * NEW.costo_unitario_crc - COALESCE(NEW.descuento_crc, 0)),
+         lineas = lineas + 1
+   WHERE id = NEW.compra_id;
+END$$
+
+CREATE TRIGGER trg_compra_det_total_upd
+AFTER UPDATE ON compra_det
+FOR EACH ROW
+BEGIN
+  UPDATE compra
+     SET total_crc = total_crc - (OLD.cantidad * OLD.costo_unitario_crc - COALESCE(OLD.descuento_crc, 0)),
+         lineas = lineas - 1
+   WHERE id = OLD.compra_id;
+  UPDATE compra
+     SET total_crc = total_crc + (NEW.cantidad * NEW.costo_unitario_crc - COALESCE(NEW.descuento_crc, 0)),
+         lineas = lineas + 1
+   WHERE id = NEW.compra_id;
+END$$
+
+CREATE TRIGGER trg_compra_det_total_del
+AFTER DELETE ON compra_det
+FOR EACH ROW
+BEGIN
+  UPDATE compra
+     SET total_crc = total_crc - (OLD.cantidad * OLD.costo_unitario_crc - COALESCE(OLD.descuento_crc, 0)),
+         lineas = lineas - 1
+   WHERE id = OLD.compra_id;
+END$$
+
+CREATE TRIGGER trg_venta_det_total_ins
+AFTER INSERT ON venta_det
+FOR EACH ROW
+BEGIN
+  UPDATE venta
+     SET total_crc = total_crc + (NEW.cantidad * NEW.precio_unitario_crc - COALESCE(NEW.descuento_crc, 0)),
+         lineas = lineas + 1
+   WHERE id = NEW.venta_id;
+END$$
+
+CREATE TRIGGER trg_venta_det_total_upd
+AFTER UPDATE ON venta_det
+FOR EACH ROW
+BEGIN
+  UPDATE venta
+     SET total_crc = total_crc - (OLD.cantidad * OLD.precio_unitario_crc - COALESCE(OLD.descuento_crc, 0)),
+         lineas = lineas - 1
+   WHERE id = OLD.venta_id;
+  UPDATE venta
+     SET total_crc = total_crc + (NEW.cantidad * NEW.precio_unitario_crc - COALESCE(NEW.descuento_crc, 0)),
+         lineas = lineas + 1
+   WHERE id = NEW.venta_id;
+END$$
+
+CREATE TRIGGER trg_venta_det_total_del
+AFTER DELETE ON venta_det
+FOR EACH ROW
+BEGIN
+  UPDATE venta
+     SET total_crc = total_crc - (OLD.cantidad * OLD.precio_unitario_crc - COALESCE(OLD.descuento_crc, 0)),
+         lineas = lineas - 1
+   WHERE id = OLD.venta_id;
+END$$
+
 DELIMITER ;
 
 SET @sql := IF (
@@ -1279,13 +1554,234 @@ SET @sql := IF (
 
 CREATE TABLE IF NOT EXISTS config_costeo (
   id TINYINT PRIMARY KEY DEFAULT 1,
-  metodo ENUM('PORCENTAJE_GLOBAL') NOT NULL DEFAULT 'PORCENTAJE_GLOBAL',
-  parametro_json JSON NULL, -- { "pct": 0.18 }
+  metodo ENUM('PCT_DIRECTO','POR_HORA','POR_UNIDAD','PORCENTAJE_GLOBAL') NOT NULL DEFAULT 'PORCENTAJE_GLOBAL',
+  parametro_json JSON NULL, -- { "pct": 0.18 } o { "tarifa_h": 2500 } o { "tarifa_unidad": 35 }
   updated_at TIMESTAMP NULL DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP
 );
 
+-- Bases existentes: admitir los metodos de asignacion de /finanzas/config/indirectos
+ALTER TABLE config_costeo
+  MODIFY metodo ENUM('PCT_DIRECTO','POR_HORA','POR_UNIDAD','PORCENTAJE_GLOBAL') NOT NULL DEFAULT 'PORCENTAJE_GLOBAL';
+
 INSERT IGNORE INTO config_costeo (id, metodo, parametro_json)
 VALUES (1, 'PORCENTAJE_GLOBAL', JSON_OBJECT('pct', 0.18));
 
+-- ============= Saldos de inventario (inv_saldo) =============
+SET @sql := IF (
+  (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+   WHERE TABLE_SCHEMA = DATABASE()
+     AND TABLE_NAME = 'inv_mov'
+     AND COLUMN_NAME = 'costo_unitario_crc') = 0,
+  'ALTER TABLE inv_mov ADD COLUMN costo_unitario_crc DECIMAL(18,6) NULL AFTER nota;',
+  'SELECT 1;'
+); PREPARE stmt_imov_costo FROM @sql; EXECUTE stmt_imov_costo; DEALLOCATE PREPARE stmt_imov_costo;
+
+CREATE TABLE IF NOT EXISTS inv_saldo (
+  producto_id BIGINT NOT NULL,
+  ubicacion_id BIGINT NOT NULL DEFAULT 0,
+  existencias DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_compra DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_produccion DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_consumo DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_venta DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_merma DECIMAL(18,6) NOT NULL DEFAULT 0,
+  total_ajuste DECIMAL(18,6) NOT NULL DEFAULT 0,
+  ultima_entrada DATETIME NULL,
+  ultima_salida DATETIME NULL,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (producto_id, ubicacion_id),
+  CONSTRAINT fk_isaldo_producto FOREIGN KEY (producto_id) REFERENCES producto(id) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- Carga inicial desde el kardex (equivale a `python -m app.cli rebuild-saldos`)
+DELETE FROM inv_saldo;
+INSERT INTO inv_saldo (producto_id, ubicacion_id, existencias,
+                       total_compra, total_produccion, total_consumo, total_venta, total_merma, total_ajuste,
+                       ultima_entrada, ultima_salida)
+SELECT m.producto_id, COALESCE(m.ubicacion_id, 0),
+       SUM(CASE WHEN m.tipo='IN' THEN m.cantidad WHEN m.tipo='OUT' THEN -m.cantidad ELSE 0 END),
+       SUM(CASE WHEN m.motivo='COMPRA' THEN m.cantidad ELSE 0 END),
+       SUM(CASE WHEN m.motivo='PRODUCCION_SALIDA' THEN m.cantidad ELSE 0 END),
+       SUM(CASE WHEN m.motivo='CONSUMO_RECETA' THEN m.cantidad ELSE 0 END),
+       SUM(CASE WHEN m.motivo='VENTA' THEN m.cantidad ELSE 0 END),
+       SUM(CASE WHEN m.motivo='MERMA' THEN m.cantidad ELSE 0 END),
+       SUM(CASE WHEN m.motivo='AJUSTE' THEN m.cantidad ELSE 0 END),
+       MAX(CASE WHEN m.tipo='IN' THEN m.fecha END),
+       MAX(CASE WHEN m.tipo='OUT' THEN m.fecha END)
+FROM inv_mov m
+GROUP BY m.producto_id, COALESCE(m.ubicacion_id, 0);
+
+CREATE OR REPLACE VIEW v_inventario_resumen AS
+SELECT
+  p.id AS producto_id, p.sku, p.nombre, p.tipo,
+  MAX(s.ultima_entrada) AS ultima_entrada,
+  MAX(s.ultima_salida)  AS ultima_salida,
+  COALESCE(SUM(s.existencias), 0) AS existencias_mov
+FROM producto p
+LEFT JOIN inv_saldo s ON s.producto_id = p.id
+GROUP BY p.id, p.sku, p.nombre, p.tipo;
+
+-- ============= Varianzas de produccion =============
+SET @sql := IF (
+  (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+   WHERE TABLE_SCHEMA = DATABASE()
+     AND TABLE_NAME = 'tanda'
+     AND COLUMN_NAME = 'cantidad_tandas') = 0,
+  'ALTER TABLE tanda ADD COLUMN cantidad_tandas DECIMAL(12,4) NOT NULL DEFAULT 1 AFTER receta_id;',
+  'SELECT 1;'
+); PREPARE stmt_tanda_cant FROM @sql; EXECUTE stmt_tanda_cant; DEALLOCATE PREPARE stmt_tanda_cant;
+
+-- Varianzas de tandas contra el estandar de su receta (cache por mes cerrado; la llena /produccion/varianzas).
+-- tipo CONSUMO: (real - estandar) x costo de la MP; tipo SALIDA: (estandar - real) x unitario estandar.
+-- Cantidades en uom base; varianza_crc > 0 es desfavorable.
+CREATE TABLE IF NOT EXISTS varianza_mes (
+  mes CHAR(7) PRIMARY KEY,
+  calculado_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS varianza_tanda (
+  tanda_id BIGINT NOT NULL,
+  tipo ENUM('CONSUMO','SALIDA') NOT NULL,
+  producto_id BIGINT NOT NULL,
+  mes CHAR(7) NOT NULL,
+  fecha DATE NOT NULL,
+  receta_id BIGINT NOT NULL,
+  cantidad_tandas DECIMAL(12,4) NOT NULL,
+  cantidad_real DECIMAL(18,6) NOT NULL,
+  cantidad_std DECIMAL(18,6) NOT NULL,
+  costo_unitario_crc DECIMAL(18,6) NOT NULL,
+  varianza_crc DECIMAL(18,6) NOT NULL,
+  PRIMARY KEY (tanda_id, tipo, producto_id),
+  KEY ix_vtanda_mes (mes, receta_id),
+  CONSTRAINT fk_vtanda_mes FOREIGN KEY (mes) REFERENCES varianza_mes(mes) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- ============= Costo de lo vendido (venta_det.costo_unitario_crc) =============
+-- Lo congela la app al vender; `python -m app.cli costear-ventas` llena las lineas previas.
+SET @sql := IF (
+  (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+   WHERE TABLE_SCHEMA = DATABASE()
+     AND TABLE_NAME = 'venta_det'
+     AND COLUMN_NAME = 'costo_unitario_crc') = 0,
+  'ALTER TABLE venta_det ADD COLUMN costo_unitario_crc DECIMAL(18,6) NULL AFTER descuento_crc;',
+  'SELECT 1;'
+); PREPARE stmt_vdet_costo FROM @sql; EXECUTE stmt_vdet_costo; DEALLOCATE PREPARE stmt_vdet_costo;
 
+-- Margen por mes con el costo congelado en venta_det (ver /reportes/margen)
+CREATE OR REPLACE VIEW v_margen_directo_mes AS
+SELECT
+  DATE_FORMAT(v.fecha,'%Y-%m') AS ym,
+  SUM(d.cantidad * d.precio_unitario_crc - d.descuento_crc) AS ventas_crc,
+  SUM(d.cantidad * COALESCE(d.costo_unitario_crc, 0)) AS costo_directo_crc_aprox,
+  SUM(d.cantidad * (d.precio_unitario_crc - COALESCE(d.costo_unitario_crc, 0)) - d.descuento_crc) AS margen_directo_crc
+FROM venta v
+JOIN venta_det d ON d.venta_id = v.id
+GROUP BY ym
+ORDER BY ym DESC;
+
+-- ============= Hechos diarios para reportes =============
+-- Los mantiene la app en cada escritura; `python -m app.cli rebuild-hechos` los recalcula.
+-- (hecho_dia sin costo_ventas_crc o hecho_venta sin ruta_id: versiones previas; se recrean y recargan abajo)
+SET @sql := IF (
+  (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+   WHERE TABLE_SCHEMA = DATABASE()
+     AND TABLE_NAME = 'hecho_dia'
+     AND COLUMN_NAME = 'costo_ventas_crc') = 0,
+  'DROP TABLE IF EXISTS hecho_dia;',
+  'SELECT 1;'
+); PREPARE stmt_hdia_costo FROM @sql; EXECUTE stmt_hdia_costo; DEALLOCATE PREPARE stmt_hdia_costo;
+
+SET @sql := IF (
+  (SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+   WHERE TABLE_SCHEMA = DATABASE()
+     AND TABLE_NAME = 'hecho_venta'
+     AND COLUMN_NAME = 'ruta_id') = 0,
+  'DROP TABLE IF EXISTS hecho_venta;',
+  'SELECT 1;'
+); PREPARE stmt_hventa_ruta FROM @sql; EXECUTE stmt_hventa_ruta; DEALLOCATE PREPARE stmt_hventa_ruta;
+
+CREATE TABLE IF NOT EXISTS hecho_dia (
+  fecha DATE PRIMARY KEY,
+  ventas_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  costo_ventas_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  facturas INT NOT NULL DEFAULT 0,
+  compras_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  compras_docs INT NOT NULL DEFAULT 0,
+  gastos_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  gastos_docs INT NOT NULL DEFAULT 0
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS hecho_venta (
+  fecha DATE NOT NULL,
+  cliente_id BIGINT NOT NULL,
+  producto_id BIGINT NOT NULL,
+  ruta_id BIGINT NOT NULL DEFAULT 0,          -- 0 = venta sin ruta
+  cantidad DECIMAL(18,6) NOT NULL DEFAULT 0,  -- uom base del producto
+  total_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  costo_crc DECIMAL(18,6) NOT NULL DEFAULT 0, -- SUM(cantidad * venta_det.costo_unitario_crc)
+  lineas INT NOT NULL DEFAULT 0,
+  lineas_sin_costo INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (fecha, cliente_id, producto_id, ruta_id),
+  KEY ix_hventa_prod (producto_id, fecha),
+  KEY ix_hventa_cli (cliente_id, fecha),
+  KEY ix_hventa_ruta (ruta_id, fecha)
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS hecho_compra (
+  fecha DATE NOT NULL,
+  proveedor_id BIGINT NOT NULL,
+  producto_id BIGINT NOT NULL,
+  cantidad DECIMAL(18,6) NOT NULL DEFAULT 0,  -- uom base del producto
+  total_crc DECIMAL(18,6) NOT NULL DEFAULT 0,
+  lineas INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (fecha, proveedor_id, producto_id),
+  KEY ix_hcompra_prod (producto_id, fecha)
+) ENGINE=InnoDB;
+
+-- Kardex por dia/producto/motivo: produccion (PRODUCCION_SALIDA/CONSUMO_RECETA), merma, etc.
+CREATE TABLE IF NOT EXISTS hecho_inv (
+  fecha DATE NOT NULL,
+  producto_id BIGINT NOT NULL,
+  motivo ENUM('COMPRA','PRODUCCION_SALIDA','CONSUMO_RECETA','VENTA','MERMA','AJUSTE') NOT NULL,
+  cantidad DECIMAL(18,6) NOT NULL DEFAULT 0,  -- uom base del producto
+  movimientos INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (fecha, producto_id, motivo),
+  KEY ix_hinv_motivo (motivo, fecha)
+) ENGINE=InnoDB;
 
+-- Carga inicial (equivale a `python -m app.cli rebuild-hechos`, sin conversion de uom)
+DELETE FROM hecho_dia;
+INSERT INTO hecho_dia (fecha, ventas_crc, costo_ventas_crc, facturas, compras_crc, compras_docs, gastos_crc, gastos_docs)
+SELECT fecha, SUM(v), SUM(cv), SUM(nv), SUM(c), SUM(nc), SUM(g), SUM(ng)
+FROM (
+  SELECT fecha, total_crc AS v, 0 AS cv, 1 AS nv, 0 AS c, 0 AS nc, 0 AS g, 0 AS ng FROM venta
+  UNION ALL SELECT v.fecha, 0, SUM(d.cantidad * d.costo_unitario_crc), 0, 0, 0, 0, 0
+            FROM venta_det d JOIN venta v ON v.id = d.venta_id
+            WHERE d.costo_unitario_crc IS NOT NULL GROUP BY v.fecha
+  UNION ALL SELECT fecha, 0, 0, 0, total_crc, 1, 0, 0 FROM compra
+  UNION ALL SELECT fecha, 0, 0, 0, 0, 0, monto_crc, 1 FROM gasto
+) x
+GROUP BY fecha;
+
+DELETE FROM hecho_venta;
+INSERT INTO hecho_venta (fecha, cliente_id, producto_id, ruta_id, cantidad, total_crc, costo_crc, lineas, lineas_sin_costo)
+SELECT v.fecha, v.cliente_id, d.producto_id, COALESCE(v.ruta_id, 0), SUM(d.cantidad),
+       SUM(d.cantidad * d.precio_unitario_crc - COALESCE(d.descuento_crc, 0)),
+       SUM(d.cantidad * COALESCE(d.costo_unitario_crc, 0)), COUNT(*), SUM(d.costo_unitario_crc IS NULL)
+FROM venta_det d
+JOIN venta v ON v.id = d.venta_id
+GROUP BY v.fecha, v.cliente_id, d.producto_id, COALESCE(v.ruta_id, 0);
+
+DELETE FROM hecho_compra;
+INSERT INTO hecho_compra (fecha, proveedor_id, producto_id, cantidad, total_crc, lineas)
+SELECT c.fecha, c.proveedor_id, d.producto_id, SUM(d.cantidad),
+       SUM(d.cantidad * d.costo_unitario_crc - COALESCE(d.descuento_crc, 0)), COUNT(*)
+FROM compra_det d
+JOIN compra c ON c.id = d.compra_id
+GROUP BY c.fecha, c.proveedor_id, d.producto_id;
+
+DELETE FROM hecho_inv;
+INSERT INTO hecho_inv (fecha, producto_id, motivo, cantidad, movimientos)
+SELECT DATE(fecha), producto_id, motivo, SUM(cantidad), COUNT(*)
+FROM inv_mov
+GROUP BY DATE(fecha), producto_id, motivo;
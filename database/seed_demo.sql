@@ -16,9 +16,17 @@ VALUES
   ('KG', 'Kilogramo'),
   ('G',  'Gramo'),
   ('LT', 'Litro'),
-  ('UN', 'Unidad')
+  ('UN', 'Unidad'),
+  ('ML', 'Mililitro')
 ON DUPLICATE KEY UPDATE nombre = VALUES(nombre);
 
+-- 1 KG = 1000 G, 1 LT = 1000 ML (genericas)
+INSERT INTO uom_conversion (producto_id, uom_origen_id, uom_destino_id, factor)
+SELECT NULL, o.id, d.id, 1000
+FROM uom o
+JOIN uom d ON (o.codigo, d.codigo) IN (('KG', 'G'), ('LT', 'ML'))
+ON DUPLICATE KEY UPDATE factor = VALUES(factor);
+
 -- ----------------------------------------------------------------------
 -- Application users
 -- ----------------------------------------------------------------------
@@ -925,6 +933,86 @@ ON DUPLICATE KEY UPDATE
   motivo = VALUES(motivo),
   nota = VALUES(nota);
 
+-- ----------------------------------------------------------------------
+-- Derived tables (the app maintains them on writes; demo rows bypass the API)
+-- Demo purchases use each product's base uom, so no conversion is applied here;
+-- otherwise run `python -m app.cli rebuild-costos` and `rebuild-saldos`.
+-- ----------------------------------------------------------------------
+-- total_crc/lineas de cabecera: los triggers ya los llevan; se recalculan por si el detalle
+-- se cargo antes de crear los triggers (equivale a `python -m app.cli rebuild-totales`)
+UPDATE venta v
+LEFT JOIN (
+  SELECT venta_id, SUM(cantidad * precio_unitario_crc - COALESCE(descuento_crc, 0)) AS total, COUNT(*) AS n
+  FROM venta_det GROUP BY venta_id
+) d ON d.venta_id = v.id
+SET v.total_crc = COALESCE(d.total, 0), v.lineas = COALESCE(d.n, 0);
+
+UPDATE compra c
+LEFT JOIN (
+  SELECT compra_id, SUM(cantidad * costo_unitario_crc - COALESCE(descuento_crc, 0)) AS total, COUNT(*) AS n
+  FROM compra_det GROUP BY compra_id
+) d ON d.compra_id = c.id
+SET c.total_crc = COALESCE(d.total, 0), c.lineas = COALESCE(d.n, 0);
+
+DELETE FROM mp_costo;
+INSERT INTO mp_costo (producto_id, ultimo_costo_crc, ultima_fecha, ultimo_det_id,
+                      cantidad_acum, costo_acum_crc, descuento_acum_crc)
+SELECT a.producto_id, u.costo_unitario_crc, u.fecha, u.id,
+       a.cantidad_acum, a.costo_acum_crc, a.descuento_acum_crc
+FROM (
+  SELECT producto_id,
+         SUM(cantidad) AS cantidad_acum,
+         SUM(cantidad * costo_unitario_crc) AS costo_acum_crc,
+         SUM(descuento_crc) AS descuento_acum_crc
+  FROM compra_det
+  GROUP BY producto_id
+) a
+JOIN (
+  SELECT d.producto_id, d.id, c.fecha, d.costo_unitario_crc,
+         ROW_NUMBER() OVER (PARTITION BY d.producto_id ORDER BY c.fecha DESC, d.id DESC) AS rn
+  FROM compra_det d
+  JOIN compra c ON c.id = d.compra_id
+) u ON u.producto_id = a.producto_id AND u.rn = 1;
+
+-- Hechos diarios de reportes (equivale a `python -m app.cli rebuild-hechos`)
+-- Las lineas de venta demo quedan sin costo congelado: `python -m app.cli costear-ventas`
+-- las costea con el motor de recetas y recarga estos hechos.
+DELETE FROM hecho_dia;
+INSERT INTO hecho_dia (fecha, ventas_crc, costo_ventas_crc, facturas, compras_crc, compras_docs, gastos_crc, gastos_docs)
+SELECT fecha, SUM(v), SUM(cv), SUM(nv), SUM(c), SUM(nc), SUM(g), SUM(ng)
+FROM (
+  SELECT fecha, total_crc AS v, 0 AS cv, 1 AS nv, 0 AS c, 0 AS nc, 0 AS g, 0 AS ng FROM venta
+  UNION ALL SELECT v.fecha, 0, SUM(d.cantidad * d.costo_unitario_crc), 0, 0, 0, 0, 0
+            FROM venta_det d JOIN venta v ON v.id = d.venta_id
+            WHERE d.costo_unitario_crc IS NOT NULL GROUP BY v.fecha
+  UNION ALL SELECT fecha, 0, 0, 0, total_crc, 1, 0, 0 FROM compra
+  UNION ALL SELECT fecha, 0, 0, 0, 0, 0, monto_crc, 1 FROM gasto
+) x
+GROUP BY fecha;
+
+DELETE FROM hecho_venta;
+INSERT INTO hecho_venta (fecha, cliente_id, producto_id, ruta_id, cantidad, total_crc, costo_crc, lineas, lineas_sin_costo)
+SELECT v.fecha, v.cliente_id, d.producto_id, COALESCE(v.ruta_id, 0), SUM(d.cantidad),
+       SUM(d.cantidad * d.precio_unitario_crc - COALESCE(d.descuento_crc, 0)),
+       SUM(d.cantidad * COALESCE(d.costo_unitario_crc, 0)), COUNT(*), SUM(d.costo_unitario_crc IS NULL)
+FROM venta_det d
+JOIN venta v ON v.id = d.venta_id
+GROUP BY v.fecha, v.cliente_id, d.producto_id, COALESCE(v.ruta_id, 0);
+
+DELETE FROM hecho_compra;
+INSERT INTO hecho_compra (fecha, proveedor_id, producto_id, cantidad, total_crc, lineas)
+SELECT c.fecha, c.proveedor_id, d.producto_id, SUM(d.cantidad),
+       SUM(d.cantidad * d.costo_unitario_crc - COALESCE(d.descuento_crc, 0)), COUNT(*)
+FROM compra_det d
+JOIN compra c ON c.id = d.compra_id
+GROUP BY c.fecha, c.proveedor_id, d.producto_id;
+
+DELETE FROM hecho_inv;
+INSERT INTO hecho_inv (fecha, producto_id, motivo, cantidad, movimientos)
+SELECT DATE(fecha), producto_id, motivo, SUM(cantidad), COUNT(*)
+FROM inv_mov
+GROUP BY DATE(fecha), producto_id, motivo;
+
 COMMIT;
 
 SELECT 'Demo data ready' AS status_message;